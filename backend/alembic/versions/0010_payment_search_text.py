@@ -0,0 +1,51 @@
+"""payment search text for transactions feed
+
+Revision ID: 0010_payment_search_text
+Revises: 0009_inventory_and_product_ext
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010_payment_search_text"
+down_revision = "0009_inventory_and_product_ext"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("payment") as batch_op:
+        batch_op.add_column(sa.Column("search_text", sa.String(length=1000), nullable=True))
+
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.text(
+            "SELECT p.id, p.note, c.name AS customer_name, s.sale_no "
+            "FROM payment p JOIN customer c ON c.id = p.customer_id "
+            "LEFT JOIN sale s ON s.id = p.sale_id"
+        )
+    ).fetchall()
+    alloc_rows = conn.execute(
+        sa.text(
+            "SELECT a.payment_id, s.sale_no FROM payment_allocation a "
+            "JOIN sale s ON s.id = a.sale_id ORDER BY a.payment_id, s.sale_date ASC, s.id ASC"
+        )
+    ).fetchall()
+    alloc_map = {}
+    for row in alloc_rows:
+        alloc_map.setdefault(row.payment_id, []).append(row.sale_no)
+
+    for row in rows:
+        sale_nos = [row.sale_no] if row.sale_no else []
+        for no in alloc_map.get(row.id, []):
+            if no not in sale_nos:
+                sale_nos.append(no)
+        parts = [row.customer_name or "", *sale_nos, row.note or ""]
+        text = " ".join(x for x in parts if x).lower()[:1000]
+        conn.execute(sa.text("UPDATE payment SET search_text = :t WHERE id = :id"), {"t": text, "id": row.id})
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("payment") as batch_op:
+        batch_op.drop_column("search_text")
@@ -0,0 +1,47 @@
+"""persisted gross profit and unit cost snapshot
+
+Revision ID: 0011_sale_gross_profit
+Revises: 0010_payment_search_text
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011_sale_gross_profit"
+down_revision = "0010_payment_search_text"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("sale_item") as batch_op:
+        batch_op.add_column(sa.Column("unit_cost", sa.Float(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("gross_profit", sa.Float(), nullable=False, server_default="0"))
+    with op.batch_alter_table("sale") as batch_op:
+        batch_op.add_column(sa.Column("gross_profit", sa.Float(), nullable=False, server_default="0"))
+
+    # 回填：历史单据没有成本快照，只能取当前标准成本
+    op.execute(
+        "UPDATE sale_item SET unit_cost = COALESCE((SELECT p.standard_cost FROM product p WHERE p.id = sale_item.product_id), 0)"
+    )
+    op.execute(
+        "UPDATE sale_item SET gross_profit = ROUND("
+        "((CASE WHEN unit_price <> 0 THEN unit_price ELSE sold_price END) - unit_cost) * qty, 2)"
+    )
+    op.execute(
+        "UPDATE sale_item SET gross_profit = 0 WHERE sale_id IN ("
+        "SELECT id FROM sale WHERE biz_status = 'VOIDED' "
+        "UNION SELECT sale_id FROM sale_operation WHERE op_type = 'RETURN')"
+    )
+    op.execute(
+        "UPDATE sale SET gross_profit = ROUND(COALESCE((SELECT SUM(si.gross_profit) FROM sale_item si WHERE si.sale_id = sale.id), 0), 2)"
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("sale") as batch_op:
+        batch_op.drop_column("gross_profit")
+    with op.batch_alter_table("sale_item") as batch_op:
+        batch_op.drop_column("gross_profit")
+        batch_op.drop_column("unit_cost")
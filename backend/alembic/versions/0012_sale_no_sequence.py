@@ -0,0 +1,39 @@
+"""per-day sale number sequence
+
+Revision ID: 0012_sale_no_sequence
+Revises: 0011_sale_gross_profit
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0012_sale_no_sequence"
+down_revision = "0011_sale_gross_profit"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sale_no_sequence",
+        sa.Column("prefix", sa.String(length=20), primary_key=True, nullable=False),
+        sa.Column("last_seq", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+    # 按已有单号回填每天的最大流水号（单号格式 SOyyyymmdd-NNNN）
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT sale_no FROM sale WHERE sale_no LIKE 'SO%-%'")).fetchall()
+    last = {}
+    for row in rows:
+        prefix, _, seq_str = row.sale_no.rpartition("-")
+        if not seq_str.isdigit():
+            continue
+        key = f"{prefix}-"
+        last[key] = max(last.get(key, 0), int(seq_str))
+    for prefix, seq in last.items():
+        conn.execute(sa.text("INSERT INTO sale_no_sequence (prefix, last_seq) VALUES (:p, :s)"), {"p": prefix, "s": seq})
+
+
+def downgrade() -> None:
+    op.drop_table("sale_no_sequence")
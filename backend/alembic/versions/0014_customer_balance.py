@@ -0,0 +1,39 @@
+"""customer running balance
+
+Revision ID: 0014_customer_balance
+Revises: 0013_idempotency_key
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0014_customer_balance"
+down_revision = "0013_idempotency_key"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "customer_balance",
+        sa.Column("customer_id", sa.Integer(), sa.ForeignKey("customer.id"), primary_key=True, nullable=False),
+        sa.Column("total_sales", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("total_received", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.func.current_timestamp()),
+    )
+
+    # 按现有单据与收款回填
+    op.execute(
+        """
+        INSERT INTO customer_balance (customer_id, total_sales, total_received)
+        SELECT c.id,
+               COALESCE((SELECT ROUND(SUM(s.total_amount), 2) FROM sale s WHERE s.customer_id = c.id), 0),
+               COALESCE((SELECT ROUND(SUM(p.amount), 2) FROM payment p WHERE p.customer_id = c.id), 0)
+        FROM customer c
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("customer_balance")
@@ -0,0 +1,21 @@
+"""inventory_txn (product_id, created_at) index
+
+Revision ID: 0015_inventory_txn_index
+Revises: 0014_customer_balance
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+
+revision = "0015_inventory_txn_index"
+down_revision = "0014_customer_balance"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_inventory_txn_product_created", "inventory_txn", ["product_id", "created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_inventory_txn_product_created", table_name="inventory_txn")
@@ -0,0 +1,28 @@
+"""monthly inventory snapshots
+
+Revision ID: 0016_inventory_snapshot
+Revises: 0015_inventory_txn_index
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0016_inventory_snapshot"
+down_revision = "0015_inventory_txn_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "inventory_snapshot",
+        sa.Column("month", sa.String(length=7), primary_key=True, nullable=False),
+        sa.Column("product_id", sa.Integer(), sa.ForeignKey("product.id"), primary_key=True, nullable=False),
+        sa.Column("qty", sa.Float(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("inventory_snapshot")
@@ -0,0 +1,37 @@
+"""background export jobs
+
+Revision ID: 0017_export_job
+Revises: 0016_inventory_snapshot
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0017_export_job"
+down_revision = "0016_inventory_snapshot"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "export_job",
+        sa.Column("id", sa.Integer(), primary_key=True, nullable=False),
+        sa.Column("kind", sa.String(length=30), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False, server_default="pending"),
+        sa.Column("params_json", sa.Text(), nullable=True),
+        sa.Column("total", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("done", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("file_path", sa.String(length=500), nullable=True),
+        sa.Column("file_name", sa.String(length=200), nullable=True),
+        sa.Column("error", sa.String(length=500), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_export_job_status", "export_job", ["status"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_export_job_status", table_name="export_job")
+    op.drop_table("export_job")
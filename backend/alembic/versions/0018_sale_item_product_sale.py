@@ -0,0 +1,21 @@
+"""sale_item (product_id, sale_id) covering index
+
+Revision ID: 0018_sale_item_product_sale
+Revises: 0017_export_job
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+
+revision = "0018_sale_item_product_sale"
+down_revision = "0017_export_job"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_sale_item_product_sale", "sale_item", ["product_id", "sale_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_sale_item_product_sale", table_name="sale_item")
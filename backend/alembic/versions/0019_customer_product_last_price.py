@@ -0,0 +1,63 @@
+"""customer/product last price
+
+Revision ID: 0019_customer_product_last_price
+Revises: 0018_sale_item_product_sale
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0019_customer_product_last_price"
+down_revision = "0018_sale_item_product_sale"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "customer_product_last_price",
+        sa.Column("customer_id", sa.Integer(), sa.ForeignKey("customer.id"), primary_key=True, nullable=False),
+        sa.Column("product_id", sa.Integer(), sa.ForeignKey("product.id"), primary_key=True, nullable=False),
+        sa.Column("last_price", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("last_qty", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("last_date", sa.DateTime(), nullable=False),
+        sa.Column("last_sale_id", sa.Integer(), nullable=True),
+        sa.Column("purchase_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.func.current_timestamp()),
+    )
+
+    # 按现有单据回填（不计已作废、已整单退货的单）
+    op.execute(
+        """
+        WITH counted AS (
+            SELECT s.customer_id, si.product_id, si.unit_price, si.sold_price, si.qty,
+                   s.id AS sale_id, s.sale_date, si.id AS item_id
+            FROM sale_item si
+            JOIN sale s ON s.id = si.sale_id
+            WHERE s.biz_status != 'VOIDED'
+              AND NOT EXISTS (SELECT 1 FROM sale_operation o WHERE o.sale_id = s.id AND o.op_type = 'RETURN')
+        ),
+        ranked AS (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY customer_id, product_id ORDER BY sale_date DESC, sale_id DESC, item_id DESC
+            ) AS rn
+            FROM counted
+        ),
+        counts AS (
+            SELECT customer_id, product_id, COUNT(DISTINCT sale_id) AS n FROM counted GROUP BY customer_id, product_id
+        )
+        INSERT INTO customer_product_last_price
+            (customer_id, product_id, last_price, last_qty, last_date, last_sale_id, purchase_count, updated_at)
+        SELECT r.customer_id, r.product_id,
+               CASE WHEN r.unit_price != 0 THEN r.unit_price ELSE r.sold_price END,
+               r.qty, r.sale_date, r.sale_id, c.n, CURRENT_TIMESTAMP
+        FROM ranked r
+        JOIN counts c ON c.customer_id = r.customer_id AND c.product_id = r.product_id
+        WHERE r.rn = 1
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("customer_product_last_price")
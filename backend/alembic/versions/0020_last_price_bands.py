@@ -0,0 +1,54 @@
+"""price bands on customer_product_last_price
+
+Revision ID: 0020_last_price_bands
+Revises: 0019_customer_product_last_price
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0020_last_price_bands"
+down_revision = "0019_customer_product_last_price"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("customer_product_last_price") as batch_op:
+        batch_op.add_column(sa.Column("price_min", sa.Float(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("price_max", sa.Float(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("price_sum", sa.Float(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("price_count", sa.Integer(), nullable=False, server_default="0"))
+
+    # 按现有单据回填（不计已作废、已整单退货的单）
+    op.execute(
+        """
+        WITH counted AS (
+            SELECT s.customer_id, si.product_id,
+                   CASE WHEN si.unit_price != 0 THEN si.unit_price ELSE si.sold_price END AS price
+            FROM sale_item si
+            JOIN sale s ON s.id = si.sale_id
+            WHERE s.biz_status != 'VOIDED'
+              AND NOT EXISTS (SELECT 1 FROM sale_operation o WHERE o.sale_id = s.id AND o.op_type = 'RETURN')
+        ),
+        bands AS (
+            SELECT customer_id, product_id, MIN(price) AS pmin, MAX(price) AS pmax, SUM(price) AS psum, COUNT(*) AS pcnt
+            FROM counted GROUP BY customer_id, product_id
+        )
+        UPDATE customer_product_last_price
+        SET price_min = (SELECT b.pmin FROM bands b WHERE b.customer_id = customer_product_last_price.customer_id AND b.product_id = customer_product_last_price.product_id),
+            price_max = (SELECT b.pmax FROM bands b WHERE b.customer_id = customer_product_last_price.customer_id AND b.product_id = customer_product_last_price.product_id),
+            price_sum = (SELECT b.psum FROM bands b WHERE b.customer_id = customer_product_last_price.customer_id AND b.product_id = customer_product_last_price.product_id),
+            price_count = (SELECT b.pcnt FROM bands b WHERE b.customer_id = customer_product_last_price.customer_id AND b.product_id = customer_product_last_price.product_id)
+        WHERE EXISTS (SELECT 1 FROM bands b WHERE b.customer_id = customer_product_last_price.customer_id AND b.product_id = customer_product_last_price.product_id)
+        """
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("customer_product_last_price") as batch_op:
+        batch_op.drop_column("price_count")
+        batch_op.drop_column("price_sum")
+        batch_op.drop_column("price_max")
+        batch_op.drop_column("price_min")
@@ -0,0 +1,58 @@
+"""payment.search_text as TEXT, rebuilt without truncation
+
+Revision ID: 0021_payment_search_text_text
+Revises: 0020_last_price_bands
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0021_payment_search_text_text"
+down_revision = "0020_last_price_bands"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("payment") as batch_op:
+        batch_op.alter_column("search_text", existing_type=sa.String(length=1000), type_=sa.Text(), existing_nullable=True)
+
+    # 0010 回填时截断到 1000 字符，分配单数多的收款后面的单号丢失，这里按完整单号重建
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.text(
+            "SELECT p.id, p.note, c.name AS customer_name, s.sale_no "
+            "FROM payment p JOIN customer c ON c.id = p.customer_id "
+            "LEFT JOIN sale s ON s.id = p.sale_id "
+            "WHERE LENGTH(p.search_text) >= 1000"
+        )
+    ).fetchall()
+    ids = [row.id for row in rows]
+    alloc_map = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i : i + 500]
+        alloc_rows = conn.execute(
+            sa.text(
+                "SELECT a.payment_id, s.sale_no FROM payment_allocation a "
+                "JOIN sale s ON s.id = a.sale_id WHERE a.payment_id IN :ids "
+                "ORDER BY a.payment_id, s.sale_date ASC, s.id ASC"
+            ).bindparams(sa.bindparam("ids", expanding=True)),
+            {"ids": chunk},
+        ).fetchall()
+        for row in alloc_rows:
+            alloc_map.setdefault(row.payment_id, []).append(row.sale_no)
+
+    for row in rows:
+        sale_nos = [row.sale_no] if row.sale_no else []
+        for no in alloc_map.get(row.id, []):
+            if no not in sale_nos:
+                sale_nos.append(no)
+        parts = [row.customer_name or "", *sale_nos, row.note or ""]
+        text = " ".join(x for x in parts if x).lower()
+        conn.execute(sa.text("UPDATE payment SET search_text = :t WHERE id = :id"), {"t": text, "id": row.id})
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("payment") as batch_op:
+        batch_op.alter_column("search_text", existing_type=sa.Text(), type_=sa.String(length=1000), existing_nullable=True)
@@ -0,0 +1,25 @@
+"""lease for pending idempotency keys
+
+Revision ID: 0022_idempotency_lease
+Revises: 0021_payment_search_text_text
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0022_idempotency_lease"
+down_revision = "0021_payment_search_text_text"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # 旧的 pending 记录 locked_until 为空，视为租约已过期，重试可直接接管
+    with op.batch_alter_table("idempotency_key") as batch_op:
+        batch_op.add_column(sa.Column("locked_until", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("idempotency_key") as batch_op:
+        batch_op.drop_column("locked_until")
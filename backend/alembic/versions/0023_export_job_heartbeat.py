@@ -0,0 +1,24 @@
+"""heartbeat column on export_job
+
+Revision ID: 0023_export_job_heartbeat
+Revises: 0022_idempotency_lease
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0023_export_job_heartbeat"
+down_revision = "0022_idempotency_lease"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("export_job") as batch_op:
+        batch_op.add_column(sa.Column("updated_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("export_job") as batch_op:
+        batch_op.drop_column("updated_at")
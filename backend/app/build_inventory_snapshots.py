@@ -0,0 +1,26 @@
+import argparse
+
+from sqlmodel import Session
+
+from app.core.time import utc_now
+from app.db.session import engine
+from app.services import inventory_service
+
+
+def _previous_month() -> str:
+    now = utc_now()
+    return f"{now.year - 1}-12" if now.month == 1 else f"{now.year}-{now.month - 1:02d}"
+
+
+def run_build(month: str | None = None):
+    month = month or _previous_month()
+    with Session(engine) as session:
+        count = len(inventory_service.build_month_snapshot(session, month))
+    print(f"月末库存快照已生成：{month}，{count} 个商品")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成已结束月份的月末库存快照（inventory_snapshot），建议每月初定时执行")
+    parser.add_argument("--month", help="YYYY-MM，默认上个月")
+    run_build(parser.parse_args().month)
@@ -15,3 +15,28 @@ CORS_ORIGINS = [
 
 
 SALE_EXCEL_TEMPLATE_PATH = os.getenv("SALE_EXCEL_TEMPLATE_PATH", "./templates/sales_template.xlsx")
+
+# 销售单号号段：>1 时每个进程一次预占 N 个流水号（减少计数器争用，单号可能不连续）
+SALE_NO_BLOCK_SIZE = max(int(os.getenv("SALE_NO_BLOCK_SIZE", "1")), 1)
+
+# Idempotency-Key 响应保留时长（小时）
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# 处理中（pending）占位的租约秒数：进程崩溃遗留的占位过期后，重试可接管；应长于单次请求的最长执行时间
+IDEMPOTENCY_LEASE_SECONDS = max(int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "120")), 1)
+
+# 销售单 PDF 渲染进程池大小与已渲染 PDF 的内存缓存条数
+PDF_RENDER_WORKERS = max(int(os.getenv("PDF_RENDER_WORKERS", "2")), 1)
+PDF_CACHE_SIZE = max(int(os.getenv("PDF_CACHE_SIZE", "256")), 0)
+
+# 后台导出任务（批量销售单 ZIP 等）的输出目录
+EXPORT_DIR = os.getenv("EXPORT_DIR", "./exports")
+# 导出任务超过此分钟数没有进度即视为中断（服务重启/崩溃遗留），标记失败并删除半成品
+EXPORT_JOB_TIMEOUT_MINUTES = max(int(os.getenv("EXPORT_JOB_TIMEOUT_MINUTES", "30")), 1)
+# 已完成导出文件的保留时长（小时），过期后删除文件，任务标记 expired
+EXPORT_RETENTION_HOURS = max(int(os.getenv("EXPORT_RETENTION_HOURS", "24")), 1)
+
+# 商品价格统计结果的内存缓存条数
+PRICE_STATS_CACHE_SIZE = max(int(os.getenv("PRICE_STATS_CACHE_SIZE", "128")), 0)
+
+# 开单价格校验（price_check=true 时）：成交价超出该客户历史价格区间上下浮动此比例即提示
+PRICE_BAND_TOLERANCE = max(float(os.getenv("PRICE_BAND_TOLERANCE", "0.2")), 0.0)
@@ -10,3 +10,7 @@ class NotFoundError(AppError):
 
 class BadRequestError(AppError):
     pass
+
+
+class ConflictError(AppError):
+    pass
@@ -1,6 +1,22 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
 
 def utc_now() -> datetime:
     """UTC aware datetime, compatible with Python 3.14 deprecation guidance."""
     return datetime.now(timezone.utc)
+
+
+def parse_iso_datetime(value: Optional[str], *, end_of_day: bool = False) -> Optional[datetime]:
+    """
+    解析查询参数中的 ISO 日期/时间，统一返回 UTC aware datetime（未带时区按 UTC）。
+    仅日期（YYYY-MM-DD）时取当天 00:00，end_of_day=True 取当天最后一刻，用作闭区间的结束。
+    格式错误抛 ValueError。
+    """
+    if not value:
+        return None
+    if len(value) == 10:
+        dt = datetime.fromisoformat(f"{value}T00:00:00+00:00")
+        return dt + timedelta(days=1) - timedelta(microseconds=1) if end_of_day else dt
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
@@ -1,3 +1,4 @@
+from sqlalchemy import event
 from sqlmodel import Session, create_engine
 from app.core.config import DATABASE_URL
 
@@ -7,6 +8,14 @@ if DATABASE_URL.startswith("sqlite"):
 
 engine = create_engine(DATABASE_URL, echo=False, connect_args=connect_args)
 
+if DATABASE_URL.startswith("sqlite"):
+    # pysqlite 只在 DML 前隐式 BEGIN：savepoint 若是事务内第一条写语句，RELEASE 时即提交，
+    # 批量开单等依赖 begin_nested 的回滚会失效；此时先显式 BEGIN（只读请求仍不开事务、不持锁）
+    @event.listens_for(engine, "savepoint")
+    def _sqlite_savepoint(conn, name):
+        if not conn.connection.dbapi_connection.in_transaction:
+            conn.exec_driver_sql("BEGIN")
+
 
 def get_session():
     with Session(engine) as session:
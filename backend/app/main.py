@@ -1,10 +1,17 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlmodel import Session
+
+from app.db.session import engine
+from app.services import export_job_service
 
 from app.routers.contacts import router as contacts_router
 from app.routers.payments import router as payments_router
 from app.routers.buyers import router as buyers_router
 from app.routers.transactions import router as transactions_router
+from app.routers.inventory import router as inventory_router
 
 from app.routers.customers import router as customers_router
 from app.routers.products import router as products_router
@@ -12,7 +19,16 @@ from app.routers.sales import router as sales_router
 from app.routers.pricing import router as pricing_router
 from app.routers.health import router as health_router
 
-app = FastAPI(title="Shop System", version="1.2.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 后台导出任务随进程存在：启动时清理上次运行中断的任务与过期的导出文件
+    with Session(engine) as session:
+        export_job_service.cleanup_export_jobs(session)
+    yield
+
+
+app = FastAPI(title="Shop System", version="1.2.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,3 +48,4 @@ app.include_router(buyers_router)
 app.include_router(pricing_router)
 
 app.include_router(transactions_router)
+app.include_router(inventory_router)
@@ -7,5 +7,11 @@ from .payment import Payment
 from .payment_allocation import PaymentAllocation
 from .sale_operation import SaleOperation
 from .inventory_txn import InventoryTxn
+from .sale_no_sequence import SaleNoSequence
+from .idempotency_key import IdempotencyKey
+from .customer_balance import CustomerBalance
+from .inventory_snapshot import InventorySnapshot
+from .export_job import ExportJob
+from .customer_product_last_price import CustomerProductLastPrice
 
-__all__ = ["Customer", "CustomerContact", "Product", "Sale", "SaleItem", "Payment", "PaymentAllocation", "SaleOperation", "InventoryTxn"]
+__all__ = ["Customer", "CustomerContact", "Product", "Sale", "SaleItem", "Payment", "PaymentAllocation", "SaleOperation", "InventoryTxn", "SaleNoSequence", "IdempotencyKey", "CustomerBalance", "InventorySnapshot", "ExportJob", "CustomerProductLastPrice"]
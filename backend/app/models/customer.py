@@ -28,9 +28,9 @@ class Customer(SQLModel, table=True):
     sales: Mapped[list["Sale"]] = Relationship(back_populates="customer")
     contacts: Mapped[list["CustomerContact"]] = Relationship(
         back_populates="customer",
-        sa_relationship_kwargs={"lazy": "selectin", "cascade": "all, delete-orphan"},
+        sa_relationship_kwargs={"lazy": "raise", "cascade": "all, delete-orphan"},
     )
     payments: Mapped[list["Payment"]] = Relationship(
         back_populates="customer",
-        sa_relationship_kwargs={"lazy": "selectin"},
+        sa_relationship_kwargs={"lazy": "raise"},
     )
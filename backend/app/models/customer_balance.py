@@ -0,0 +1,16 @@
+from datetime import datetime
+
+from sqlmodel import SQLModel, Field
+
+from app.core.time import utc_now
+
+
+class CustomerBalance(SQLModel, table=True):
+    """客户应收台账：累计销售额与累计收款额，由开单/收款/删单等写路径在同一事务内增量维护"""
+
+    __tablename__ = "customer_balance"
+
+    customer_id: int = Field(foreign_key="customer.id", primary_key=True)
+    total_sales: float = Field(default=0, nullable=False)
+    total_received: float = Field(default=0, nullable=False)
+    updated_at: datetime = Field(default_factory=utc_now, nullable=False)
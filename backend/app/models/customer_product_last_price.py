@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlmodel import SQLModel, Field
+
+from app.core.time import utc_now
+
+
+class CustomerProductLastPrice(SQLModel, table=True):
+    """客户-商品最近成交价、购买次数与历史价格区间；开单时增量写入，作废/退货时按剩余单据重算（已作废、已退货的单不计入）"""
+
+    __tablename__ = "customer_product_last_price"
+
+    customer_id: int = Field(foreign_key="customer.id", primary_key=True)
+    product_id: int = Field(foreign_key="product.id", primary_key=True)
+    last_price: float = Field(default=0, nullable=False)
+    last_qty: float = Field(default=0, nullable=False)
+    last_date: datetime = Field(nullable=False)
+    last_sale_id: Optional[int] = Field(default=None)
+    purchase_count: int = Field(default=0, nullable=False)
+    # 历史成交价区间（按明细行累计），开单价格校验用
+    price_min: float = Field(default=0, nullable=False)
+    price_max: float = Field(default=0, nullable=False)
+    price_sum: float = Field(default=0, nullable=False)
+    price_count: int = Field(default=0, nullable=False)
+    updated_at: datetime = Field(default_factory=utc_now, nullable=False)
@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Column, Text
+from sqlmodel import SQLModel, Field
+
+from app.core.time import utc_now
+
+
+class ExportJob(SQLModel, table=True):
+    """后台导出任务（如批量销售单打包 ZIP），记录进度与结果文件位置"""
+
+    __tablename__ = "export_job"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str = Field(max_length=30)  # sale_slips
+    status: str = Field(default="pending", max_length=20, index=True)  # pending/running/done/failed/expired
+    params_json: Optional[str] = Field(default=None, sa_column=Column(Text, nullable=True))
+    total: int = Field(default=0, nullable=False)
+    done: int = Field(default=0, nullable=False)
+    file_path: Optional[str] = Field(default=None, max_length=500)
+    file_name: Optional[str] = Field(default=None, max_length=200)
+    error: Optional[str] = Field(default=None, max_length=500)
+    created_at: datetime = Field(default_factory=utc_now, nullable=False)
+    finished_at: Optional[datetime] = Field(default=None)
+    updated_at: Optional[datetime] = Field(default=None)  # 最近一次进度更新（心跳），用于判定中断的任务
@@ -0,0 +1,24 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Column, Text, UniqueConstraint
+from sqlmodel import SQLModel, Field
+
+from app.core.time import utc_now
+
+
+class IdempotencyKey(SQLModel, table=True):
+    """客户端重试去重：按 (scope, key) 保存首次请求的响应，在有效期内原样返回"""
+
+    __tablename__ = "idempotency_key"
+    __table_args__ = (UniqueConstraint("scope", "key", name="uq_idempotency_key_scope_key"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    scope: str = Field(max_length=60)
+    key: str = Field(max_length=100)
+    request_hash: str = Field(max_length=64)
+    status: str = Field(default="pending", max_length=20)  # pending/partial/committed/done
+    response_json: Optional[str] = Field(default=None, sa_column=Column(Text, nullable=True))
+    created_at: datetime = Field(default_factory=utc_now, nullable=False)
+    expires_at: datetime = Field(nullable=False, index=True)
+    locked_until: Optional[datetime] = None  # pending 占位的租约到期时间
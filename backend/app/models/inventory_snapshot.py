@@ -0,0 +1,16 @@
+from datetime import datetime
+
+from sqlmodel import SQLModel, Field
+
+from app.core.time import utc_now
+
+
+class InventorySnapshot(SQLModel, table=True):
+    """月末库存快照：已结束月份的各商品月末库存，按需生成后不再变化"""
+
+    __tablename__ = "inventory_snapshot"
+
+    month: str = Field(primary_key=True, max_length=7)  # YYYY-MM
+    product_id: int = Field(foreign_key="product.id", primary_key=True)
+    qty: float = Field(nullable=False)
+    created_at: datetime = Field(default_factory=utc_now, nullable=False)
@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import Optional, TYPE_CHECKING
 
+from sqlalchemy import Index
 from sqlalchemy.orm import Mapped
 from sqlmodel import SQLModel, Field, Relationship
 
@@ -12,6 +13,9 @@ if TYPE_CHECKING:
 
 class InventoryTxn(SQLModel, table=True):
     __tablename__ = "inventory_txn"
+    __table_args__ = (
+        Index("ix_inventory_txn_product_created", "product_id", "created_at"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     product_id: int = Field(foreign_key="product.id", index=True)
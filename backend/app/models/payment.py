@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import Optional, TYPE_CHECKING, List
 
+from sqlalchemy import Column, Text
 from sqlalchemy.orm import Mapped
 from sqlmodel import SQLModel, Field, Relationship
 
@@ -26,11 +27,13 @@ class Payment(SQLModel, table=True):
 
     paid_at: datetime = Field(default_factory=utc_now, nullable=False, index=True)
     note: Optional[str] = Field(default=None, max_length=255)
+    # 流水检索用：客户名 + 关联单号 + 备注（小写），由 payment_service.refresh_payment_search_text 维护
+    search_text: Optional[str] = Field(default=None, sa_column=Column(Text, nullable=True))
     created_at: datetime = Field(default_factory=utc_now, nullable=False)
 
     customer: Mapped[Optional["Customer"]] = Relationship(back_populates="payments")
     sale: Mapped[Optional["Sale"]] = Relationship(back_populates="payments")
     allocations: Mapped[List["PaymentAllocation"]] = Relationship(
         back_populates="payment",
-        sa_relationship_kwargs={"lazy": "selectin", "cascade": "all, delete-orphan"},
+        sa_relationship_kwargs={"lazy": "raise", "cascade": "all, delete-orphan"},
     )
@@ -35,5 +35,5 @@ class Product(SQLModel, table=True):
     sale_items: Mapped[list["SaleItem"]] = Relationship(back_populates="product")
     inventory_txns: Mapped[list["InventoryTxn"]] = Relationship(
         back_populates="product",
-        sa_relationship_kwargs={"lazy": "selectin", "cascade": "all, delete-orphan"},
+        sa_relationship_kwargs={"lazy": "raise", "cascade": "all, delete-orphan"},
     )
@@ -38,6 +38,7 @@ class Sale(SQLModel, table=True):
     total_amount: float = Field(default=0, ge=0, nullable=False)
     paid_amount: float = Field(default=0, ge=0, nullable=False)
     ar_amount: float = Field(default=0, ge=0, nullable=False)
+    gross_profit: float = Field(default=0, nullable=False)
     payment_status: str = Field(default="unpaid", max_length=20, index=True)
     settlement_status: str = Field(default="UNPAID", max_length=20, index=True)
     payment_method: Optional[str] = Field(default=None, max_length=30)
@@ -49,20 +50,20 @@ class Sale(SQLModel, table=True):
     customer: Mapped[Optional["Customer"]] = Relationship(back_populates="sales")
     items: Mapped[list["SaleItem"]] = Relationship(
         back_populates="sale",
-        sa_relationship_kwargs={"lazy": "selectin", "cascade": "all, delete-orphan"},
+        sa_relationship_kwargs={"lazy": "raise", "cascade": "all, delete-orphan"},
     )
 
     payments: Mapped[list["Payment"]] = Relationship(
         back_populates="sale",
-        sa_relationship_kwargs={"lazy": "selectin", "cascade": "all, delete-orphan"},
+        sa_relationship_kwargs={"lazy": "raise", "cascade": "all, delete-orphan"},
     )
 
     payment_allocations: Mapped[list["PaymentAllocation"]] = Relationship(
         back_populates="sale",
-        sa_relationship_kwargs={"lazy": "selectin", "cascade": "all, delete-orphan"},
+        sa_relationship_kwargs={"lazy": "raise", "cascade": "all, delete-orphan"},
     )
 
     operations: Mapped[list["SaleOperation"]] = Relationship(
         back_populates="sale",
-        sa_relationship_kwargs={"lazy": "selectin", "cascade": "all, delete-orphan"},
+        sa_relationship_kwargs={"lazy": "raise", "cascade": "all, delete-orphan"},
     )
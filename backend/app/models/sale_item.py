@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import Optional, TYPE_CHECKING
 
+from sqlalchemy import Index
 from sqlalchemy.orm import Mapped
 from sqlmodel import SQLModel, Field, Relationship
 
@@ -13,6 +14,10 @@ if TYPE_CHECKING:
 
 class SaleItem(SQLModel, table=True):
     __tablename__ = "sale_item"
+    __table_args__ = (
+        # 客户+商品的历史价查询：按商品过滤后直接取 sale_id 关联 sale，不回表
+        Index("ix_sale_item_product_sale", "product_id", "sale_id"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     sale_id: int = Field(foreign_key="sale.id", index=True)
@@ -22,6 +27,9 @@ class SaleItem(SQLModel, table=True):
     unit_price: float = Field(default=0, ge=0)
     sold_price: float = Field(default=0, ge=0)
     line_total: float = Field(default=0, ge=0, nullable=False)
+    # 开单时的成本快照与毛利，避免 Product.standard_cost 变动导致历史毛利漂移
+    unit_cost: float = Field(default=0, ge=0, nullable=False)
+    gross_profit: float = Field(default=0, nullable=False)
 
     remark: Optional[str] = Field(default=None, max_length=200)
     created_at: datetime = Field(default_factory=utc_now, nullable=False)
@@ -0,0 +1,10 @@
+from sqlmodel import SQLModel, Field
+
+
+class SaleNoSequence(SQLModel, table=True):
+    """按日前缀（如 SO20260306-）维护的销售单流水号计数器"""
+
+    __tablename__ = "sale_no_sequence"
+
+    prefix: str = Field(primary_key=True, max_length=20)
+    last_seq: int = Field(default=0, nullable=False)
@@ -0,0 +1,18 @@
+import argparse
+
+from sqlmodel import Session
+
+from app.db.session import engine
+from app.services import customer_balance_service
+
+
+def run_rebuild():
+    with Session(engine) as session:
+        count = customer_balance_service.rebuild_balances(session)
+    print(f"客户台账重建完成：{count} 个客户")
+    return count
+
+
+if __name__ == "__main__":
+    argparse.ArgumentParser(description="按销售单与收款记录全量重建客户应收台账（customer_balance）").parse_args()
+    run_rebuild()
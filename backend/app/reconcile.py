@@ -0,0 +1,25 @@
+import argparse
+
+from sqlmodel import Session
+
+from app.db.session import engine
+from app.services import payment_service
+
+
+def run_reconcile(*, repair: bool = True, chunk_size: int = 500):
+    with Session(engine) as session:
+        result = payment_service.reconcile_sale_payments(session, chunk_size=chunk_size, repair=repair)
+
+    for it in result["items"]:
+        print(f"{it['sale_no']}: 已收 {it['stored']} -> 应为 {it['expected']}")
+    action = "已修复" if repair else "未修复（--dry-run）"
+    print(f"对账完成：检查 {result['checked']} 单，偏差 {result['drifted']} 单，{action}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="核对并修复销售单已收金额（paid_amount）")
+    parser.add_argument("--dry-run", action="store_true", help="只报告偏差，不写库")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    args = parser.parse_args()
+    run_reconcile(repair=not args.dry_run, chunk_size=args.chunk_size)
@@ -1,7 +1,8 @@
+import urllib.parse
 from math import ceil
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Response
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlmodel import Session
 
@@ -116,20 +117,21 @@ def customer_statement(
 ):
     try:
         customer_service.get_customer_or_404(session, customer_id)
+        summary, items, total = statement_service.get_statement(
+            session,
+            customer_id=customer_id,
+            start_date=start_date,
+            end_date=end_date,
+            page=page,
+            page_size=page_size,
+            q=q,
+            payment_status=payment_status,
+            sort_by=sort_by,
+        )
     except NotFoundError as exc:
         raise HTTPException(status_code=404, detail=exc.message)
-
-    summary, items, total = statement_service.get_statement(
-        session,
-        customer_id=customer_id,
-        start_date=start_date,
-        end_date=end_date,
-        page=page,
-        page_size=page_size,
-        q=q,
-        payment_status=payment_status,
-        sort_by=sort_by,
-    )
+    except BadRequestError as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
     pages = ceil(total / page_size) if page_size else 0
     meta = {"total": int(total), "page": page, "page_size": page_size, "pages": pages}
     return {"items": items, "meta": meta, "summary": summary}
@@ -162,10 +164,9 @@ def export_customer_statement(
     format: str = Query("csv"),
     session: Session = Depends(get_session),
 ):
-    if format != "csv":
-        raise HTTPException(status_code=400, detail="仅支持 csv")
-    content = statement_service.export_statement_csv(
-        session,
+    if format not in {"csv", "xlsx"}:
+        raise HTTPException(status_code=400, detail="仅支持 csv / xlsx")
+    params = dict(
         customer_id=customer_id,
         start_date=start_date,
         end_date=end_date,
@@ -173,7 +174,26 @@ def export_customer_statement(
         payment_status=payment_status,
         sort_by=sort_by,
     )
-    return PlainTextResponse(content, media_type="text/csv; charset=utf-8")
+    # 客户与筛选条件在开始流式输出之前校验：响应头发出后就无法再返回 404/400
+    try:
+        customer_service.get_customer_or_404(session, customer_id)
+        if format == "xlsx":
+            chunks = statement_service.export_statement_xlsx(session, **params)
+        else:
+            chunks = statement_service.export_statement_csv(session, **params)
+    except NotFoundError as exc:
+        raise HTTPException(status_code=404, detail=exc.message)
+    except BadRequestError as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
+
+    if format == "xlsx":
+        encoded_file_name = urllib.parse.quote(f"对账单_{customer_id}.xlsx")
+        return StreamingResponse(
+            chunks,
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={"Content-Disposition": f"attachment; filename*=utf-8''{encoded_file_name}"},
+        )
+    return StreamingResponse(chunks, media_type="text/csv; charset=utf-8")
 
 
 @router.get("/{customer_id}/open_sales")
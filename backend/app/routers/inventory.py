@@ -0,0 +1,72 @@
+from math import ceil
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlmodel import Session
+
+from app.core.errors import BadRequestError, NotFoundError
+from app.db.session import get_session
+from app.services import inventory_service
+
+router = APIRouter(prefix="/api/inventory", tags=["Inventory"])
+
+
+@router.get("/txns")
+def list_inventory_txns(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    product_id: int | None = Query(None),
+    biz_type: str | None = Query(None, description="如 sale / sale_void / sale_return / manual_adjust"),
+    start_date: str | None = Query(None),
+    end_date: str | None = Query(None),
+    cursor: str | None = Query(None, description="上一页返回的 next_cursor；传入时忽略 page"),
+    with_total: bool = Query(True, description="为 false 时不统计总数（total/pages 为 null）"),
+    session: Session = Depends(get_session),
+):
+    try:
+        items, total, next_cursor = inventory_service.list_inventory_txns(
+            session,
+            product_id=product_id,
+            biz_type=biz_type,
+            start_date=start_date,
+            end_date=end_date,
+            page=page,
+            page_size=page_size,
+            cursor=cursor,
+            with_total=with_total,
+        )
+    except BadRequestError as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
+    except NotFoundError as exc:
+        raise HTTPException(status_code=404, detail=exc.message)
+    pages = ceil(total / page_size) if total is not None else None
+    return {"items": items, "meta": {"total": total, "page": page, "page_size": page_size, "pages": pages, "next_cursor": next_cursor}}
+
+
+@router.get("/stock_as_of")
+def stock_as_of(
+    at: str = Query(..., description="时间点；只传日期时取当天结束时刻"),
+    q: str | None = Query(None, description="可选：商品名或SKU模糊搜索"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    session: Session = Depends(get_session),
+):
+    try:
+        summary, items, total = inventory_service.stock_as_of(session, at=at, q=q, page=page, page_size=page_size)
+    except BadRequestError as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
+    return {"at": at, "summary": summary, "items": items, "meta": {"total": total, "page": page, "page_size": page_size, "pages": ceil(total / page_size)}}
+
+
+@router.get("/valuation")
+def month_end_valuation(
+    month: str = Query(..., description="月份 YYYY-MM，按月末库存 × 标准成本估值"),
+    q: str | None = Query(None, description="可选：商品名或SKU模糊搜索"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    session: Session = Depends(get_session),
+):
+    try:
+        summary, items, total = inventory_service.month_end_valuation(session, month=month, q=q, page=page, page_size=page_size)
+    except BadRequestError as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
+    return {"month": month, "summary": summary, "items": items, "meta": {"total": total, "page": page, "page_size": page_size, "pages": ceil(total / page_size)}}
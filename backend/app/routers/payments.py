@@ -1,17 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
 from sqlmodel import Session
 
-from app.core.errors import BadRequestError, NotFoundError
+from app.core.errors import BadRequestError, ConflictError, NotFoundError
 from app.db.session import get_session
 from app.schemas.payment import BatchPaymentApplyIn, BatchPaymentApplyOut, PaymentCreate, PaymentRead
-from app.services import payment_service
+from app.services import idempotency_service, payment_service
 
 router = APIRouter(prefix="/api", tags=["Payments"])
 
 
 @router.post("/payments", response_model=PaymentRead)
-def create_payment(payload: PaymentCreate, session: Session = Depends(get_session)):
-    try:
+def create_payment(
+    payload: PaymentCreate,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+    session: Session = Depends(get_session),
+):
+    def _run():
         p = payment_service.create_payment(
             session,
             sale_id=payload.sale_id,
@@ -31,10 +35,15 @@ def create_payment(payload: PaymentCreate, session: Session = Depends(get_sessio
             "paid_at": p.paid_at.isoformat().replace("+00:00", "Z"),
             "note": p.note,
         }
+
+    try:
+        return idempotency_service.run_idempotent(session, scope="payments.create", key=idempotency_key, payload=payload, fn=_run)
     except NotFoundError as exc:
         raise HTTPException(status_code=404, detail=exc.message)
     except BadRequestError as exc:
         raise HTTPException(status_code=400, detail=exc.message)
+    except ConflictError as exc:
+        raise HTTPException(status_code=409, detail=exc.message)
 
 
 @router.post("/payments/batch_apply", response_model=BatchPaymentApplyOut)
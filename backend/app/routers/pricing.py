@@ -1,8 +1,17 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlmodel import Session
 
+from app.core.errors import BadRequestError, NotFoundError
 from app.db.session import get_session
-from app.schemas.pricing import PricingLastResponse, PricingHistoryItem, ProductTrendItem
+from app.schemas.pricing import (
+    FrequentProductItem,
+    PricingBatchRequest,
+    PricingBatchResponse,
+    PricingHistoryItem,
+    PricingLastResponse,
+    ProductPriceStatsResponse,
+    ProductTrendItem,
+)
 from app.services import pricing_service
 
 router = APIRouter(prefix="/api/pricing", tags=["Pricing/History"])
@@ -14,7 +23,19 @@ def get_last(
     product_id: int = Query(..., ge=1),
     session: Session = Depends(get_session),
 ):
-    return pricing_service.last_pricing(session, customer_id, product_id)
+    try:
+        return pricing_service.last_pricing(session, customer_id, product_id)
+    except NotFoundError as exc:
+        raise HTTPException(status_code=404, detail=exc.message)
+
+
+@router.post("/last/batch", response_model=PricingBatchResponse)
+def get_last_batch(payload: PricingBatchRequest, session: Session = Depends(get_session)):
+    """收银整单取价：一次请求返回购物车所有商品的最近成交价、标准价与库存"""
+    try:
+        return pricing_service.last_pricing_batch(session, payload.customer_id, payload.product_ids)
+    except NotFoundError as exc:
+        raise HTTPException(status_code=404, detail=exc.message)
 
 
 @router.get("/history", response_model=list[PricingHistoryItem])
@@ -24,7 +45,23 @@ def get_history(
     limit: int = Query(20, ge=1, le=200),
     session: Session = Depends(get_session),
 ):
-    return pricing_service.pricing_history(session, customer_id, product_id, limit=limit)
+    try:
+        items, _ = pricing_service.pricing_history(session, customer_id, product_id, limit=limit)
+    except NotFoundError as exc:
+        raise HTTPException(status_code=404, detail=exc.message)
+    return items
+
+
+@router.get("/frequent_products", response_model=list[FrequentProductItem])
+def get_frequent_products(
+    customer_id: int = Query(..., ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    session: Session = Depends(get_session),
+):
+    try:
+        return pricing_service.frequent_products(session, customer_id, limit=limit)
+    except NotFoundError as exc:
+        raise HTTPException(status_code=404, detail=exc.message)
 
 
 @router.get("/product_trend", response_model=list[ProductTrendItem])
@@ -34,3 +71,17 @@ def get_product_trend(
     session: Session = Depends(get_session),
 ):
     return pricing_service.product_trend(session, product_id, limit=limit)
+
+
+@router.get("/product_stats", response_model=ProductPriceStatsResponse)
+def get_product_price_stats(
+    product_id: int = Query(..., ge=1),
+    session: Session = Depends(get_session),
+):
+    """商品历史成交价统计：整体、按客户、按月的数量加权 min/max/均价/分位数"""
+    try:
+        return pricing_service.price_statistics(session, product_id)
+    except NotFoundError as exc:
+        raise HTTPException(status_code=404, detail=exc.message)
+    except BadRequestError as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
@@ -1,3 +1,5 @@
+from math import ceil
+
 from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel
 from sqlmodel import Session
@@ -5,7 +7,7 @@ from sqlmodel import Session
 from app.core.errors import BadRequestError, NotFoundError
 from app.db.session import get_session
 from app.schemas.product import ProductCreate, ProductPage, ProductRead, ProductUpdate
-from app.services import product_service
+from app.services import inventory_service, product_service
 
 router = APIRouter(prefix="/api/products", tags=["Products"])
 
@@ -94,3 +96,35 @@ def adjust_product_stock(product_id: int, payload: StockAdjustPayload, session:
         raise HTTPException(status_code=404, detail=exc.message)
     except BadRequestError as exc:
         raise HTTPException(status_code=400, detail=exc.message)
+
+
+@router.get("/{product_id}/inventory_txns")
+def list_product_inventory_txns(
+    product_id: int,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    biz_type: str | None = Query(None),
+    start_date: str | None = Query(None),
+    end_date: str | None = Query(None),
+    cursor: str | None = Query(None, description="上一页返回的 next_cursor；传入时忽略 page"),
+    with_total: bool = Query(True, description="为 false 时不统计总数（total/pages 为 null）"),
+    session: Session = Depends(get_session),
+):
+    try:
+        items, total, next_cursor = inventory_service.list_inventory_txns(
+            session,
+            product_id=product_id,
+            biz_type=biz_type,
+            start_date=start_date,
+            end_date=end_date,
+            page=page,
+            page_size=page_size,
+            cursor=cursor,
+            with_total=with_total,
+        )
+    except NotFoundError as exc:
+        raise HTTPException(status_code=404, detail=exc.message)
+    except BadRequestError as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
+    pages = ceil(total / page_size) if total is not None else None
+    return {"items": items, "meta": {"total": total, "page": page, "page_size": page_size, "pages": pages, "next_cursor": next_cursor}}
@@ -2,15 +2,19 @@ from io import BytesIO
 import urllib.parse
 import traceback
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlmodel import Session
 
 from app.core.config import SALE_EXCEL_TEMPLATE_PATH
-from app.core.errors import BadRequestError, NotFoundError
+from app.core.errors import BadRequestError, ConflictError, NotFoundError
 from app.db.session import get_session
 from app.schemas.sale import (
+    ExportJobRead,
+    SaleBatchCreate,
+    SaleBatchResponse,
     SaleCreate,
+    SaleExportJobCreate,
     SaleOperationCreate,
     SalePage,
     SalePaymentCreate,
@@ -19,7 +23,7 @@ from app.schemas.sale import (
     SaleReverseSettlementCreate,
     SaleSettlementUpdate,
 )
-from app.services import payment_service, sale_export_service, sale_service, settlement_service
+from app.services import export_job_service, idempotency_service, payment_service, sale_export_service, sale_service, settlement_service
 
 router = APIRouter(prefix="/api/sales", tags=["Sales"])
 
@@ -30,11 +34,44 @@ def get_next_no(session: Session = Depends(get_session)):
 
 
 @router.post("", response_model=SaleRead)
-def create_sale(payload: SaleCreate, session: Session = Depends(get_session)):
+def create_sale(
+        payload: SaleCreate,
+        idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+        session: Session = Depends(get_session),
+):
     try:
-        return sale_service.create_sale(session, payload)
+        return idempotency_service.run_idempotent(
+            session,
+            scope="sales.create",
+            key=idempotency_key,
+            payload=payload,
+            fn=lambda: sale_service.create_sale(session, payload),
+        )
     except (NotFoundError, BadRequestError) as exc:
         raise HTTPException(status_code=400, detail=exc.message)
+    except ConflictError as exc:
+        raise HTTPException(status_code=409, detail=exc.message)
+
+
+@router.post("/batch", response_model=SaleBatchResponse)
+def create_sales_batch(
+        payload: SaleBatchCreate,
+        idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+        session: Session = Depends(get_session),
+):
+    def _run(progress):
+        results = sale_service.create_sales_batch(session, payload.orders, progress=progress)
+        created = sum(1 for r in results if r["ok"])
+        return {"created": created, "failed": len(results) - created, "results": results}
+
+    try:
+        return idempotency_service.run_idempotent(
+            session, scope="sales.batch", key=idempotency_key, payload=payload, fn=_run, resumable=True
+        )
+    except BadRequestError as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
+    except ConflictError as exc:
+        raise HTTPException(status_code=409, detail=exc.message)
 
 
 @router.get("", response_model=SalePage)
@@ -48,6 +85,45 @@ def get_sales(
     return SalePage(items=items, total=int(total), page=page, page_size=page_size)
 
 
+@router.post("/export_jobs", response_model=ExportJobRead)
+def create_export_job(payload: SaleExportJobCreate, background_tasks: BackgroundTasks, session: Session = Depends(get_session)):
+    """批量导出销售单（ZIP）：立即返回任务，后台分批生成，通过 GET /export_jobs/{job_id} 查询进度"""
+    try:
+        job = export_job_service.create_sale_slip_job(
+            session,
+            fmt=payload.format,
+            customer_id=payload.customer_id,
+            start_date=payload.start_date,
+            end_date=payload.end_date,
+            sale_ids=payload.sale_ids,
+        )
+    except BadRequestError as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
+    background_tasks.add_task(export_job_service.run_sale_slip_job, job.id, SALE_EXCEL_TEMPLATE_PATH)
+    return job
+
+
+@router.get("/export_jobs/{job_id}", response_model=ExportJobRead)
+def get_export_job(job_id: int, session: Session = Depends(get_session)):
+    try:
+        return export_job_service.get_job(session, job_id)
+    except NotFoundError as exc:
+        raise HTTPException(status_code=404, detail=exc.message)
+
+
+@router.get("/export_jobs/{job_id}/download")
+def download_export_job(job_id: int, session: Session = Depends(get_session)):
+    try:
+        job = export_job_service.get_job(session, job_id)
+    except NotFoundError as exc:
+        raise HTTPException(status_code=404, detail=exc.message)
+    if job.status == "expired":
+        raise HTTPException(status_code=410, detail="导出文件已过期，请重新导出")
+    if job.status != "done" or not job.file_path:
+        raise HTTPException(status_code=409, detail="导出任务尚未完成")
+    return FileResponse(job.file_path, media_type="application/zip", filename=job.file_name)
+
+
 @router.get("/{sale_id}", response_model=SaleRead)
 def get_sale_detail(sale_id: int, session: Session = Depends(get_session)):
     try:
@@ -74,8 +150,13 @@ def submit_settlement(sale_id: int, payload: SaleSettlementUpdate, session: Sess
 
 
 @router.post("/{sale_id}/payments", response_model=SalePaymentSubmitResponse)
-def submit_sale_payment(sale_id: int, payload: SalePaymentCreate, session: Session = Depends(get_session)):
-    try:
+def submit_sale_payment(
+        sale_id: int,
+        payload: SalePaymentCreate,
+        idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+        session: Session = Depends(get_session),
+):
+    def _run():
         sale, payment = payment_service.submit_sale_payment(
             session,
             sale_id=sale_id,
@@ -85,10 +166,17 @@ def submit_sale_payment(sale_id: int, payload: SalePaymentCreate, session: Sessi
             note=payload.note,
         )
         return {"sale": sale, "payment": payment}
+
+    try:
+        return idempotency_service.run_idempotent(
+            session, scope=f"sales.{sale_id}.payments", key=idempotency_key, payload=payload, fn=_run
+        )
     except NotFoundError as exc:
         raise HTTPException(status_code=404, detail=exc.message)
     except BadRequestError as exc:
         raise HTTPException(status_code=400, detail=exc.message)
+    except ConflictError as exc:
+        raise HTTPException(status_code=409, detail=exc.message)
 
 
 @router.get('/{sale_id}/payment_records')
@@ -164,7 +252,7 @@ def export_sale_pdf(sale_id: int, session: Session = Depends(get_session)):
         print(f"====== PDF 导出被主动拦截，原因：{exc.message} ======")
         raise HTTPException(status_code=400, detail=exc.message)
     except Exception as exc:
-        # 当 Excel COM 转换报错或者超时时，这里会将具体原因抛出到控制台
+        # 渲染进程报错或者超时时，这里会将具体原因抛出到控制台
         print("====== PDF 转换出现未知异常 ======")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"底层转换失败: {str(exc)}")
@@ -1,14 +1,19 @@
 from math import ceil
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlmodel import Session
 
+from app.core.errors import BadRequestError
 from app.db.session import get_session
 from app.services import transaction_service
 
 router = APIRouter(prefix="/api/transactions", tags=["Transactions"])
 
 
+def _pages(total: int | None, page_size: int):
+    return ceil(total / page_size) if total is not None else None
+
+
 @router.get("/sales")
 def list_sales_transactions(
     page: int = Query(1, ge=1),
@@ -18,18 +23,25 @@ def list_sales_transactions(
     q: str | None = Query(None),
     status: str | None = Query(None),
     sort_by: str = Query("date_desc"),
+    cursor: str | None = Query(None, description="上一页返回的 next_cursor；传入时忽略 page"),
+    with_total: bool = Query(True, description="为 false 时不统计总数（total/pages 为 null）"),
     session: Session = Depends(get_session),
 ):
-    items, total = transaction_service.list_sales_transactions(
-        session,
-        page=page,
-        page_size=page_size,
-        start_date=start_date,
-        end_date=end_date,
-        q=q,
-        status=status,
-    )
-    return {"items": items, "meta": {"total": total, "page": page, "page_size": page_size, "sort_by": sort_by, "pages": ceil(total / page_size)}}
+    try:
+        items, total, next_cursor = transaction_service.list_sales_transactions(
+            session,
+            page=page,
+            page_size=page_size,
+            start_date=start_date,
+            end_date=end_date,
+            q=q,
+            status=status,
+            cursor=cursor,
+            with_total=with_total,
+        )
+    except BadRequestError as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
+    return {"items": items, "meta": {"total": total, "page": page, "page_size": page_size, "sort_by": sort_by, "pages": _pages(total, page_size), "next_cursor": next_cursor}}
 
 
 @router.get("/payments")
@@ -40,15 +52,22 @@ def list_payments_transactions(
     end_date: str | None = Query(None),
     q: str | None = Query(None),
     method: str | None = Query(None),
+    cursor: str | None = Query(None, description="上一页返回的 next_cursor；传入时忽略 page"),
+    with_total: bool = Query(True, description="为 false 时不统计总数（total/pages 为 null）"),
     session: Session = Depends(get_session),
 ):
-    items, total = transaction_service.list_payment_transactions(
-        session,
-        page=page,
-        page_size=page_size,
-        start_date=start_date,
-        end_date=end_date,
-        q=q,
-        method=method,
-    )
-    return {"items": items, "meta": {"total": total, "page": page, "page_size": page_size, "pages": ceil(total / page_size)}}
+    try:
+        items, total, next_cursor = transaction_service.list_payment_transactions(
+            session,
+            page=page,
+            page_size=page_size,
+            start_date=start_date,
+            end_date=end_date,
+            q=q,
+            method=method,
+            cursor=cursor,
+            with_total=with_total,
+        )
+    except BadRequestError as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
+    return {"items": items, "meta": {"total": total, "page": page, "page_size": page_size, "pages": _pages(total, page_size), "next_cursor": next_cursor}}
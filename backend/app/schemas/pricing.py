@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional, List
 
-from sqlmodel import SQLModel
+from sqlmodel import SQLModel, Field
 
 
 class PricingLastResponse(SQLModel):
@@ -12,6 +12,21 @@ class PricingLastResponse(SQLModel):
     last_qty: Optional[float] = None
 
 
+class PricingBatchRequest(SQLModel):
+    customer_id: int = Field(ge=1)
+    product_ids: List[int] = Field(min_length=1, max_length=500)
+
+
+class PricingBatchItem(PricingLastResponse):
+    product_id: int
+    stock_quantity: float
+
+
+class PricingBatchResponse(SQLModel):
+    items: List[PricingBatchItem]
+    missing_product_ids: List[int] = []
+
+
 class PricingHistoryItem(SQLModel):
     date: datetime
     qty: float
@@ -26,3 +41,46 @@ class ProductTrendItem(SQLModel):
     sale_id: int
     customer_id: int
     customer_name: str
+
+
+class FrequentProductItem(SQLModel):
+    product_id: int
+    name: str
+    sku: Optional[str] = None
+    unit: Optional[str] = None
+    standard_price: float
+    stock_quantity: float
+    last_price: float
+    last_qty: float
+    last_date: datetime
+    purchase_count: int
+
+
+class PriceStats(SQLModel):
+    count: int
+    total_qty: float
+    min: float
+    max: float
+    mean: float
+    p10: float
+    p25: float
+    median: float
+    p75: float
+    p90: float
+
+
+class CustomerPriceStats(PriceStats):
+    customer_id: int
+    customer_name: str
+
+
+class MonthPriceStats(PriceStats):
+    month: str
+
+
+class ProductPriceStatsResponse(SQLModel):
+    product_id: int
+    last_sale_id: Optional[int] = None
+    overall: Optional[PriceStats] = None
+    by_customer: List[CustomerPriceStats]
+    by_month: List[MonthPriceStats]
@@ -19,6 +19,37 @@ class SaleCreate(SQLModel):
     sale_date: Optional[datetime] = None
     note: Optional[str] = Field(default=None, max_length=500)
     items: List[SaleItemCreate]
+    # 为 true 时按成本价与该客户历史价格区间校验每行成交价，异常行作为 warnings 返回（不阻止开单）
+    price_check: bool = False
+
+
+class SalePriceWarning(SQLModel):
+    line_index: int  # 对应请求 items 的下标
+    product_id: int
+    unit_price: float
+    kind: str  # below_cost / below_history / above_history
+    reference_price: float
+    message: str
+
+
+class SaleBatchCreate(SQLModel):
+    orders: List[SaleCreate] = Field(min_length=1, max_length=1000)
+
+
+class SaleBatchResultItem(SQLModel):
+    index: int
+    ok: bool
+    sale_id: Optional[int] = None
+    sale_no: Optional[str] = None
+    total_amount: Optional[float] = None
+    error: Optional[str] = None
+    warnings: List[SalePriceWarning] = []
+
+
+class SaleBatchResponse(SQLModel):
+    created: int
+    failed: int
+    results: List[SaleBatchResultItem]
 
 
 class SaleSettlementUpdate(SQLModel):
@@ -71,6 +102,7 @@ class SaleRead(SQLModel):
     biz_status: str = "NORMAL"
     created_at: datetime
     items: List[SaleItemRead] = []
+    warnings: List[SalePriceWarning] = []
 
 
 class SaleSummary(SQLModel):
@@ -107,3 +139,23 @@ class SalePaymentCreate(SQLModel):
 class SalePaymentSubmitResponse(SQLModel):
     sale: SaleRead
     payment: dict
+
+
+class SaleExportJobCreate(SQLModel):
+    format: str = "xlsx"  # xlsx / pdf
+    customer_id: Optional[int] = None
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    sale_ids: Optional[List[int]] = Field(default=None, max_length=10000)
+
+
+class ExportJobRead(SQLModel):
+    id: int
+    kind: str
+    status: str
+    total: int
+    done: int
+    file_name: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
@@ -5,6 +5,7 @@ from app.core.config import APP_ENV
 from app.core.time import utc_now
 from app.db.session import engine
 from app.models import Customer, Product, Sale, SaleItem, CustomerContact, Payment
+from app.services import customer_balance_service, last_price_service, sale_service
 
 
 def upsert_customer(session: Session, name: str, phone: str | None = None, address: str | None = None) -> Customer:
@@ -67,18 +68,6 @@ def run_seed():
         session.commit()
         session.refresh(contact_worker1); session.refresh(contact_worker2); session.refresh(contact_account)
 
-        def gen_sale_no(when):
-            day = when.strftime("%Y%m%d")
-            prefix = f"SO{day}-"
-            last = session.exec(select(Sale).where(Sale.sale_no.like(f"{prefix}%")).order_by(Sale.sale_no.desc()).limit(1)).first()
-            seq = 1
-            if last and last.sale_no and "-" in last.sale_no:
-                try:
-                    seq = int(last.sale_no.split("-")[-1]) + 1
-                except Exception:
-                    seq = 1
-            return f"{prefix}{seq:04d}"
-
         def ensure_sale(customer: Customer, when, note: str, contact: CustomerContact | None, items):
             # 若同日期同备注存在则不重复插入
             exists = session.exec(
@@ -88,7 +77,7 @@ def run_seed():
                 return exists
 
             sale = Sale(
-                sale_no=gen_sale_no(when),
+                sale_no=sale_service._generate_sale_no(session, when),
                 customer_id=customer.id,
                 sale_date=when,
                 note=note,
@@ -169,6 +158,10 @@ def run_seed():
         # sale_c 全额付款
         ensure_payment(sale_c, amount=sale_c.total_amount, method="转账", days_ago=5, note="现结")
 
+        # 种子数据直接写表，最后按单据与收款重建客户台账与最近成交价
+        customer_balance_service.rebuild_balances(session)
+        last_price_service.rebuild_last_prices(session)
+
         print("seed 完成：已插入客户、联系人、商品、历史单据、付款流水。")
 
 
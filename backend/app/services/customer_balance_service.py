@@ -0,0 +1,83 @@
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.core.errors import BadRequestError
+from app.core.time import utc_now
+from app.models import CustomerBalance, Payment, Sale
+
+
+def apply_balance_delta(session: Session, customer_id: int, *, sales: float = 0, received: float = 0) -> None:
+    """在调用方事务内增量更新客户台账；客户首笔业务时插入台账行"""
+    sales = round(float(sales), 2)
+    received = round(float(received), 2)
+    if abs(sales) < 1e-9 and abs(received) < 1e-9:
+        return
+    for _ in range(2):
+        updated = session.exec(
+            update(CustomerBalance)
+            .where(CustomerBalance.customer_id == customer_id)
+            .values(
+                total_sales=func.round(CustomerBalance.total_sales + sales, 2),
+                total_received=func.round(CustomerBalance.total_received + received, 2),
+                updated_at=utc_now(),
+            )
+            .returning(CustomerBalance.customer_id)
+        ).scalar_one_or_none()
+        if updated is not None:
+            return
+        try:
+            with session.begin_nested():
+                session.exec(
+                    insert(CustomerBalance).values(customer_id=customer_id, total_sales=sales, total_received=received, updated_at=utc_now())
+                )
+            return
+        except IntegrityError:
+            # 并发首笔：对方已插入台账行，回到 UPDATE 分支
+            continue
+    raise BadRequestError("更新客户台账失败，请重试")
+
+
+def get_balance(session: Session, customer_id: int) -> dict:
+    """单行读取客户累计销售额/收款额/应收余额"""
+    row = session.get(CustomerBalance, customer_id)
+    total_sales = float(row.total_sales) if row else 0.0
+    total_received = float(row.total_received) if row else 0.0
+    return {
+        "total_sales": round(total_sales, 2),
+        "total_received": round(total_received, 2),
+        "total_ar": round(total_sales - total_received, 2),
+    }
+
+
+def refresh_balance(session: Session, customer_id: int) -> None:
+    """按该客户现有单据与收款重算台账行（用于删单等难以逐笔追踪的写路径）"""
+    total_sales = float(session.exec(select(func.coalesce(func.sum(Sale.total_amount), 0)).where(Sale.customer_id == customer_id)).one() or 0)
+    total_received = float(session.exec(select(func.coalesce(func.sum(Payment.amount), 0)).where(Payment.customer_id == customer_id)).one() or 0)
+    row = session.get(CustomerBalance, customer_id) or CustomerBalance(customer_id=customer_id)
+    row.total_sales = round(total_sales, 2)
+    row.total_received = round(total_received, 2)
+    row.updated_at = utc_now()
+    session.add(row)
+
+
+def rebuild_balances(session: Session) -> int:
+    """按 sale / payment 全量重算客户台账，返回重建的客户数"""
+    sales = dict(session.exec(select(Sale.customer_id, func.sum(Sale.total_amount)).group_by(Sale.customer_id)).all())
+    received = dict(session.exec(select(Payment.customer_id, func.sum(Payment.amount)).group_by(Payment.customer_id)).all())
+
+    now = utc_now()
+    rows = [
+        {
+            "customer_id": cid,
+            "total_sales": round(float(sales.get(cid) or 0), 2),
+            "total_received": round(float(received.get(cid) or 0), 2),
+            "updated_at": now,
+        }
+        for cid in sorted(set(sales) | set(received))
+    ]
+    session.exec(delete(CustomerBalance))
+    if rows:
+        session.exec(insert(CustomerBalance), params=rows)
+    session.commit()
+    return len(rows)
@@ -2,8 +2,9 @@ from sqlalchemy import func
 from sqlmodel import Session, col, select
 
 from app.core.errors import BadRequestError, NotFoundError
-from app.models import Customer, Payment, Sale
+from app.models import Customer, CustomerBalance, Payment, Sale
 from app.schemas.sale import SaleSummary
+from app.services import customer_balance_service, payment_service
 from app.services.buyer_service import ensure_default_personal_buyer
 from app.services.pagination import paginate
 from app.services.utils import to_update_dict
@@ -59,10 +60,14 @@ def update_customer(session: Session, customer_id: int, data) -> Customer:
         if key in updates and updates[key] is not None:
             updates[key] = updates[key].strip()
 
+    renamed = "name" in updates and updates["name"] is not None and updates["name"] != customer.name
     for k, v in updates.items():
         setattr(customer, k, v)
 
     session.add(customer)
+    if renamed:
+        payment_ids = session.exec(select(Payment.id).where(Payment.customer_id == customer_id)).all()
+        payment_service.refresh_payment_search_text(session, list(payment_ids))
     session.commit()
     session.refresh(customer)
     if customer.type == "personal":
@@ -81,6 +86,9 @@ def delete_customer(session: Session, customer_id: int) -> None:
     if sale_count > 0 or payment_count > 0:
         raise ValueError("customer_has_related_records")
 
+    balance = session.get(CustomerBalance, customer_id)
+    if balance:
+        session.delete(balance)
     session.delete(customer)
     session.commit()
 
@@ -119,12 +127,4 @@ def get_customer_profile(session: Session, customer_id: int, recent_limit: int =
 
 def get_ar_summary(session: Session, customer_id: int) -> dict:
     get_customer_or_404(session, customer_id)
-
-    total_sales = float(session.exec(select(func.coalesce(func.sum(Sale.total_amount), 0)).where(Sale.customer_id == customer_id)).one() or 0)
-    total_received = float(session.exec(select(func.coalesce(func.sum(Payment.amount), 0)).where(Payment.customer_id == customer_id)).one() or 0)
-
-    return {
-        "total_sales": round(total_sales, 2),
-        "total_received": round(total_received, 2),
-        "total_ar": round(total_sales - total_received, 2),
-    }
+    return customer_balance_service.get_balance(session, customer_id)
@@ -0,0 +1,159 @@
+import json
+import traceback
+from datetime import timedelta
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy import func, update
+from sqlmodel import Session, select
+
+from app.core.config import EXPORT_DIR, EXPORT_JOB_TIMEOUT_MINUTES, EXPORT_RETENTION_HOURS
+from app.core.errors import AppError, BadRequestError, NotFoundError
+from app.core.time import parse_iso_datetime, utc_now
+from app.db.session import engine
+from app.models import ExportJob, Sale
+from app.services import sale_export_service
+
+_SLIP_FORMATS = {"xlsx", "pdf"}
+_ACTIVE_STATUSES = ("pending", "running")
+
+
+def _zip_path(job_id: int) -> Path:
+    return Path(EXPORT_DIR) / f"sale_slips_{job_id}.zip"
+
+
+def create_sale_slip_job(
+    session: Session,
+    *,
+    fmt: str,
+    customer_id: Optional[int],
+    start_date: Optional[str],
+    end_date: Optional[str],
+    sale_ids: Optional[List[int]],
+) -> ExportJob:
+    """登记批量销售单导出任务；筛选条件在此校验，实际导出由 run_sale_slip_job 在后台执行"""
+    if fmt not in _SLIP_FORMATS:
+        raise BadRequestError("仅支持 xlsx / pdf")
+    if not sale_ids and customer_id is None and not start_date and not end_date:
+        raise BadRequestError("请指定 sale_ids 或 客户/日期范围")
+    try:
+        parse_iso_datetime(start_date)
+        parse_iso_datetime(end_date, end_of_day=True)
+    except ValueError:
+        raise BadRequestError("日期格式错误")
+
+    cleanup_export_jobs(session)
+    params = {"format": fmt, "customer_id": customer_id, "start_date": start_date, "end_date": end_date, "sale_ids": sale_ids}
+    job = ExportJob(kind="sale_slips", params_json=json.dumps(params, ensure_ascii=False))
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def _selected_sale_ids(session: Session, params: dict) -> List[int]:
+    stmt = select(Sale.id)
+    if params.get("sale_ids"):
+        stmt = stmt.where(Sale.id.in_(params["sale_ids"]))
+    if params.get("customer_id") is not None:
+        stmt = stmt.where(Sale.customer_id == params["customer_id"])
+    start_dt = parse_iso_datetime(params.get("start_date"))
+    end_dt = parse_iso_datetime(params.get("end_date"), end_of_day=True)
+    if start_dt:
+        stmt = stmt.where(Sale.sale_date >= start_dt)
+    if end_dt:
+        stmt = stmt.where(Sale.sale_date <= end_dt)
+    return list(session.exec(stmt.order_by(Sale.sale_date.asc(), Sale.id.asc())).all())
+
+
+def _update_job(session: Session, job_id: int, **values) -> int:
+    """更新未结束的任务并刷新心跳（提交）；任务已被判定中断时不再改写，返回 0"""
+    result = session.exec(
+        update(ExportJob)
+        .where(ExportJob.id == job_id, ExportJob.status.in_(_ACTIVE_STATUSES))
+        .values(updated_at=utc_now(), **values)
+    )
+    session.commit()
+    return result.rowcount
+
+
+def cleanup_export_jobs(session: Session) -> None:
+    """
+    清理导出任务（启动时、新建任务时执行）：
+    - 超过 EXPORT_JOB_TIMEOUT_MINUTES 没有进度的 pending/running 任务（进程重启或崩溃遗留）标记失败，删除半成品 ZIP
+    - 完成超过 EXPORT_RETENTION_HOURS 的任务删除 ZIP，标记 expired
+    """
+    now = utc_now()
+    stale_ids = session.exec(
+        update(ExportJob)
+        .where(
+            ExportJob.status.in_(_ACTIVE_STATUSES),
+            func.coalesce(ExportJob.updated_at, ExportJob.created_at) < now - timedelta(minutes=EXPORT_JOB_TIMEOUT_MINUTES),
+        )
+        .values(status="failed", error="导出任务长时间无进度（服务可能已重启），请重新导出", finished_at=now, updated_at=now)
+        .returning(ExportJob.id)
+    ).all()
+    expired = session.exec(
+        update(ExportJob)
+        .where(ExportJob.status == "done", ExportJob.finished_at < now - timedelta(hours=EXPORT_RETENTION_HOURS))
+        .values(status="expired", file_path=None, updated_at=now)
+        .returning(ExportJob.id)
+    ).all()
+    session.commit()
+    for job_id in [*stale_ids, *expired]:
+        _zip_path(job_id[0]).unlink(missing_ok=True)
+
+
+def run_sale_slip_job(job_id: int, template_path: Optional[str] = None) -> None:
+    """
+    后台执行批量销售单导出：使用独立 Session（请求的 Session 在响应后已关闭），
+    分批生成后写入 EXPORT_DIR 下的 ZIP，每批提交一次进度。
+    """
+    with Session(engine) as session:
+        job = session.get(ExportJob, job_id)
+        if not job or job.status != "pending":
+            return
+        params = json.loads(job.params_json or "{}")
+        zip_path = _zip_path(job_id)
+        try:
+            sale_ids = _selected_sale_ids(session, params)
+            _update_job(session, job_id, status="running", total=len(sale_ids))
+
+            zip_path.parent.mkdir(parents=True, exist_ok=True)
+            sale_export_service.export_sale_slips_zip(
+                session,
+                sale_ids=sale_ids,
+                fmt=params["format"],
+                zip_path=zip_path,
+                template_path=template_path,
+                on_progress=lambda done: _update_job(session, job_id, done=done),
+            )
+            finished = _update_job(
+                session,
+                job_id,
+                status="done",
+                file_path=str(zip_path),
+                file_name=f"销售清单_{job_id}.zip",
+                finished_at=utc_now(),
+            )
+            if not finished:
+                # 运行期间已被判定中断并标记失败：结果不再有效
+                zip_path.unlink(missing_ok=True)
+        except Exception as exc:
+            session.rollback()
+            traceback.print_exc()
+            zip_path.unlink(missing_ok=True)
+            message = exc.message if isinstance(exc, AppError) else str(exc)
+            _update_job(session, job_id, status="failed", error=message[:500], finished_at=utc_now())
+
+
+def get_job(session: Session, job_id: int) -> ExportJob:
+    job = session.get(ExportJob, job_id)
+    if not job:
+        raise NotFoundError("导出任务不存在")
+    if job.status in _ACTIVE_STATUSES:
+        heartbeat = (job.updated_at or job.created_at).replace(tzinfo=utc_now().tzinfo)
+        if heartbeat < utc_now() - timedelta(minutes=EXPORT_JOB_TIMEOUT_MINUTES):
+            cleanup_export_jobs(session)
+            session.refresh(job)
+    return job
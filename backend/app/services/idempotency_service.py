@@ -0,0 +1,176 @@
+import hashlib
+import json
+from datetime import timedelta
+from typing import Callable, Optional
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import and_, delete, event, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.core.config import IDEMPOTENCY_LEASE_SECONDS, IDEMPOTENCY_TTL_HOURS
+from app.core.errors import BadRequestError, ConflictError
+from app.core.time import utc_now
+from app.models import IdempotencyKey
+
+
+def _request_hash(payload) -> str:
+    raw = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Progress:
+    """
+    分批提交的写操作的断点：saved 为此前失败请求已提交的部分结果（无则 None）；
+    save() 在调用方事务内登记当前部分结果并续租，随该批数据一起提交。
+    """
+
+    def __init__(self, session: Session, scope: str, key: str, saved):
+        self._session = session
+        self._scope = scope
+        self._key = key
+        self.saved = saved
+
+    def save(self, partial) -> None:
+        self._session.exec(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.scope == self._scope, IdempotencyKey.key == self._key)
+            .values(
+                response_json=json.dumps(jsonable_encoder(partial), ensure_ascii=False),
+                locked_until=_lease_until(),
+            )
+        )
+
+
+def _lease_until():
+    return utc_now() + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+
+
+def _begin(session: Session, scope: str, key: str, request_hash: str) -> IdempotencyKey:
+    """
+    已完成的 key 返回该记录（status=done）；否则占位（独立提交）并返回 pending 记录。
+    可由重试接管的记录：partial（分批提交中途失败，response_json 为已提交的部分结果），
+    以及租约已过期的 pending（处理进程崩溃遗留，且写操作尚未提交）。
+    committed 表示写操作已随同一事务提交、但响应未保存（提交后崩溃），不能重跑，只能报冲突。
+    """
+    now = utc_now()
+    row = session.exec(select(IdempotencyKey).where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)).first()
+    if row and row.expires_at.replace(tzinfo=now.tzinfo) <= now:
+        row = None
+    if row:
+        if row.request_hash != request_hash:
+            raise ConflictError("Idempotency-Key 已用于不同的请求")
+        if row.status == "done":
+            return row
+        if row.status == "committed" and (row.locked_until is None or row.locked_until.replace(tzinfo=now.tzinfo) <= now):
+            raise ConflictError("相同 Idempotency-Key 的请求已执行，但响应未能保存，请查询确认结果，勿重复提交")
+        # 条件更新抢占，并发重试只有一个能接管
+        claimed = session.exec(
+            update(IdempotencyKey)
+            .where(
+                IdempotencyKey.id == row.id,
+                or_(
+                    IdempotencyKey.status == "partial",
+                    and_(
+                        IdempotencyKey.status == "pending",
+                        or_(IdempotencyKey.locked_until.is_(None), IdempotencyKey.locked_until <= now),
+                    ),
+                ),
+            )
+            .values(status="pending", locked_until=_lease_until())
+        ).rowcount
+        session.commit()
+        if claimed:
+            session.refresh(row)
+            return row
+        raise ConflictError("相同 Idempotency-Key 的请求正在处理，请稍后重试")
+
+    # 顺带清理过期记录（走 expires_at 索引，通常为空）
+    session.exec(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now))
+    row = IdempotencyKey(
+        scope=scope,
+        key=key,
+        request_hash=request_hash,
+        status="pending",
+        expires_at=now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+        locked_until=_lease_until(),
+    )
+    session.add(row)
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise ConflictError("相同 Idempotency-Key 的请求正在处理，请稍后重试")
+    return row
+
+
+def _finish(session: Session, scope: str, key: str, response) -> None:
+    row = session.exec(select(IdempotencyKey).where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)).one()
+    row.status = "done"
+    row.response_json = json.dumps(response, ensure_ascii=False)
+    session.add(row)
+    session.commit()
+
+
+def _release(session: Session, scope: str, key: str) -> None:
+    """
+    执行失败：写操作未提交过的删除 key 以便重试；已分批提交过的标记 partial，重试从断点续做；
+    已提交（committed）的保留，避免重试重复写入。
+    """
+    session.rollback()
+    pending = (IdempotencyKey.scope == scope, IdempotencyKey.key == key, IdempotencyKey.status == "pending")
+    session.exec(update(IdempotencyKey).where(*pending, IdempotencyKey.response_json.is_not(None)).values(status="partial"))
+    session.exec(delete(IdempotencyKey).where(*pending, IdempotencyKey.response_json.is_(None)))
+    session.commit()
+
+
+def _mark_committed(scope: str, key: str):
+    """before_commit 监听：把 key 标记为 committed，与写操作同一事务提交"""
+
+    def _before_commit(session) -> None:
+        session.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key, IdempotencyKey.status == "pending")
+            .values(status="committed")
+        )
+
+    return _before_commit
+
+
+def run_idempotent(session: Session, *, scope: str, key: Optional[str], payload, fn: Callable, resumable: bool = False):
+    """
+    带 Idempotency-Key 执行写操作：
+    - 未带 key：直接执行
+    - 首次请求：先占位，执行成功后保存响应；失败则释放 key 以便客户端重试
+    - fn 内的提交会同时把 key 标记为 committed：若提交后、保存响应前进程崩溃，
+      租约过期后的重试不会重跑 fn（避免重复开单/收款），而是返回冲突
+    - 重放：直接返回保存的响应，不再触碰库存、单号与收款
+    - resumable=True：fn 接收 Progress（未带 key 时为 None），分批提交时随每批登记部分结果；
+      中途失败不释放 key，重试从已提交的断点继续，不会重复写入已提交的部分
+    """
+    key = (key or "").strip()
+    if not key:
+        return fn(None) if resumable else fn()
+    if len(key) > 100:
+        raise BadRequestError("Idempotency-Key 过长")
+
+    row = _begin(session, scope, key, _request_hash(payload))
+    if row.status == "done":
+        return json.loads(row.response_json or "null")
+    try:
+        if resumable:
+            saved = json.loads(row.response_json) if row.response_json else None
+            response = jsonable_encoder(fn(Progress(session, scope, key, saved)))
+        else:
+            listener = _mark_committed(scope, key)
+            event.listen(session, "before_commit", listener)
+            try:
+                response = jsonable_encoder(fn())
+            finally:
+                event.remove(session, "before_commit", listener)
+    except Exception:
+        _release(session, scope, key)
+        raise
+    _finish(session, scope, key, response)
+    return response
+
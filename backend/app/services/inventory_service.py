@@ -0,0 +1,231 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, func, insert, or_
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.core.errors import BadRequestError, NotFoundError
+from app.core.time import utc_now
+from app.models import InventorySnapshot, InventoryTxn, Product, Sale
+from app.services.pagination import keyset_paginate, normalize_page
+
+
+def _parse_iso(v: Optional[str], *, end_of_day: bool = False):
+    if not v:
+        return None
+    if len(v) == 10:
+        dt = datetime.fromisoformat(f"{v}T00:00:00+00:00")
+        return dt + timedelta(days=1) - timedelta(microseconds=1) if end_of_day else dt
+    return datetime.fromisoformat(v.replace("Z", "+00:00"))
+
+
+def _to_iso_z(dt: datetime) -> str:
+    return dt.isoformat().replace("+00:00", "Z")
+
+
+def list_inventory_txns(
+        session: Session,
+        *,
+        product_id: Optional[int] = None,
+        biz_type: Optional[str] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        page: int = 1,
+        page_size: int = 20,
+        cursor: Optional[str] = None,
+        with_total: bool = True,
+):
+    """
+    库存流水：按 (created_at, id) 降序游标分页，可按商品、业务类型、时间过滤。
+    按商品查询走 (product_id, created_at) 复合索引，不会加载该商品的全部流水。
+    """
+    if product_id is not None and not session.get(Product, product_id):
+        raise NotFoundError("商品不存在")
+
+    start_dt = _parse_iso(start_date)
+    end_dt = _parse_iso(end_date, end_of_day=True)
+
+    stmt = (
+        select(InventoryTxn, Product.name, Product.sku, Sale.sale_no)
+        .join(Product, Product.id == InventoryTxn.product_id)
+        .outerjoin(Sale, Sale.id == InventoryTxn.sale_id)
+    )
+    if product_id is not None:
+        stmt = stmt.where(InventoryTxn.product_id == product_id)
+    if biz_type:
+        stmt = stmt.where(InventoryTxn.biz_type == biz_type)
+    if start_dt:
+        stmt = stmt.where(InventoryTxn.created_at >= start_dt)
+    if end_dt:
+        stmt = stmt.where(InventoryTxn.created_at <= end_dt)
+
+    rows, total, next_cursor = keyset_paginate(
+        session,
+        stmt,
+        keys=(InventoryTxn.created_at, InventoryTxn.id),
+        row_key=lambda row: (row[0].created_at, row[0].id),
+        page=page,
+        page_size=page_size,
+        cursor=cursor,
+        with_total=with_total,
+    )
+    items = [
+        {
+            "id": t.id,
+            "product_id": t.product_id,
+            "product_name": name,
+            "sku": sku,
+            "change_qty": t.change_qty,
+            "after_qty": t.after_qty,
+            "biz_type": t.biz_type,
+            "biz_id": t.biz_id,
+            "sale_id": t.sale_id,
+            "sale_no": sale_no,
+            "note": t.note,
+            "created_at": _to_iso_z(t.created_at),
+        }
+        for t, name, sku, sale_no in rows
+    ]
+    return items, total, next_cursor
+
+
+def _stock_as_of_rows(session: Session, at: datetime) -> dict:
+    """
+    一条带窗口函数的查询还原 at 时刻各商品库存 {product_id: qty}：
+    - 取 at 及之前最后一条流水的 after_qty；
+    - 之前没有流水时，取之后第一条流水的变动前数量（after_qty - change_qty）；
+    - 始终没有流水的商品，库存未变动过，取当前库存。
+    """
+    last = (
+        select(
+            InventoryTxn.product_id,
+            InventoryTxn.after_qty,
+            func.row_number()
+            .over(partition_by=InventoryTxn.product_id, order_by=(InventoryTxn.created_at.desc(), InventoryTxn.id.desc()))
+            .label("rn"),
+        )
+        .where(InventoryTxn.created_at <= at)
+        .subquery()
+    )
+    nxt = (
+        select(
+            InventoryTxn.product_id,
+            (InventoryTxn.after_qty - InventoryTxn.change_qty).label("before_qty"),
+            func.row_number()
+            .over(partition_by=InventoryTxn.product_id, order_by=(InventoryTxn.created_at.asc(), InventoryTxn.id.asc()))
+            .label("rn"),
+        )
+        .where(InventoryTxn.created_at > at)
+        .subquery()
+    )
+    qty = func.coalesce(last.c.after_qty, nxt.c.before_qty, Product.stock_quantity)
+    rows = session.exec(
+        select(Product.id, qty)
+        .outerjoin(last, and_(last.c.product_id == Product.id, last.c.rn == 1))
+        .outerjoin(nxt, and_(nxt.c.product_id == Product.id, nxt.c.rn == 1))
+        .where(Product.created_at <= at)
+    ).all()
+    return {pid: round(float(q or 0), 2) for pid, q in rows}
+
+
+def _month_range(month: str) -> tuple[datetime, datetime]:
+    try:
+        start = datetime.strptime(month, "%Y-%m").replace(tzinfo=utc_now().tzinfo)
+    except ValueError:
+        raise BadRequestError("month 格式应为 YYYY-MM")
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def _month_end_stock(session: Session, month: str) -> dict:
+    """月末库存：已结束的月份读快照（首次计算后写入），当月实时计算"""
+    _, next_start = _month_range(month)
+    month_end = next_start - timedelta(microseconds=1)
+    if next_start > utc_now():
+        return _stock_as_of_rows(session, month_end)
+
+    cached = _read_snapshot(session, month)
+    if cached:
+        return cached
+    return build_month_snapshot(session, month)
+
+
+def _read_snapshot(session: Session, month: str) -> dict:
+    rows = session.exec(select(InventorySnapshot.product_id, InventorySnapshot.qty).where(InventorySnapshot.month == month)).all()
+    return {pid: float(q) for pid, q in rows}
+
+
+def build_month_snapshot(session: Session, month: str) -> dict:
+    """
+    计算已结束月份的月末库存并写入快照（提交）。月初由 app.build_inventory_snapshots 预先生成，
+    避免当月第一次查询上月估值时全量计算；并发首算时以先写入者为准。
+    """
+    _, next_start = _month_range(month)
+    if next_start > utc_now():
+        raise BadRequestError("只能为已结束的月份生成库存快照")
+    stock = _stock_as_of_rows(session, next_start - timedelta(microseconds=1))
+    if stock:
+        now = utc_now()
+        try:
+            with session.begin_nested():
+                session.exec(
+                    insert(InventorySnapshot),
+                    params=[{"month": month, "product_id": pid, "qty": q, "created_at": now} for pid, q in stock.items()],
+                )
+        except IntegrityError:
+            # 并发请求已写入该月快照：读取对方的结果
+            stock = _read_snapshot(session, month)
+        session.commit()
+    return stock
+
+
+def _stock_report(session: Session, stock: dict, *, q: Optional[str], page: int, page_size: int):
+    """按库存数量映射拼装报表：汇总全部商品，明细分页；估值 = 数量 × 标准成本"""
+    page, page_size = normalize_page(page, page_size)
+    stmt = select(Product.id, Product.name, Product.sku, Product.unit, Product.standard_cost).order_by(Product.id.asc())
+    if q and q.strip():
+        like = f"%{q.strip()}%"
+        stmt = stmt.where(or_(Product.name.ilike(like), Product.sku.ilike(like)))
+    products = [p for p in session.exec(stmt).all() if p.id in stock]
+
+    total_qty = 0.0
+    total_value = 0.0
+    rows = []
+    for p in products:
+        qty = stock[p.id]
+        value = round(qty * float(p.standard_cost or 0), 2)
+        total_qty += qty
+        total_value += value
+        rows.append((p, qty, value))
+
+    items = [
+        {
+            "product_id": p.id,
+            "product_name": p.name,
+            "sku": p.sku,
+            "unit": p.unit,
+            "qty": qty,
+            "standard_cost": float(p.standard_cost or 0),
+            "value": value,
+        }
+        for p, qty, value in rows[(page - 1) * page_size : page * page_size]
+    ]
+    summary = {"product_count": len(rows), "total_qty": round(total_qty, 2), "total_value": round(total_value, 2)}
+    return summary, items, len(rows)
+
+
+def stock_as_of(session: Session, *, at: str, q: Optional[str] = None, page: int = 1, page_size: int = 20):
+    try:
+        at_dt = _parse_iso(at, end_of_day=True)
+    except ValueError:
+        raise BadRequestError("时间格式不合法")
+    if not at_dt:
+        raise BadRequestError("请提供时间点 at")
+    if at_dt.tzinfo is None:
+        at_dt = at_dt.replace(tzinfo=utc_now().tzinfo)
+    return _stock_report(session, _stock_as_of_rows(session, at_dt), q=q, page=page, page_size=page_size)
+
+
+def month_end_valuation(session: Session, *, month: str, q: Optional[str] = None, page: int = 1, page_size: int = 20):
+    return _stock_report(session, _month_end_stock(session, month), q=q, page=page, page_size=page_size)
@@ -0,0 +1,225 @@
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, case, delete, func, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.core.errors import BadRequestError
+from app.core.time import utc_now
+from app.models import CustomerProductLastPrice, Sale, SaleItem, SaleOperation
+
+
+def _counted_sales():
+    """计入最近价与购买次数的单据：未作废且未整单退货"""
+    returned = (
+        select(SaleOperation.id)
+        .where(SaleOperation.sale_id == Sale.id, SaleOperation.op_type == "RETURN")
+        .exists()
+    )
+    return and_(Sale.biz_status != "VOIDED", ~returned)
+
+
+def record_sale(session: Session, *, customer_id: int, sale_id: int, sale_date: datetime, item_rows: list[dict]) -> dict:
+    """
+    开单时在调用方事务内更新客户-商品最近价：购买次数 +1、并入本单价格区间，
+    本单日期不早于已记录的最近一单时覆盖最近价/数量/日期（补录的历史单只计次数与区间）。
+    同一商品在单内出现多行时最近价取最后一行。
+    返回写入前已有的价格区间 {product_id: (min, max, sum, count)}，供开单价格校验使用。
+    """
+    lines = {}
+    bands_in = {}
+    for r in item_rows:
+        price = float(r["unit_price"])
+        lines[r["product_id"]] = (price, float(r["qty"]))
+        lo, hi, total, n = bands_in.get(r["product_id"], (price, price, 0.0, 0))
+        bands_in[r["product_id"]] = (min(lo, price), max(hi, price), total + price, n + 1)
+    if not lines:
+        return {}
+
+    t = CustomerProductLastPrice.__table__
+    newer = or_(
+        t.c.last_date < sale_date,
+        and_(t.c.last_date == sale_date, func.coalesce(t.c.last_sale_id, 0) < sale_id),
+    )
+    now = utc_now()
+    update_stmt = (
+        update(t)
+        .where(t.c.customer_id == customer_id, t.c.product_id == bindparam("b_product_id"))
+        .values(
+            purchase_count=t.c.purchase_count + 1,
+            last_price=case((newer, bindparam("b_price")), else_=t.c.last_price),
+            last_qty=case((newer, bindparam("b_qty")), else_=t.c.last_qty),
+            last_sale_id=case((newer, sale_id), else_=t.c.last_sale_id),
+            last_date=case((newer, sale_date), else_=t.c.last_date),
+            price_min=case((t.c.price_min <= bindparam("b_min"), t.c.price_min), else_=bindparam("b_min")),
+            price_max=case((t.c.price_max >= bindparam("b_max"), t.c.price_max), else_=bindparam("b_max")),
+            price_sum=t.c.price_sum + bindparam("b_sum"),
+            price_count=t.c.price_count + bindparam("b_count"),
+            updated_at=now,
+        )
+    )
+
+    pending = dict(lines)
+    bands = {}
+    for _ in range(2):
+        rows = session.exec(
+            select(
+                CustomerProductLastPrice.product_id,
+                CustomerProductLastPrice.price_min,
+                CustomerProductLastPrice.price_max,
+                CustomerProductLastPrice.price_sum,
+                CustomerProductLastPrice.price_count,
+            ).where(
+                CustomerProductLastPrice.customer_id == customer_id,
+                CustomerProductLastPrice.product_id.in_(list(pending)),
+            )
+        ).all()
+        bands.update({pid: (lo, hi, total, n) for pid, lo, hi, total, n in rows})
+        existing = {row[0] for row in rows}
+        if existing:
+            session.exec(
+                update_stmt,
+                params=[
+                    {
+                        "b_product_id": pid,
+                        "b_price": pending[pid][0],
+                        "b_qty": pending[pid][1],
+                        "b_min": bands_in[pid][0],
+                        "b_max": bands_in[pid][1],
+                        "b_sum": bands_in[pid][2],
+                        "b_count": bands_in[pid][3],
+                    }
+                    for pid in existing
+                ],
+            )
+        missing = [pid for pid in pending if pid not in existing]
+        if not missing:
+            return bands
+        try:
+            with session.begin_nested():
+                session.exec(
+                    insert(CustomerProductLastPrice),
+                    params=[
+                        {
+                            "customer_id": customer_id,
+                            "product_id": pid,
+                            "last_price": pending[pid][0],
+                            "last_qty": pending[pid][1],
+                            "last_date": sale_date,
+                            "last_sale_id": sale_id,
+                            "purchase_count": 1,
+                            "price_min": bands_in[pid][0],
+                            "price_max": bands_in[pid][1],
+                            "price_sum": bands_in[pid][2],
+                            "price_count": bands_in[pid][3],
+                            "updated_at": now,
+                        }
+                        for pid in missing
+                    ],
+                )
+            return bands
+        except IntegrityError:
+            # 并发首购：对方已插入，剩余商品回到 UPDATE 分支
+            pending = {pid: pending[pid] for pid in missing}
+    raise BadRequestError("更新最近成交价失败，请重试")
+
+
+def _recompute_rows(session: Session, *conditions) -> list[dict]:
+    """按现存（计入的）单据重算最近价行：窗口函数取每个客户-商品的最近一行，分组计数购买单数并汇总价格区间"""
+    ranked = (
+        select(
+            Sale.customer_id,
+            SaleItem.product_id,
+            SaleItem.unit_price,
+            SaleItem.sold_price,
+            SaleItem.qty,
+            Sale.id.label("sale_id"),
+            Sale.sale_date,
+            func.row_number()
+            .over(
+                partition_by=(Sale.customer_id, SaleItem.product_id),
+                order_by=(Sale.sale_date.desc(), Sale.id.desc(), SaleItem.id.desc()),
+            )
+            .label("rn"),
+        )
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .where(_counted_sales(), *conditions)
+        .subquery()
+    )
+    price = func.coalesce(func.nullif(SaleItem.unit_price, 0), SaleItem.sold_price)
+    aggregates = {
+        (cid, pid): (int(n), float(lo), float(hi), float(total), int(lines))
+        for cid, pid, n, lo, hi, total, lines in session.exec(
+            select(
+                Sale.customer_id,
+                SaleItem.product_id,
+                func.count(func.distinct(Sale.id)),
+                func.min(price),
+                func.max(price),
+                func.sum(price),
+                func.count(),
+            )
+            .join(Sale, Sale.id == SaleItem.sale_id)
+            .where(_counted_sales(), *conditions)
+            .group_by(Sale.customer_id, SaleItem.product_id)
+        ).all()
+    }
+    last_rows = session.exec(
+        select(
+            ranked.c.customer_id,
+            ranked.c.product_id,
+            ranked.c.unit_price,
+            ranked.c.sold_price,
+            ranked.c.qty,
+            ranked.c.sale_id,
+            ranked.c.sale_date,
+        ).where(ranked.c.rn == 1)
+    ).all()
+
+    now = utc_now()
+    rows = []
+    for row in last_rows:
+        purchase_count, price_min, price_max, price_sum, price_count = aggregates[(row.customer_id, row.product_id)]
+        rows.append(
+            {
+                "customer_id": row.customer_id,
+                "product_id": row.product_id,
+                "last_price": float(row.unit_price or row.sold_price),
+                "last_qty": float(row.qty),
+                "last_date": row.sale_date,
+                "last_sale_id": row.sale_id,
+                "purchase_count": purchase_count,
+                "price_min": price_min,
+                "price_max": price_max,
+                "price_sum": price_sum,
+                "price_count": price_count,
+                "updated_at": now,
+            }
+        )
+    return rows
+
+
+def refresh_last_prices(session: Session, customer_id: int, product_ids) -> None:
+    """作废/退货/删单后按剩余单据重算该客户这些商品的最近价（不提交）"""
+    product_ids = list(set(product_ids))
+    if not product_ids:
+        return
+    rows = _recompute_rows(session, Sale.customer_id == customer_id, SaleItem.product_id.in_(product_ids))
+    session.exec(
+        delete(CustomerProductLastPrice).where(
+            CustomerProductLastPrice.customer_id == customer_id,
+            CustomerProductLastPrice.product_id.in_(product_ids),
+        )
+    )
+    if rows:
+        session.exec(insert(CustomerProductLastPrice), params=rows)
+
+
+def rebuild_last_prices(session: Session) -> int:
+    """按全部单据重建最近价表，返回行数"""
+    rows = _recompute_rows(session)
+    session.exec(delete(CustomerProductLastPrice))
+    if rows:
+        session.exec(insert(CustomerProductLastPrice), params=rows)
+    session.commit()
+    return len(rows)
@@ -1,5 +1,11 @@
+import base64
+import json
+from datetime import datetime
+
 from sqlmodel import Session, select
-from sqlalchemy import func
+from sqlalchemy import and_, func, or_
+
+from app.core.errors import BadRequestError
 
 
 def normalize_page(page: int, page_size: int) -> tuple[int, int]:
@@ -17,3 +23,80 @@ def paginate(session: Session, stmt, page: int, page_size: int):
         stmt.offset((page - 1) * page_size).limit(page_size)
     ).all()
     return items, total, page, page_size
+
+
+def encode_cursor(*values) -> str:
+    """把排序键（如 paid_at, id）编码成不透明的游标字符串"""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise BadRequestError("cursor 不合法")
+    if not isinstance(values, list):
+        raise BadRequestError("cursor 不合法")
+    return values
+
+
+def _cursor_values(keys, cursor: str) -> list:
+    values = decode_cursor(cursor)
+    if len(values) != len(keys):
+        raise BadRequestError("cursor 不合法")
+    out = []
+    try:
+        # 游标只含时间（ISO 字符串）与整型主键两类排序键
+        for v in values:
+            out.append(datetime.fromisoformat(v) if isinstance(v, str) else int(v))
+    except (TypeError, ValueError):
+        raise BadRequestError("cursor 不合法")
+    return out
+
+
+def _after(keys, values):
+    """降序排序下严格位于 values 之后的行：(k0 < v0) OR (k0 = v0 AND k1 < v1) ..."""
+    clauses = []
+    for i, key in enumerate(keys):
+        eqs = [keys[j] == values[j] for j in range(i)]
+        clauses.append(and_(*eqs, key < values[i]))
+    return or_(*clauses)
+
+
+def keyset_paginate(
+    session: Session,
+    stmt,
+    *,
+    keys,
+    row_key,
+    page: int = 1,
+    page_size: int = 20,
+    cursor: str | None = None,
+    with_total: bool = True,
+):
+    """
+    按 keys（如 sale_date, id）降序的游标分页。
+    - 传 cursor 时走索引范围扫描，深翻页与第一页开销相同；否则退化为 page/offset
+    - row_key(row) 返回该行的排序键，用于生成 next_cursor
+    - with_total=False 时跳过 COUNT，total 返回 None
+    返回 (rows, total, next_cursor)
+    """
+    page, page_size = normalize_page(page, page_size)
+    total = None
+    if with_total:
+        total = int(session.exec(select(func.count()).select_from(stmt.subquery())).one() or 0)
+
+    stmt = stmt.order_by(*[k.desc() for k in keys])
+    if cursor:
+        stmt = stmt.where(_after(keys, _cursor_values(keys, cursor)))
+    else:
+        stmt = stmt.offset((page - 1) * page_size)
+    rows = session.exec(stmt.limit(page_size + 1)).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(*row_key(rows[-1]))
+    return rows, total, next_cursor
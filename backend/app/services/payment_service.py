@@ -1,12 +1,15 @@
 from datetime import datetime, timedelta
 from typing import Optional, List
 
-from sqlalchemy import func
+from sqlalchemy import case, func, insert, update
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlmodel import Session, select
 
 from app.core.errors import BadRequestError, NotFoundError
 from app.core.time import utc_now
 from app.models import Customer, Payment, PaymentAllocation, Sale
+from app.services import customer_balance_service, last_price_service
 from app.services.sale_service import get_sale
 
 _ALLOWED_METHODS = {"cash", "wechat", "alipay", "bank_transfer", "bank", "transfer", "other", "现金", "微信", "支付宝", "银行卡", "转账", "其他"}
@@ -41,10 +44,9 @@ def _sum_sale_paid(session: Session, sale_id: int) -> float:
     return round(direct + alloc, 2)
 
 
-def recompute_sale_payment(session: Session, sale: Sale):
-    paid = _sum_sale_paid(session, sale.id)
-    sale.paid_amount = round(paid, 2)
-    sale.ar_amount = round(max(float(sale.total_amount) - sale.paid_amount, 0), 2)
+def _apply_sale_status(sale: Sale) -> None:
+    """根据 paid_amount 刷新未收金额与收款状态"""
+    sale.ar_amount = round(max(float(sale.total_amount) - float(sale.paid_amount), 0), 2)
     if sale.paid_amount <= 0:
         sale.payment_status = "unpaid"
     elif sale.paid_amount + 1e-6 >= float(sale.total_amount):
@@ -54,9 +56,103 @@ def recompute_sale_payment(session: Session, sale: Sale):
     sale.settlement_status = {"unpaid": "UNPAID", "partial": "PARTIAL", "paid": "PAID"}[sale.payment_status]
     if sale.payment_status == "unpaid":
         sale.payment_method = None
+
+
+def apply_sale_paid_deltas(session: Session, deltas: dict) -> dict:
+    """
+    增量维护已收金额：一条 UPDATE sale SET paid_amount = paid_amount + CASE id ... END 批量作用于多张单，
+    未收金额与收款状态在同一语句里按新的已收金额推导，RETURNING 带回结果，无需再查 SUM 或重读。
+    返回 {sale_id: {"paid_amount", "balance", "status", ...}}。
+    """
+    deltas = {sid: round(float(d), 2) for sid, d in deltas.items() if abs(float(d)) > 1e-9}
+    if not deltas:
+        return {}
+    new_paid = func.round(Sale.paid_amount + case(deltas, value=Sale.id, else_=0), 2)
+    rows = session.exec(
+        update(Sale)
+        .where(Sale.id.in_(list(deltas)))
+        .values(
+            paid_amount=new_paid,
+            ar_amount=case((Sale.total_amount - new_paid > 0, func.round(Sale.total_amount - new_paid, 2)), else_=0),
+            payment_status=case((new_paid <= 0, "unpaid"), (new_paid + 1e-6 >= Sale.total_amount, "paid"), else_="partial"),
+            settlement_status=case((new_paid <= 0, "UNPAID"), (new_paid + 1e-6 >= Sale.total_amount, "PAID"), else_="PARTIAL"),
+            payment_method=case((new_paid <= 0, None), else_=Sale.payment_method),
+        )
+        .returning(Sale.id, Sale.paid_amount, Sale.ar_amount, Sale.payment_status, Sale.settlement_status, Sale.payment_method)
+        .execution_options(synchronize_session=False)
+    ).all()
+    return {
+        r.id: {
+            "paid_amount": float(r.paid_amount),
+            "balance": float(r.ar_amount),
+            "status": r.payment_status,
+            "settlement_status": r.settlement_status,
+            "payment_method": r.payment_method,
+        }
+        for r in rows
+    }
+
+
+def apply_sale_paid_delta(session: Session, sale: Sale, delta: float) -> None:
+    """单张单的增量维护，并把结果同步到已加载的 sale 对象上"""
+    updated = apply_sale_paid_deltas(session, {sale.id: delta}).get(sale.id)
+    if not updated:
+        return
+    set_committed_value(sale, "paid_amount", updated["paid_amount"])
+    set_committed_value(sale, "ar_amount", updated["balance"])
+    set_committed_value(sale, "payment_status", updated["status"])
+    set_committed_value(sale, "settlement_status", updated["settlement_status"])
+    set_committed_value(sale, "payment_method", updated["payment_method"])
+
+
+def recompute_sale_payment(session: Session, sale: Sale):
+    """全量重算（删单、对账修复用）"""
+    sale.paid_amount = _sum_sale_paid(session, sale.id)
+    _apply_sale_status(sale)
     session.add(sale)
 
 
+def reconcile_sale_payments(session: Session, *, chunk_size: int = 500, repair: bool = True) -> dict:
+    """
+    按 id 分块核对 sale.paid_amount 与 payment + payment_allocation 的全量合计，
+    发现偏差时（repair=True）修复并逐块提交。
+    """
+    checked = 0
+    drifted = []
+    last_id = 0
+    while True:
+        sales = session.exec(select(Sale).where(Sale.id > last_id).order_by(Sale.id.asc()).limit(chunk_size)).all()
+        if not sales:
+            break
+        ids = [s.id for s in sales]
+        last_id = ids[-1]
+        direct = dict(
+            session.exec(
+                select(Payment.sale_id, func.sum(Payment.amount)).where(Payment.sale_id.in_(ids)).group_by(Payment.sale_id)
+            ).all()
+        )
+        alloc = dict(
+            session.exec(
+                select(PaymentAllocation.sale_id, func.sum(PaymentAllocation.amount))
+                .where(PaymentAllocation.sale_id.in_(ids))
+                .group_by(PaymentAllocation.sale_id)
+            ).all()
+        )
+        for s in sales:
+            checked += 1
+            expected = round(float(direct.get(s.id) or 0) + float(alloc.get(s.id) or 0), 2)
+            if abs(expected - float(s.paid_amount or 0)) > 0.005:
+                drifted.append({"sale_id": s.id, "sale_no": s.sale_no, "stored": s.paid_amount, "expected": expected})
+                if repair:
+                    s.paid_amount = expected
+                    _apply_sale_status(s)
+                    session.add(s)
+        if repair:
+            session.commit()
+        session.expunge_all()
+    return {"checked": checked, "drifted": len(drifted), "repaired": len(drifted) if repair else 0, "items": drifted}
+
+
 def create_payment(session: Session, sale_id: int, amount: float, method: str, paid_at: Optional[str], note: Optional[str]):
     sale = session.get(Sale, sale_id)
     if not sale:
@@ -81,7 +177,9 @@ def create_payment(session: Session, sale_id: int, amount: float, method: str, p
     session.add(payment)
     session.flush()
 
-    recompute_sale_payment(session, sale)
+    apply_sale_paid_delta(session, sale, payment.amount)
+    customer_balance_service.apply_balance_delta(session, sale.customer_id, received=payment.amount)
+    refresh_payment_search_text(session, [payment.id])
     session.commit()
     session.refresh(payment)
     return payment
@@ -112,8 +210,10 @@ def submit_sale_payment(session: Session, sale_id: int, pay_type: str, method: s
         )
         session.add(created)
         session.flush()
+        refresh_payment_search_text(session, [created.id])
+        customer_balance_service.apply_balance_delta(session, sale.customer_id, received=created.amount)
 
-    recompute_sale_payment(session, sale)
+    apply_sale_paid_delta(session, sale, created.amount if created else 0)
     session.commit()
     updated_sale = get_sale(session, sale.id)
 
@@ -188,38 +288,74 @@ def list_sale_payments(session: Session, sale_id: int):
     return items
 
 
+def _allocated_sale_nos(session: Session, payment_ids: List[int]) -> dict:
+    """payment_id -> 分配到的销售单号（按单据日期升序），一次查询取回整页"""
+    if not payment_ids:
+        return {}
+    rows = session.exec(
+        select(PaymentAllocation.payment_id, Sale.sale_no)
+        .join(Sale, Sale.id == PaymentAllocation.sale_id)
+        .where(PaymentAllocation.payment_id.in_(payment_ids))
+        .order_by(PaymentAllocation.payment_id, Sale.sale_date.asc(), Sale.id.asc())
+    ).all()
+    out: dict = {}
+    for payment_id, sale_no in rows:
+        out.setdefault(payment_id, []).append(sale_no)
+    return out
+
+
+def _merge_sale_nos(direct_sale_no: Optional[str], alloc_sale_nos: List[str]) -> List[str]:
+    sale_nos = [direct_sale_no] if direct_sale_no else []
+    for no in alloc_sale_nos:
+        if no not in sale_nos:
+            sale_nos.append(no)
+    return sale_nos
+
+
+def _build_search_text(customer_name: Optional[str], sale_nos: List[str], note: Optional[str]) -> str:
+    parts = [customer_name or "", *sale_nos, note or ""]
+    # 不截断：一笔收款可能分配到很多单，截断会丢掉后面的单号
+    return " ".join(x for x in parts if x).lower()
+
+
+def refresh_payment_search_text(session: Session, payment_ids: List[int]) -> None:
+    """重建收款流水检索字段（客户名 + 关联单号 + 备注），在收款/分配/删单后调用"""
+    ids = sorted({pid for pid in payment_ids if pid})
+    for i in range(0, len(ids), 500):
+        chunk = ids[i : i + 500]
+        rows = session.exec(
+            select(Payment, Customer.name, Sale.sale_no)
+            .join(Customer, Customer.id == Payment.customer_id)
+            .outerjoin(Sale, Sale.id == Payment.sale_id)
+            .where(Payment.id.in_(chunk))
+        ).all()
+        alloc_map = _allocated_sale_nos(session, chunk)
+        for p, customer_name, direct_sale_no in rows:
+            p.search_text = _build_search_text(customer_name, _merge_sale_nos(direct_sale_no, alloc_map.get(p.id, [])), p.note)
+            session.add(p)
+
+
 def list_customer_payments(session: Session, customer_id: int, *, page: int, page_size: int, start_date: Optional[str], end_date: Optional[str]):
     customer = session.get(Customer, customer_id)
     if not customer:
         raise NotFoundError("客户不存在")
 
-    stmt = select(Payment).where(Payment.customer_id == customer_id)
+    stmt = select(Payment, Sale.sale_no).outerjoin(Sale, Sale.id == Payment.sale_id).where(Payment.customer_id == customer_id)
     if start_date:
         stmt = stmt.where(Payment.paid_at >= _parse_iso_dt(start_date))
     if end_date:
         stmt = stmt.where(Payment.paid_at <= _parse_iso_dt(end_date, end_of_day=True))
 
-    rows_all = session.exec(stmt.order_by(Payment.paid_at.desc(), Payment.id.desc())).all()
-    total = len(rows_all)
-    rows = rows_all[(page - 1) * page_size : page * page_size]
+    total = int(session.exec(select(func.count()).select_from(stmt.subquery())).one() or 0)
+    rows = session.exec(
+        stmt.order_by(Payment.paid_at.desc(), Payment.id.desc()).offset((page - 1) * page_size).limit(page_size)
+    ).all()
+    alloc_map = _allocated_sale_nos(session, [p.id for p, _ in rows])
 
     items = []
-    for p in rows:
-        sale_nos = []
-        if p.sale_id:
-            sale = session.get(Sale, p.sale_id)
-            if sale:
-                sale_nos = [sale.sale_no]
-        alloc_sales = session.exec(
-            select(Sale)
-            .join(PaymentAllocation, PaymentAllocation.sale_id == Sale.id)
-            .where(PaymentAllocation.payment_id == p.id)
-            .order_by(Sale.sale_date.asc(), Sale.id.asc())
-        ).all()
-        for s in alloc_sales:
-            if s.sale_no not in sale_nos:
-                sale_nos.append(s.sale_no)
-
+    for p, direct_sale_no in rows:
+        alloc_sale_nos = alloc_map.get(p.id, [])
+        sale_nos = _merge_sale_nos(direct_sale_no, alloc_sale_nos)
         items.append(
             {
                 "id": p.id,
@@ -232,7 +368,7 @@ def list_customer_payments(session: Session, customer_id: int, *, page: int, pag
                 "pay_type": p.pay_type,
                 "paid_at": _to_iso_z(p.paid_at),
                 "note": p.note,
-                "has_allocations": len(sale_nos) > 1 or bool(alloc_sales),
+                "has_allocations": len(sale_nos) > 1 or bool(alloc_sale_nos),
             }
         )
     return items, total
@@ -268,6 +404,66 @@ def list_open_sales(session: Session, customer_id: int, *, page: int, page_size:
     return items, total
 
 
+def _open_sale_stmt(customer_id: int):
+    return (
+        select(Sale.id, Sale.sale_no, Sale.paid_amount, Sale.ar_amount, Sale.payment_status)
+        .where(Sale.customer_id == customer_id)
+        .order_by(Sale.sale_date.asc(), Sale.id.asc())
+    )
+
+
+def _plan_allocations(candidates, amount: float):
+    """按最早优先逐单冲抵，金额用完立即停止读取；返回 [(row, applied)] 与剩余金额"""
+    remaining = round(float(amount), 2)
+    plan = []
+    for row in candidates:
+        if remaining <= 0:
+            break
+        applied = round(min(float(row.ar_amount), remaining), 2)
+        if applied <= 0:
+            continue
+        plan.append((row, applied))
+        remaining = round(remaining - applied, 2)
+    return plan, remaining
+
+
+def _write_allocations(session: Session, *, customer: Customer, plan, amount: float, method: str, paid_at: Optional[str], note: Optional[str]):
+    """一次写入收款、批量插入分配明细、一条 UPDATE 更新所有相关单据余额，然后提交"""
+    payment = Payment(
+        receipt_no=_gen_receipt_no(),
+        customer_id=customer.id,
+        sale_id=None,
+        pay_type="partial",
+        amount=round(float(amount), 2),
+        method=method,
+        paid_at=_parse_iso_dt(paid_at),
+        note=note,
+        search_text=_build_search_text(customer.name, [row.sale_no for row, _ in plan], note),
+    )
+    session.add(payment)
+    session.flush()
+
+    session.exec(
+        insert(PaymentAllocation),
+        params=[{"payment_id": payment.id, "sale_id": row.id, "amount": applied} for row, applied in plan],
+    )
+    updated = apply_sale_paid_deltas(session, {row.id: applied for row, applied in plan})
+    customer_balance_service.apply_balance_delta(session, customer.id, received=payment.amount)
+
+    payment_out = {
+        "id": payment.id,
+        "receipt_no": payment.receipt_no,
+        "customer_id": payment.customer_id,
+        "amount": payment.amount,
+        "method": payment.method,
+        "paid_at": _to_iso_z(payment.paid_at),
+        "note": payment.note,
+    }
+    allocations = [{"sale_id": row.id, "sale_no": row.sale_no, "amount": applied} for row, applied in plan]
+    session.commit()
+    return payment_out, allocations, updated
+
+
 def allocate_to_sales(session: Session, *, customer_id: int, sale_ids: List[int], amount: float, method: str, paid_at: Optional[str], note: Optional[str]):
     if amount <= 0:
         raise BadRequestError("金额必须大于0")
@@ -277,10 +473,9 @@ def allocate_to_sales(session: Session, *, customer_id: int, sale_ids: List[int]
     if not customer:
         raise NotFoundError("客户不存在")
 
-    sales = session.exec(select(Sale).where(Sale.customer_id == customer_id, Sale.id.in_(sale_ids))).all()
+    sales = session.exec(_open_sale_stmt(customer_id).where(Sale.id.in_(sale_ids))).all()
     if not sales:
         raise BadRequestError("未找到可分配订单")
-    sales.sort(key=lambda s: (s.sale_date, s.id))
 
     open_sales = [s for s in sales if float(s.ar_amount) > 0]
     if not open_sales:
@@ -290,57 +485,21 @@ def allocate_to_sales(session: Session, *, customer_id: int, sale_ids: List[int]
     if amount > selected_total + 1e-6:
         raise BadRequestError("收款金额超过所选订单未收合计")
 
-    payment = Payment(
-        receipt_no=_gen_receipt_no(),
-        customer_id=customer_id,
-        sale_id=None,
-        pay_type="partial",
-        amount=round(float(amount), 2),
-        method=method,
-        paid_at=_parse_iso_dt(paid_at),
-        note=note,
+    plan, _ = _plan_allocations(open_sales, amount)
+    payment_out, allocations, updated = _write_allocations(
+        session, customer=customer, plan=plan, amount=amount, method=method, paid_at=paid_at, note=note
     )
-    session.add(payment)
-    session.flush()
-
-    remaining = round(float(amount), 2)
-    allocations = []
-    for s in open_sales:
-        if remaining <= 0:
-            break
-        applied = round(min(float(s.ar_amount), remaining), 2)
-        if applied <= 0:
-            continue
-        alloc = PaymentAllocation(payment_id=payment.id, sale_id=s.id, amount=applied)
-        session.add(alloc)
-        # 修复：分配金额必须立即 Flush，确保 sum(allocations) 能够被看到
-        session.flush()
-        remaining = round(remaining - applied, 2)
-        recompute_sale_payment(session, s)
-        allocations.append({"sale_id": s.id, "sale_no": s.sale_no, "amount": applied})
-
-    session.commit()
-    for s in open_sales:
-        session.refresh(s)
 
     return {
-        "payment": {
-            "id": payment.id,
-            "receipt_no": payment.receipt_no,
-            "customer_id": payment.customer_id,
-            "amount": payment.amount,
-            "method": payment.method,
-            "paid_at": _to_iso_z(payment.paid_at),
-            "note": payment.note,
-        },
+        "payment": payment_out,
         "allocations": allocations,
         "sales": [
             {
                 "sale_id": s.id,
                 "sale_no": s.sale_no,
-                "paid_amount": s.paid_amount,
-                "balance": s.ar_amount,
-                "status": s.payment_status,
+                "paid_amount": updated[s.id]["paid_amount"] if s.id in updated else s.paid_amount,
+                "balance": updated[s.id]["balance"] if s.id in updated else s.ar_amount,
+                "status": updated[s.id]["status"] if s.id in updated else s.payment_status,
             }
             for s in open_sales
         ],
@@ -396,10 +555,24 @@ def batch_apply(
 def allocate_customer_receipt(session: Session, *, customer_id: int, method: str, amount: float, note: Optional[str], allocate_mode: str = "oldest_first"):
     if allocate_mode != "oldest_first":
         raise BadRequestError("目前仅支持 oldest_first")
-    sales = session.exec(select(Sale.id).where(Sale.customer_id == customer_id, Sale.ar_amount > 0).order_by(Sale.sale_date.asc(), Sale.id.asc())).all()
-    sale_ids = [sid for sid in sales]
-    result = allocate_to_sales(session, customer_id=customer_id, sale_ids=sale_ids, amount=amount, method=method, paid_at=None, note=note)
-    return 1, result["allocations"]
+    if amount <= 0:
+        raise BadRequestError("金额必须大于0")
+    if method not in _ALLOWED_METHODS:
+        raise BadRequestError("付款方式不合法")
+    customer = session.get(Customer, customer_id)
+    if not customer:
+        raise NotFoundError("客户不存在")
+
+    result = session.exec(_open_sale_stmt(customer_id).where(Sale.ar_amount > 0).execution_options(yield_per=100))
+    plan, remaining = _plan_allocations(result, amount)
+    result.close()
+    if not plan:
+        raise BadRequestError("未找到可分配订单")
+    if remaining > 1e-6:
+        raise BadRequestError("收款金额超过所选订单未收合计")
+
+    _, allocations, _ = _write_allocations(session, customer=customer, plan=plan, amount=amount, method=method, paid_at=None, note=note)
+    return 1, allocations
 
 
 def customer_delete_check(session: Session, customer_id: int):
@@ -448,6 +621,7 @@ def delete_customer_records(session: Session, *, customer_id: int, sale_ids: Lis
         raise NotFoundError("客户不存在")
 
     touched_sale_ids = set()
+    touched_payment_ids = set()
 
     # delete payments first (and rollback sales by recompute)
     for pid in payment_ids:
@@ -463,11 +637,21 @@ def delete_customer_records(session: Session, *, customer_id: int, sale_ids: Lis
         session.delete(p)
 
     # delete sales and cleanup allocations/payments that become empty
-    for sid in sale_ids:
-        s = session.get(Sale, sid)
-        if not s or s.customer_id != customer_id:
-            continue
+    # 关系默认不加载（lazy=raise）；删单需要级联的子表在这里一次性预加载
+    sales_to_delete = session.exec(
+        select(Sale)
+        .where(Sale.id.in_(sale_ids), Sale.customer_id == customer_id)
+        .options(
+            selectinload(Sale.items),
+            selectinload(Sale.payments),
+            selectinload(Sale.payment_allocations),
+            selectinload(Sale.operations),
+        )
+    ).all() if sale_ids else []
+    deleted_product_ids = set()
+    for s in sales_to_delete:
         touched_sale_ids.add(s.id)
+        deleted_product_ids.update(si.product_id for si in s.items)
 
         allocs = session.exec(select(PaymentAllocation).where(PaymentAllocation.sale_id == s.id)).all()
         affected_payment_ids = set(a.payment_id for a in allocs)
@@ -475,6 +659,7 @@ def delete_customer_records(session: Session, *, customer_id: int, sale_ids: Lis
             session.delete(a)
 
         # cleanup orphan payments after removing allocations
+        touched_payment_ids.update(affected_payment_ids)
         for pid in affected_payment_ids:
             pay = session.get(Payment, pid)
             if not pay:
@@ -489,12 +674,16 @@ def delete_customer_records(session: Session, *, customer_id: int, sale_ids: Lis
         session.delete(s)
 
     session.flush()
+    # 删单会级联删除该单的直接收款，按剩余记录重算该客户台账
+    customer_balance_service.refresh_balance(session, customer_id)
+    last_price_service.refresh_last_prices(session, customer_id, deleted_product_ids)
 
     # recompute remaining touched sales
     for sid in list(touched_sale_ids):
         s = session.get(Sale, sid)
         if s:
             recompute_sale_payment(session, s)
+    refresh_payment_search_text(session, list(touched_payment_ids))
 
     session.commit()
 
@@ -1,10 +1,15 @@
-from datetime import datetime
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
 
+from sqlalchemy import func
 from sqlmodel import Session, select
 
-from app.core.errors import NotFoundError
-from app.models import Customer, CustomerContact, Product, Sale, SaleItem
-from app.schemas.pricing import ProductTrendItem, PricingLastResponse
+from app.core.config import PRICE_STATS_CACHE_SIZE
+from app.core.errors import BadRequestError, NotFoundError
+from app.models import Customer, CustomerContact, CustomerProductLastPrice, Product, Sale, SaleItem, SaleOperation
+from app.schemas.pricing import FrequentProductItem, PricingBatchItem, PricingBatchResponse, ProductTrendItem, PricingLastResponse
+from app.services import last_price_service
 
 
 def _parse_iso(v: str | None):
@@ -16,37 +21,95 @@ def _parse_iso(v: str | None):
 
 
 def last_pricing(session: Session, customer_id: int, product_id: int) -> PricingLastResponse:
-    customer = session.get(Customer, customer_id)
-    if not customer:
-        raise NotFoundError("客户不存在")
-
+    """最近成交价：读 customer_product_last_price 的一行（主键），不再扫描历史明细"""
     product = session.get(Product, product_id)
     if not product:
         raise NotFoundError("商品不存在")
 
-    stmt = (
-        select(SaleItem, Sale)
-        .join(Sale, Sale.id == SaleItem.sale_id)
-        .where(Sale.customer_id == customer_id)
-        .where(SaleItem.product_id == product_id)
-        .order_by(Sale.sale_date.desc(), Sale.id.desc(), SaleItem.id.desc())
-        .limit(1)
-    )
-    row = session.exec(stmt).first()
-
+    row = session.get(CustomerProductLastPrice, (customer_id, product_id))
     if not row:
+        if not session.get(Customer, customer_id):
+            raise NotFoundError("客户不存在")
         return PricingLastResponse(found=False, standard_price=product.standard_price)
 
-    si, sale = row
     return PricingLastResponse(
         found=True,
         standard_price=product.standard_price,
-        last_price=si.unit_price or si.sold_price,
-        last_date=sale.sale_date,
-        last_qty=si.qty,
+        last_price=row.last_price,
+        last_date=row.last_date,
+        last_qty=row.last_qty,
     )
 
 
+def last_pricing_batch(session: Session, customer_id: int, product_ids: list[int]) -> PricingBatchResponse:
+    """整单取价：一次查询取回各商品的标准价、库存与该客户最近成交价，按请求顺序返回"""
+    if not session.get(Customer, customer_id):
+        raise NotFoundError("客户不存在")
+
+    product_ids = list(dict.fromkeys(product_ids))
+    rows = session.exec(
+        select(
+            Product.id,
+            Product.standard_price,
+            Product.stock_quantity,
+            CustomerProductLastPrice.last_price,
+            CustomerProductLastPrice.last_date,
+            CustomerProductLastPrice.last_qty,
+        )
+        .outerjoin(
+            CustomerProductLastPrice,
+            (CustomerProductLastPrice.product_id == Product.id) & (CustomerProductLastPrice.customer_id == customer_id),
+        )
+        .where(Product.id.in_(product_ids))
+    ).all()
+    by_id = {row.id: row for row in rows}
+
+    items = [
+        PricingBatchItem(
+            product_id=pid,
+            found=by_id[pid].last_date is not None,
+            standard_price=by_id[pid].standard_price,
+            stock_quantity=by_id[pid].stock_quantity,
+            last_price=by_id[pid].last_price,
+            last_date=by_id[pid].last_date,
+            last_qty=by_id[pid].last_qty,
+        )
+        for pid in product_ids
+        if pid in by_id
+    ]
+    return PricingBatchResponse(items=items, missing_product_ids=[pid for pid in product_ids if pid not in by_id])
+
+
+def frequent_products(session: Session, customer_id: int, limit: int = 20) -> list[FrequentProductItem]:
+    """该客户常买商品：按购买单数、最近购买时间排序"""
+    limit = max(1, min(int(limit or 20), 100))
+    if not session.get(Customer, customer_id):
+        raise NotFoundError("客户不存在")
+
+    rows = session.exec(
+        select(CustomerProductLastPrice, Product)
+        .join(Product, Product.id == CustomerProductLastPrice.product_id)
+        .where(CustomerProductLastPrice.customer_id == customer_id)
+        .order_by(CustomerProductLastPrice.purchase_count.desc(), CustomerProductLastPrice.last_date.desc())
+        .limit(limit)
+    ).all()
+    return [
+        FrequentProductItem(
+            product_id=p.id,
+            name=p.name,
+            sku=p.sku,
+            unit=p.unit,
+            standard_price=p.standard_price,
+            stock_quantity=p.stock_quantity,
+            last_price=lp.last_price,
+            last_qty=lp.last_qty,
+            last_date=lp.last_date,
+            purchase_count=lp.purchase_count,
+        )
+        for lp, p in rows
+    ]
+
+
 def pricing_history(session: Session, customer_id: int, product_id: int, *, page: int = 1, page_size: int = 20, start_date: str | None = None, end_date: str | None = None, limit: int | None = None):
     customer = session.get(Customer, customer_id)
     if not customer:
@@ -62,36 +125,57 @@ def pricing_history(session: Session, customer_id: int, product_id: int, *, page
     start_dt = _parse_iso(start_date)
     end_dt = _parse_iso(end_date)
 
-    stmt = (
-        select(SaleItem, Sale, CustomerContact)
+    # 只用到 sale_item(product_id, sale_id) 与 sale(customer_id, sale_date) 两个索引即可完成过滤、计数与排序
+    key_stmt = (
+        select(SaleItem.id)
         .join(Sale, Sale.id == SaleItem.sale_id)
-        .outerjoin(CustomerContact, CustomerContact.id == Sale.buyer_id)
         .where(Sale.customer_id == customer_id)
         .where(SaleItem.product_id == product_id)
     )
     if start_dt:
-        stmt = stmt.where(Sale.sale_date >= start_dt)
+        key_stmt = key_stmt.where(Sale.sale_date >= start_dt)
     if end_dt:
-        stmt = stmt.where(Sale.sale_date <= end_dt)
+        key_stmt = key_stmt.where(Sale.sale_date <= end_dt)
 
-    rows_all = session.exec(stmt.order_by(Sale.sale_date.desc(), Sale.id.desc(), SaleItem.id.desc())).all()
-    total = len(rows_all)
-    s = (page - 1) * page_size
-    rows = rows_all[s : s + page_size]
+    total = int(session.exec(select(func.count()).select_from(key_stmt.subquery())).one() or 0)
+    order_by = (Sale.sale_date.desc(), Sale.id.desc(), SaleItem.id.desc())
+    page_ids = session.exec(key_stmt.order_by(*order_by).offset((page - 1) * page_size).limit(page_size)).all()
+    if not page_ids:
+        return [], total
+
+    # 只为本页的行回表取明细列
+    rows = session.exec(
+        select(
+            SaleItem.qty,
+            SaleItem.unit_price,
+            SaleItem.sold_price,
+            SaleItem.remark,
+            Sale.id,
+            Sale.sale_no,
+            Sale.sale_date,
+            Sale.project,
+            Sale.contact_name_snapshot,
+            CustomerContact.name.label("buyer_name"),
+        )
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .outerjoin(CustomerContact, CustomerContact.id == Sale.buyer_id)
+        .where(SaleItem.id.in_(page_ids))
+        .order_by(*order_by)
+    ).all()
 
     items = [
         {
-            "date": sale.sale_date,
-            "qty": si.qty,
-            "unit_price": si.unit_price or si.sold_price,
-            "sold_price": si.unit_price or si.sold_price,
-            "sale_id": sale.id,
-            "sale_no": sale.sale_no,
-            "project": sale.project,
-            "buyer_name": buyer.name if buyer else sale.contact_name_snapshot,
-            "note": si.remark,
+            "date": row.sale_date,
+            "qty": row.qty,
+            "unit_price": row.unit_price or row.sold_price,
+            "sold_price": row.unit_price or row.sold_price,
+            "sale_id": row.id,
+            "sale_no": row.sale_no,
+            "project": row.project,
+            "buyer_name": row.buyer_name or row.contact_name_snapshot,
+            "note": row.remark,
         }
-        for (si, sale, buyer) in rows
+        for row in rows
     ]
     return items, total
 
@@ -124,3 +208,148 @@ def product_trend(session: Session, product_id: int, limit: int = 50):
         )
         for (si, sale, c) in rows
     ]
+
+
+_STATS_PERCENTILES = (("p10", 0.10), ("p25", 0.25), ("median", 0.50), ("p75", 0.75), ("p90", 0.90))
+_stats_cache: OrderedDict = OrderedDict()
+_stats_cache_lock = threading.Lock()
+
+
+def _grouped_price_stats(np, codes, price, qty, n_groups: int) -> dict:
+    """
+    按组一次性算数量加权的价格统计（向量化）：组内按价格排序后，
+    累计数量占比首次达到 p 的价格即加权分位数；min/max 为组内首尾价格。
+    """
+    order = np.lexsort((price, codes))
+    c, p, q = codes[order], price[order], qty[order]
+
+    counts = np.bincount(c, minlength=n_groups)
+    total_qty = np.bincount(c, weights=q, minlength=n_groups)
+    amount = np.bincount(c, weights=p * q, minlength=n_groups)
+    ends = np.cumsum(counts) - 1
+    starts = ends - counts + 1
+
+    cum = np.cumsum(q)
+    within = cum - np.repeat(cum[starts] - q[starts], counts)
+    # 组号 + 组内累计占比：整体单调递增，可对所有组一次 searchsorted
+    key = c + within / np.repeat(total_qty, counts)
+    out = {
+        "count": counts,
+        "total_qty": total_qty,
+        "min": p[starts],
+        "max": p[ends],
+        "mean": amount / total_qty,
+    }
+    groups = np.arange(n_groups)
+    for name, pct in _STATS_PERCENTILES:
+        idx = np.minimum(np.searchsorted(key, groups + pct - 1e-9, side="left"), ends)
+        out[name] = p[idx]
+    return out
+
+
+def _stats_rows(stats: dict, i: int) -> dict:
+    return {
+        "count": int(stats["count"][i]),
+        "total_qty": round(float(stats["total_qty"][i]), 2),
+        "min": round(float(stats["min"][i]), 2),
+        "max": round(float(stats["max"][i]), 2),
+        "mean": round(float(stats["mean"][i]), 2),
+        **{name: round(float(stats[name][i]), 2) for name, _ in _STATS_PERCENTILES},
+    }
+
+
+def _month_key(dt) -> int:
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return dt.year * 100 + dt.month
+
+
+def _load_price_columns(np, session: Session, product_id: int, chunk_size: int):
+    """
+    服务端游标分批读取 (单据日期, 客户, 数量, 单价) 四列，逐批转成数组后拼接。
+    月份在 Python 中由日期算出（年*100+月，UTC），不依赖特定数据库的日期函数。
+    """
+    stmt = (
+        select(
+            Sale.sale_date,
+            Sale.customer_id,
+            SaleItem.qty,
+            func.coalesce(func.nullif(SaleItem.unit_price, 0), SaleItem.sold_price),
+        )
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .where(SaleItem.product_id == product_id, last_price_service._counted_sales())
+    )
+    months, customers, qtys, prices = [], [], [], []
+    result = session.exec(stmt.execution_options(stream_results=True, yield_per=chunk_size))
+    try:
+        for part in result.partitions():
+            dates, cid, q, p = zip(*part)
+            months.append(np.fromiter((_month_key(d) for d in dates), dtype=np.int64, count=len(dates)))
+            customers.append(np.asarray(cid, dtype=np.int64))
+            qtys.append(np.asarray(q, dtype=np.float64))
+            prices.append(np.asarray(p, dtype=np.float64))
+    finally:
+        result.close()
+    if not months:
+        return None
+    return np.concatenate(months), np.concatenate(customers), np.concatenate(qtys), np.concatenate(prices)
+
+
+def price_statistics(session: Session, product_id: int, *, chunk_size: int = 5000) -> dict:
+    """
+    商品全部历史成交价的统计（整体 / 按客户 / 按月，均按数量加权），不计已作废、已退货的单。
+    结果按（最近一张含该商品的单据 id、明细行数、最新单据操作 id）缓存：
+    新开单、删单、作废/退货都会使缓存键变化。
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise BadRequestError("请安装 numpy 库以支持价格统计")
+
+    product = session.get(Product, product_id)
+    if not product:
+        raise NotFoundError("商品不存在")
+
+    last_sale_id, line_count = session.exec(
+        select(func.max(SaleItem.sale_id), func.count()).where(SaleItem.product_id == product_id)
+    ).one()
+    last_op_id = session.exec(select(func.max(SaleOperation.id))).one()
+    key = (product_id, last_sale_id, line_count, last_op_id)
+    with _stats_cache_lock:
+        if key in _stats_cache:
+            _stats_cache.move_to_end(key)
+            return _stats_cache[key]
+
+    result = {"product_id": product_id, "last_sale_id": last_sale_id, "overall": None, "by_customer": [], "by_month": []}
+    columns = _load_price_columns(np, session, product_id, chunk_size)
+    if columns is not None:
+        months, customers, qtys, prices = columns
+        overall = _grouped_price_stats(np, np.zeros(len(prices), dtype=np.int64), prices, qtys, 1)
+        result["overall"] = _stats_rows(overall, 0)
+
+        customer_ids, customer_codes = np.unique(customers, return_inverse=True)
+        by_customer = _grouped_price_stats(np, customer_codes, prices, qtys, len(customer_ids))
+        names = dict(
+            session.exec(select(Customer.id, Customer.name).where(Customer.id.in_([int(cid) for cid in customer_ids]))).all()
+        )
+        result["by_customer"] = sorted(
+            (
+                {"customer_id": int(cid), "customer_name": names.get(int(cid), ""), **_stats_rows(by_customer, i)}
+                for i, cid in enumerate(customer_ids)
+            ),
+            key=lambda row: row["total_qty"],
+            reverse=True,
+        )
+
+        month_keys, month_codes = np.unique(months, return_inverse=True)
+        by_month = _grouped_price_stats(np, month_codes, prices, qtys, len(month_keys))
+        result["by_month"] = [
+            {"month": f"{month // 100:04d}-{month % 100:02d}", **_stats_rows(by_month, i)} for i, month in enumerate(month_keys)
+        ]
+
+    if PRICE_STATS_CACHE_SIZE:
+        with _stats_cache_lock:
+            _stats_cache[key] = result
+            while len(_stats_cache) > PRICE_STATS_CACHE_SIZE:
+                _stats_cache.popitem(last=False)
+    return result
@@ -1,8 +1,8 @@
-from sqlalchemy import func, or_
+from sqlalchemy import case, delete, func, or_, update
 from sqlmodel import Session, col, select
 
 from app.core.errors import BadRequestError, NotFoundError
-from app.models import InventoryTxn, Product, SaleItem
+from app.models import InventorySnapshot, InventoryTxn, Product, SaleItem
 from app.services.pagination import paginate
 from app.services.utils import to_update_dict
 
@@ -107,6 +107,7 @@ def delete_product(session: Session, product_id: int) -> None:
     if related_sale_item_count > 0:
         raise ValueError("product_has_related_records")
 
+    session.exec(delete(InventorySnapshot).where(InventorySnapshot.product_id == product_id))
     session.delete(product)
     session.commit()
 
@@ -130,3 +131,35 @@ def adjust_stock(session: Session, *, product_id: int, change_qty: float, note:
     session.commit()
     session.refresh(p)
     return p
+
+
+def apply_stock_deltas(session: Session, lines: list[tuple[int, float]]) -> list[float | None]:
+    """
+    按行批量变更库存：同一商品的变动先合并，再用一条
+    UPDATE product SET stock_quantity = stock_quantity + CASE id ... END RETURNING 原子完成，避免并发读改写丢失。
+    返回与 lines 对齐的逐行 after_qty（商品不存在时为 None），用于写库存流水。
+    """
+    totals: dict[int, float] = {}
+    for pid, delta in lines:
+        totals[pid] = round(totals.get(pid, 0.0) + float(delta), 2)
+    if not totals:
+        return []
+
+    rows = session.exec(
+        update(Product)
+        .where(Product.id.in_(list(totals)))
+        .values(stock_quantity=func.round(Product.stock_quantity + case(totals, value=Product.id, else_=0), 2))
+        .returning(Product.id, Product.stock_quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+    running = {pid: float(qty) for pid, qty in rows}
+
+    # 从最终库存倒推每一行变动后的结存
+    after: list[float | None] = [None] * len(lines)
+    for i in range(len(lines) - 1, -1, -1):
+        pid, delta = lines[i]
+        if pid not in running:
+            continue
+        after[i] = round(running[pid], 2)
+        running[pid] -= float(delta)
+    return after
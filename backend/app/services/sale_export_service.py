@@ -1,37 +1,67 @@
 from __future__ import annotations
 
-import os
-import tempfile
+import hashlib
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
 from pathlib import Path
 from io import BytesIO
 from sqlmodel import Session
+from app.core.config import PDF_CACHE_SIZE, PDF_RENDER_WORKERS
 from app.core.errors import NotFoundError, BadRequestError
 from app.models import Sale, Customer
 from app.services import sale_service
 
 
-def _set_cell_value(ws, r, c, val):
-    """安全地向单元格写入数据，完美兼容并保护合并单元格(MergedCell)"""
-    cell = ws.cell(row=r, column=c)
-    if type(cell).__name__ == 'MergedCell':
-        for merged_range in ws.merged_cells.ranges:
-            if cell.coordinate in merged_range:
-                ws.cell(row=merged_range.min_row, column=merged_range.min_col, value=val)
-                return
-    else:
-        cell.value = val
+_HEADER_LABELS = {
+    "sale_no": ["单号：", "单号"],
+    "date": ["日期：", "日期"],
+    "customer": ["客户名称：", "客户名称", "客户"],
+    "phone": ["电话：", "电话", "联系电话：", "联系电话"],
+}
+_COLUMN_LABELS = {
+    "index": ["序号"],
+    "name": ["名称", "品名", "商品名称"],
+    "sku": ["规格", "SKU"],
+    "qty": ["数量"],
+    "unit": ["单位"],
+    "price": ["单价"],
+}
 
 
-def export_sale_excel(session: Session, *, sale_id: int, template_path: str | None = None) -> tuple[bytes, str, str]:
-    exists = session.get(Sale, sale_id)
-    if not exists:
-        raise NotFoundError("单据不存在")
-    sale = sale_service.get_sale(session, sale_id)
+@dataclass(frozen=True)
+class _TemplateLayout:
+    """打印模板解析结果：标签填写位置、明细列、合并单元格锚点，以及模板原始字节"""
+
+    path: str
+    mtime: float
+    header_cells: tuple  # ((字段, (row, col)), ...)，已换算到合并区域左上角
+    col_map: dict  # 明细字段 -> 列号
+    start_row: int
+    merged_anchor: dict  # (row, col) -> 所在合并区域左上角 (row, col)
+    page_rows: int  # 每页明细行数（明细起始行到“合计”行之间）；0 表示模板没有合计行，不分页
+    total_label_cell: tuple | None  # “金额合计”标签格
+    total_cell: tuple | None  # 合计金额格（=SUM(...)）
+    item_formulas: tuple  # ((row, col, 公式), ...)：模板明细行里缺失、按首行补齐的金额公式
+    page_height: int  # 模板占用的行数，Excel 多页时按此行数纵向重复
+    workbook_bytes: bytes
+    pdf_spec: dict  # PDF 渲染用的几何/文字/边框描述，见 _build_pdf_spec
 
-    try:
-        from openpyxl import Workbook, load_workbook
-    except ImportError:
-        raise BadRequestError("请安装 openpyxl 库")
+
+_template_paths: dict = {}
+_template_cache: dict = {}
+_template_lock = threading.Lock()
+
+
+def _resolve_template_path(template_path: str | None) -> Path:
+    """按候选位置查找模板，结果按入参缓存；缓存的文件消失时重新查找"""
+    cached = _template_paths.get(template_path)
+    if cached and cached.exists():
+        return cached
 
     current_dir = Path(__file__).resolve().parent
     backend_dir = current_dir.parent.parent
@@ -44,136 +74,709 @@ def export_sale_excel(session: Session, *, sale_id: int, template_path: str | No
         Path("打印模板.xlsx")
     ]
 
-    path_to_use = None
     for p in possible_paths:
         if p and p.exists():
-            path_to_use = p
-            break
+            _template_paths[template_path] = p
+            return p
 
-    if not path_to_use:
-        raise BadRequestError("找不到【打印模板.xlsx】，请确认该文件已上传")
+    raise BadRequestError("找不到【打印模板.xlsx】，请确认该文件已上传")
 
-    wb = load_workbook(path_to_use)
-    ws = wb.active
 
-    customer = session.get(Customer, sale.customer_id) if getattr(sale, 'customer_id', None) else None
-    customer_phone = getattr(sale, "contact_phone_snapshot", None)
-    if not customer_phone and customer:
-        customer_phone = getattr(customer, "phone", None) or getattr(customer, "mobile", None) or getattr(customer,
-                                                                                                          "contact_phone",
-                                                                                                          None)
-    customer_phone = customer_phone or "-"
+def _col_width_pt(ws, letter: str) -> float:
+    dim = ws.column_dimensions.get(letter)
+    width = dim.width if dim is not None and dim.width else (ws.sheet_format.defaultColWidth or 8.43)
+    # Excel 列宽单位是字符数：约 7px/字符 + 5px 边距，1px = 0.75pt
+    return (width * 7 + 5) * 0.75
 
-    sale_date_str = sale.sale_date.strftime("%Y-%m-%d %H:%M")
 
-    for r in range(1, 15):
-        for c in range(1, 15):
+def _row_height_pt(ws, r: int) -> float:
+    dim = ws.row_dimensions.get(r)
+    return float(dim.height) if dim is not None and dim.height else float(ws.sheet_format.defaultRowHeight or 15)
+
+
+def _build_pdf_spec(ws, merged_anchor: dict) -> dict:
+    """
+    把模板工作表换算成 PDF 绘制描述（坐标单位 pt，原点在左上角）：
+    cells 为打印区域内每个（合并区域左上角）格子的位置、字体、对齐与模板原值，
+    borders 为去重后的边框线段。只依赖模板本身，随模板缓存。
+    """
+    from openpyxl.utils import get_column_letter
+
+    used = [
+        (cell.row, cell.column)
+        for row in ws.iter_rows()
+        for cell in row
+        if cell.value is not None or any(getattr(cell.border, side).style for side in ("left", "right", "top", "bottom"))
+    ]
+    if not used:
+        return {"width": 0, "height": 0, "cells": (), "borders": ()}
+    min_row = min(r for r, _ in used)
+    max_row = max(r for r, _ in used)
+    min_col = min(c for _, c in used)
+    max_col = max(c for _, c in used)
+    for merged_range in ws.merged_cells.ranges:
+        max_row = max(max_row, merged_range.max_row)
+        max_col = max(max_col, merged_range.max_col)
+
+    col_x, x = {}, 0.0
+    for c in range(min_col, max_col + 2):
+        col_x[c] = x
+        x += _col_width_pt(ws, get_column_letter(c))
+    row_y, y = {}, 0.0
+    for r in range(min_row, max_row + 2):
+        row_y[r] = y
+        y += _row_height_pt(ws, r)
+
+    spans = {}
+    bounds = {}
+    for merged_range in ws.merged_cells.ranges:
+        spans[(merged_range.min_row, merged_range.min_col)] = (merged_range.max_row, merged_range.max_col)
+        for key in merged_anchor:
+            if merged_anchor[key] == (merged_range.min_row, merged_range.min_col):
+                bounds[key] = merged_range.bounds  # (min_col, min_row, max_col, max_row)
+
+    cells = []
+    borders = set()
+    for r in range(min_row, max_row + 1):
+        for c in range(min_col, max_col + 1):
             cell = ws.cell(row=r, column=c)
-            if type(cell).__name__ == 'MergedCell':
+            x0, x1 = col_x[c], col_x[c + 1]
+            y0, y1 = row_y[r], row_y[r + 1]
+            b = cell.border
+            # 合并区域内部的格线不画，只画外框
+            bc1, br1, bc2, br2 = bounds.get((r, c), (c, r, c, r))
+            if b.left.style and c == bc1: borders.add((x0, y0, x0, y1))
+            if b.right.style and c == bc2: borders.add((x1, y0, x1, y1))
+            if b.top.style and r == br1: borders.add((x0, y0, x1, y0))
+            if b.bottom.style and r == br2: borders.add((x0, y1, x1, y1))
+
+            if merged_anchor.get((r, c), (r, c)) != (r, c):
                 continue
+            r2, c2 = spans.get((r, c), (r, c))
+            font = cell.font
+            align = cell.alignment
+            cells.append({
+                "row": r,
+                "col": c,
+                "x": x0,
+                "y": y0,
+                "w": col_x[c2 + 1] - x0,
+                "h": row_y[r2 + 1] - y0,
+                "value": cell.value,
+                "size": float(font.sz or 11),
+                "bold": bool(font.b),
+                "merged": (r, c) in spans,
+                "wrap": bool(align.wrap_text),
+                "halign": align.horizontal or "general",
+                "valign": align.vertical or "bottom",
+                "number_format": cell.number_format or "General",
+            })
+
+    return {
+        "width": col_x[max_col + 1],
+        "height": row_y[max_row + 1],
+        "cells": tuple(cells),
+        "borders": tuple(sorted(borders)),
+    }
+
+
+def _parse_template(path: Path, mtime: float) -> _TemplateLayout:
+    from openpyxl import load_workbook
+
+    workbook_bytes = path.read_bytes()
+    ws = load_workbook(BytesIO(workbook_bytes)).active
+
+    merged_anchor = {}
+    for merged_range in ws.merged_cells.ranges:
+        for r in range(merged_range.min_row, merged_range.max_row + 1):
+            for c in range(merged_range.min_col, merged_range.max_col + 1):
+                merged_anchor[(r, c)] = (merged_range.min_row, merged_range.min_col)
+
+    def _label(r, c):
+        # 合并区域中非左上角的格子没有值
+        if merged_anchor.get((r, c), (r, c)) != (r, c):
+            return None
+        return str(ws.cell(row=r, column=c).value or "").strip()
 
-            val = str(cell.value or "").strip()
-            # 兼容D列与H列偏移填入
-            if val in ["单号：", "单号"]:
-                _set_cell_value(ws, r, c + 2, sale.sale_no)
-            elif val in ["日期：", "日期"]:
-                _set_cell_value(ws, r, c + 2, sale_date_str)
-            elif val in ["客户名称：", "客户名称", "客户"]:
-                _set_cell_value(ws, r, c + 2, sale.customer_name)
-            elif val in ["电话：", "电话", "联系电话：", "联系电话"]:
-                _set_cell_value(ws, r, c + 2, customer_phone)
+    header_cells = []
+    for r in range(1, 15):
+        for c in range(1, 15):
+            val = _label(r, c)
+            for field, labels in _HEADER_LABELS.items():
+                # 兼容D列与H列偏移填入
+                if val in labels:
+                    header_cells.append((field, merged_anchor.get((r, c + 2), (r, c + 2))))
 
     start_row = 12
     col_map = {}
     for r in range(1, 20):
         for c in range(1, 15):
-            cell = ws.cell(row=r, column=c)
-            if type(cell).__name__ == 'MergedCell':
-                continue
-            val = str(cell.value or "").strip()
-            if val == "序号":
-                col_map['index'] = c
-                start_row = r + 1
-            elif val in ["名称", "品名", "商品名称"]:
-                col_map['name'] = c
-            elif val in ["规格", "SKU"]:
-                col_map['sku'] = c
-            elif val == "数量":
-                col_map['qty'] = c
-            elif val == "单位":
-                col_map['unit'] = c
-            elif val == "单价":
-                col_map['price'] = c
+            val = _label(r, c)
+            for field, labels in _COLUMN_LABELS.items():
+                if val in labels:
+                    col_map[field] = c
+                    if field == "index":
+                        start_row = r + 1
 
         if 'index' in col_map and 'name' in col_map:
             break
 
-    for idx, it in enumerate(sale.items):
-        r = start_row + idx
-        if 'index' in col_map: _set_cell_value(ws, r, col_map['index'], idx + 1)
-        if 'name' in col_map: _set_cell_value(ws, r, col_map['name'], it.product_name)
-        if 'sku' in col_map: _set_cell_value(ws, r, col_map['sku'], it.sku or "")
-        if 'qty' in col_map: _set_cell_value(ws, r, col_map['qty'], float(it.qty))
-        if 'unit' in col_map: _set_cell_value(ws, r, col_map['unit'], it.unit or "")
-        if 'price' in col_map: _set_cell_value(ws, r, col_map['price'], float(it.unit_price))
+    # 明细区到“合计”行为止，合计行之前的行数即每页可容纳的明细数
+    page_rows = 0
+    total_label_cell = total_cell = None
+    for r in range(start_row, ws.max_row + 1):
+        for c in range(1, ws.max_column + 1):
+            val = _label(r, c)
+            if val and "合计" in val and total_label_cell is None:
+                total_label_cell = (r, c)
+            elif val and val.upper().startswith("=SUM(") and total_cell is None:
+                total_cell = (r, c)
+        if total_label_cell:
+            page_rows = r - start_row
+            break
+
+    # 模板明细行的金额公式（如 =F12*H12）常有漏填的行，按首行公式平移补齐
+    item_formulas = []
+    if page_rows:
+        from openpyxl.formula.translate import Translator
+        from openpyxl.utils import get_column_letter
+
+        for c in range(1, ws.max_column + 1):
+            first = ws.cell(row=start_row, column=c).value
+            if not (isinstance(first, str) and first.startswith("=")):
+                continue
+            origin = f"{get_column_letter(c)}{start_row}"
+            for r in range(start_row + 1, start_row + page_rows):
+                if ws.cell(row=r, column=c).value is None and merged_anchor.get((r, c), (r, c)) == (r, c):
+                    item_formulas.append((r, c, Translator(first, origin=origin).translate_formula(f"{get_column_letter(c)}{r}")))
+
+    page_height = ws.max_row
+    for merged_range in ws.merged_cells.ranges:
+        page_height = max(page_height, merged_range.max_row)
+
+    return _TemplateLayout(
+        path=str(path),
+        mtime=mtime,
+        header_cells=tuple(header_cells),
+        col_map=col_map,
+        start_row=start_row,
+        merged_anchor=merged_anchor,
+        page_rows=page_rows,
+        total_label_cell=total_label_cell,
+        total_cell=total_cell,
+        item_formulas=tuple(item_formulas),
+        page_height=page_height,
+        workbook_bytes=workbook_bytes,
+        pdf_spec=_build_pdf_spec(ws, merged_anchor),
+    )
+
+
+def _get_template_layout(template_path: str | None) -> _TemplateLayout:
+    """取缓存的模板解析结果；模板文件 mtime 变化时重新解析"""
+    path = _resolve_template_path(template_path)
+    mtime = path.stat().st_mtime
+    key = str(path)
+    layout = _template_cache.get(key)
+    if layout and layout.mtime == mtime:
+        return layout
+    with _template_lock:
+        layout = _template_cache.get(key)
+        if not layout or layout.mtime != mtime:
+            layout = _parse_template(path, mtime)
+            _template_cache[key] = layout
+    return layout
+
+
+def _customer_phone(session: Session, sale, customer=None) -> str:
+    if customer is None:
+        customer = session.get(Customer, sale.customer_id) if getattr(sale, 'customer_id', None) else None
+    customer_phone = getattr(sale, "contact_phone_snapshot", None)
+    if not customer_phone and customer:
+        customer_phone = getattr(customer, "phone", None) or getattr(customer, "mobile", None) or getattr(customer,
+                                                                                                          "contact_phone",
+                                                                                                          None)
+    return customer_phone or "-"
+
+
+def _slip_values(layout: _TemplateLayout, sale, customer_phone: str) -> list:
+    """
+    按模板布局算出每页要填写的格子 [{(row, col): value}, ...]（坐标均为模板坐标），Excel 与 PDF 共用。
+    明细超过模板每页行数时分页：非末页合计行改为“本页小计”，末页合计为整单金额，单号后标注页码。
+    """
+    items = list(sale.items)
+    per_page = layout.page_rows or max(len(items), 1)
+    chunks = [items[i:i + per_page] for i in range(0, len(items), per_page)] or [[]]
+    page_count = len(chunks)
+
+    col_map = layout.col_map
+    pages = []
+    for page_no, chunk in enumerate(chunks, start=1):
+        values = {}
+        header_values = {
+            "sale_no": sale.sale_no if page_count == 1 else f"{sale.sale_no}（{page_no}/{page_count}）",
+            "date": sale.sale_date.strftime("%Y-%m-%d %H:%M"),
+            "customer": sale.customer_name,
+            "phone": customer_phone,
+        }
+        for field, (r, c) in layout.header_cells:
+            values[(r, c)] = header_values[field]
+
+        offset = (page_no - 1) * per_page
+        for idx, it in enumerate(chunk):
+            r = layout.start_row + idx
+            row_values = {
+                "index": offset + idx + 1,
+                "name": it.product_name,
+                "sku": it.sku or "",
+                "qty": float(it.qty),
+                "unit": it.unit or "",
+                "price": float(it.unit_price),
+            }
+            for field, value in row_values.items():
+                if field in col_map:
+                    values[layout.merged_anchor.get((r, col_map[field]), (r, col_map[field]))] = value
+        last_row = layout.start_row + len(chunk)
+        for r, c, formula in layout.item_formulas:
+            if r < last_row:
+                values[(r, c)] = formula
+
+        if page_count > 1 and layout.total_label_cell:
+            if page_no < page_count:
+                values[layout.total_label_cell] = "本页小计："
+            elif layout.total_cell:
+                values[layout.total_cell] = round(float(sale.total_amount), 2)
+        pages.append(values)
+    return pages
+
+
+def _fill_template(layout: _TemplateLayout, pages: list) -> bytes:
+    """
+    复制模板并写入各页的值，返回 xlsx 字节。
+    多页时在同一工作表内按模板行数纵向重复（含样式、行高、合并区域、平移后的公式），页间插入分页符。
+    """
+    from copy import copy
+
+    from openpyxl import load_workbook
+    from openpyxl.formula.translate import Translator
+    from openpyxl.worksheet.pagebreak import Break
+
+    wb = load_workbook(BytesIO(layout.workbook_bytes))
+    ws = wb.active
+    height = layout.page_height
+
+    def _shifted(value, r, c, offset):
+        if offset and isinstance(value, str) and value.startswith("="):
+            return Translator(value, origin=ws.cell(row=r, column=c).coordinate).translate_formula(
+                ws.cell(row=r + offset, column=c).coordinate
+            )
+        return value
+
+    if len(pages) > 1:
+        template_cells = [cell for row in ws.iter_rows(min_row=1, max_row=height) for cell in row]
+        template_merged = list(ws.merged_cells.ranges)
+        for page_idx in range(1, len(pages)):
+            offset = page_idx * height
+            for cell in template_cells:
+                target = ws.cell(row=cell.row + offset, column=cell.column)
+                target.value = _shifted(cell.value, cell.row, cell.column, offset)
+                if cell.has_style:
+                    target._style = copy(cell._style)
+            for r in range(1, height + 1):
+                if ws.row_dimensions[r].height is not None:
+                    ws.row_dimensions[r + offset].height = ws.row_dimensions[r].height
+            for merged_range in template_merged:
+                ws.merge_cells(
+                    start_row=merged_range.min_row + offset,
+                    start_column=merged_range.min_col,
+                    end_row=merged_range.max_row + offset,
+                    end_column=merged_range.max_col,
+                )
+            ws.row_breaks.append(Break(id=offset))
+
+    for page_idx, values in enumerate(pages):
+        offset = page_idx * height
+        for (r, c), value in values.items():
+            r, c = layout.merged_anchor.get((r, c), (r, c))
+            ws.cell(row=r + offset, column=c, value=_shifted(value, r, c, offset))
 
     bio = BytesIO()
     wb.save(bio)
-    return bio.getvalue(), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'
+    return bio.getvalue()
 
 
-def export_sale_pdf(session: Session, *, sale_id: int, template_path: str | None = None) -> bytes:
-    """导出 PDF 功能：利用系统的 Excel 软件将填好的数据直接转换为完美的 PDF"""
-    excel_bytes, _, _ = export_sale_excel(session, sale_id=sale_id, template_path=template_path)
+def export_sale_excel(session: Session, *, sale_id: int, template_path: str | None = None) -> tuple[bytes, str, str]:
+    exists = session.get(Sale, sale_id)
+    if not exists:
+        raise NotFoundError("单据不存在")
+    sale = sale_service.get_sale(session, sale_id)
 
     try:
-        import win32com.client
-        import pythoncom
+        import openpyxl  # noqa: F401
     except ImportError:
-        raise BadRequestError("请在 backend 目录下运行 pip install pywin32 以支持 PDF 转换")
+        raise BadRequestError("请安装 openpyxl 库")
+
+    layout = _get_template_layout(template_path)
+    content = _fill_template(layout, _slip_values(layout, sale, _customer_phone(session, sale)))
+    return content, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'
+
+
+_CELL_REF = re.compile(r"\$?([A-Z]{1,3})\$?(\d+)")
+_CN_DIGITS = "零壹贰叁肆伍陆柒捌玖"
+
+
+def _ref(ref: str) -> tuple:
+    from openpyxl.utils import column_index_from_string
+
+    m = _CELL_REF.fullmatch(ref)
+    return int(m.group(2)), column_index_from_string(m.group(1))
+
+
+def _cn_amount(amount: float) -> str:
+    """金额大写（与模板中 [dbnum2] 公式的输出一致，如 贰佰叁拾元整）"""
+    if not amount:
+        return ""
+    prefix = "负" if amount < 0 else ""
+    cents = int(round(abs(amount) * 100))
+    yuan, jiao, fen = cents // 100, cents // 10 % 10, cents % 10
+    units = ["", "拾", "佰", "仟"]
+    big_units = ["", "万", "亿", "兆"]
+
+    def _section(n: int) -> str:
+        out, zero = "", False
+        for i in range(3, -1, -1):
+            d = n // (10 ** i) % 10
+            if d == 0:
+                zero = bool(out)
+                continue
+            if zero:
+                out += "零"
+                zero = False
+            out += _CN_DIGITS[d] + units[i]
+        return out
+
+    text = ""
+    if yuan:
+        sections = []
+        n = yuan
+        while n:
+            sections.append(n % 10000)
+            n //= 10000
+        parts = []
+        for i in range(len(sections) - 1, -1, -1):
+            sec = sections[i]
+            if sec:
+                if parts and sec < 1000:
+                    parts.append("零")
+                parts.append(_section(sec) + big_units[i])
+        text = "".join(parts) + "元"
+    if jiao:
+        text += _CN_DIGITS[jiao] + "角"
+    elif yuan and fen:
+        text += "零"
+    if fen:
+        text += _CN_DIGITS[fen] + "分"
+    if not fen:
+        text += "整"
+    return prefix + text
+
+
+def _eval_formula(formula: str, get):
+    """模板里只用到三类公式：A*B、SUM(区域)、[dbnum2] 金额大写；其余公式不显示"""
+    body = formula[1:].strip()
+    m = re.fullmatch(r"(\$?[A-Z]{1,3}\$?\d+)\*(\$?[A-Z]{1,3}\$?\d+)", body)
+    if m:
+        a, b = get(*_ref(m.group(1))), get(*_ref(m.group(2)))
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            return round(a * b, 2)
+        return None
+    m = re.fullmatch(r"SUM\((\$?[A-Z]{1,3}\$?\d+):(\$?[A-Z]{1,3}\$?\d+)\)", body, flags=re.IGNORECASE)
+    if m:
+        (r1, c1), (r2, c2) = _ref(m.group(1)), _ref(m.group(2))
+        total = 0.0
+        for r in range(r1, r2 + 1):
+            for c in range(c1, c2 + 1):
+                v = get(r, c)
+                if isinstance(v, (int, float)):
+                    total += v
+        return round(total, 2)
+    if "dbnum2" in body:
+        ref = _CELL_REF.search(body)
+        v = get(*_ref(ref.group(0))) if ref else None
+        return _cn_amount(v) if isinstance(v, (int, float)) else None
+    return None
+
+
+def _format_value(value, number_format: str) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, (int, float)):
+        if "0.00" in number_format:
+            text = f"{value:,.2f}" if "#,##0" in number_format else f"{value:.2f}"
+            return f"￥{text}" if "￥" in number_format else text
+        return f"{value:g}" if isinstance(value, float) else str(value)
+    return str(value)
+
+
+def _render_slip_pdf(spec: dict, pages: list) -> bytes:
+    """
+    按模板几何描述与各页填写值绘制 PDF（纯 Python，reportlab），每个填写页一页。
+    只接收可序列化的普通数据，供渲染进程池调用。
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+    from reportlab.pdfgen import canvas
+
+    font = "STSong-Light"
+    if font not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(UnicodeCIDFont(font))
+
+    page_w, page_h = A4
+    margin = 18.0
+    scale = min(1.0, (page_w - 2 * margin) / spec["width"]) if spec["width"] else 1.0
+
+    cells = {(cell["row"], cell["col"]): cell for cell in spec["cells"]}
+
+    bio = BytesIO()
+    pdf = canvas.Canvas(bio, pagesize=A4)
+
+    def tx(x):
+        return margin + x * scale
+
+    def ty(y):
+        return page_h - margin - y * scale
+
+    for values in pages:
+        _draw_slip_page(pdf, font, cells, spec["borders"], values, scale, tx, ty)
+        pdf.showPage()
+    pdf.save()
+    return bio.getvalue()
+
+
+def _draw_slip_page(pdf, font: str, cells: dict, borders, values: dict, scale: float, tx, ty) -> None:
+    from reportlab.pdfbase import pdfmetrics
+
+    resolved = {}
+
+    def get(r, c):
+        if (r, c) in resolved:
+            return resolved[(r, c)]
+        if (r, c) in values:
+            v = values[(r, c)]
+        else:
+            v = cells[(r, c)]["value"] if (r, c) in cells else None
+        if isinstance(v, str) and v.startswith("="):
+            resolved[(r, c)] = None  # 防止循环引用
+            v = _eval_formula(v, get)
+        resolved[(r, c)] = v
+        return v
+
+    pdf.setLineWidth(0.5)
+    for x0, y0, x1, y1 in borders:
+        pdf.line(tx(x0), ty(y0), tx(x1), ty(y1))
+    pdf.setLineWidth(0.2)
+
+    for (r, c), cell in cells.items():
+        value = get(r, c)
+        text = _format_value(value, cell["number_format"])
+        if not text:
+            continue
+        is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+        halign = cell["halign"]
+        if halign == "general":
+            halign = "right" if is_number else "left"
 
-    # 将数据写入系统临时文件
-    fd_xlsx, temp_xlsx = tempfile.mkstemp(suffix=".xlsx")
-    with os.fdopen(fd_xlsx, 'wb') as f:
-        f.write(excel_bytes)
+        # 与 Excel 一致：不换行的左对齐文字可以溢出到右侧相邻的空格子
+        cell_w = cell["w"]
+        if halign == "left" and not cell["wrap"] and not cell["merged"]:
+            nc = c + 1
+            while (r, nc) in cells and cells[(r, nc)]["value"] is None and get(r, nc) is None:
+                cell_w += cells[(r, nc)]["w"]
+                nc += 1
 
-    temp_pdf = temp_xlsx.replace(".xlsx", ".pdf")
+        size = cell["size"] * scale
+        lines = [ln.strip() for ln in text.split("\n")] if "\n" in text else [text]
+        width = cell_w * scale - 4
+        widest = max(pdfmetrics.stringWidth(ln, font, size) for ln in lines)
+        if widest > width > 0:
+            size = max(size * width / widest, 5.0)
+
+        left, top = tx(cell["x"]), ty(cell["y"])
+        height = cell["h"] * scale
+        block = size * 1.2 * len(lines)
+        if cell["valign"] == "top":
+            baseline = top - size
+        elif cell["valign"] == "center":
+            baseline = top - (height - block) / 2 - size
+        else:
+            baseline = top - height + block - size * 1.2 + size * 0.25
+
+        # 会计格式（￥* #,##0.00）：货币符号靠左、数字靠右
+        accounting = is_number and text.startswith("￥") and "*" in cell["number_format"]
+        for ln in lines:
+            if accounting:
+                segments = [("￥", left + 2), (ln[1:], left + cell_w * scale - 2 - pdfmetrics.stringWidth(ln[1:], font, size))]
+            else:
+                line_w = pdfmetrics.stringWidth(ln, font, size)
+                if halign in ("center", "centerContinuous"):
+                    x = left + (cell_w * scale - line_w) / 2
+                elif halign == "right":
+                    x = left + cell_w * scale - 2 - line_w
+                else:
+                    x = left + 2
+                segments = [(ln, x)]
+            for seg, x in segments:
+                text_obj = pdf.beginText(x, baseline)
+                text_obj.setFont(font, size)
+                # CID 字体没有粗体字重，加粗用“填充+描边”渲染模式模拟
+                text_obj.setTextRenderMode(2 if cell["bold"] else 0)
+                text_obj.textOut(seg)
+                pdf.drawText(text_obj)
+            baseline -= size * 1.2
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_pdf_cache: OrderedDict = OrderedDict()
+_pdf_cache_lock = threading.Lock()
+
+
+def _get_render_pool() -> ProcessPoolExecutor:
+    """PDF 绘制与批量填模板共用的渲染进程池（大小 PDF_RENDER_WORKERS）"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS)
+        return _render_pool
+
+
+def _discard_render_pool(pool: ProcessPoolExecutor) -> None:
+    """进程池已损坏（子进程被杀、OOM 等）：丢弃，下次 _get_render_pool 重建"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_in_render_pool(fn, args_list: list) -> list:
+    """
+    在渲染进程池中并行执行 fn(*args)，按顺序返回结果。
+    池损坏时重建并重试一次；超时或出错时取消尚未开始的任务，不让它们继续占用进程池。
+    """
+    for attempt in range(2):
+        pool = _get_render_pool()
+        futures = []
+        try:
+            futures = [pool.submit(fn, *args) for args in args_list]
+            return [fut.result(timeout=60) for fut in futures]
+        except BrokenProcessPool:
+            _discard_render_pool(pool)
+            if attempt:
+                raise
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+
+def _pdf_cache_key(sale_id: int, layout: _TemplateLayout, pages: list) -> tuple:
+    """
+    销售单没有更新时间列；单据内容（单号/日期/客户/电话/明细）一旦变化填写值就会变，
+    因此用 单据id + 模板 mtime + 填写值摘要 作为缓存键，客户改名等也能自动失效。
+    """
+    digest = hashlib.sha1(repr([sorted(values.items()) for values in pages]).encode("utf-8")).hexdigest()
+    return sale_id, layout.path, layout.mtime, digest
+
+
+def render_slips_pdf(layout: _TemplateLayout, jobs: list) -> list:
+    """批量渲染 [(sale_id, pages)]：命中缓存直接返回，其余提交进程池并行渲染"""
+    keys = [_pdf_cache_key(sale_id, layout, pages) for sale_id, pages in jobs]
+    out = [None] * len(jobs)
+    pending = []
+    with _pdf_cache_lock:
+        for i, key in enumerate(keys):
+            if key in _pdf_cache:
+                _pdf_cache.move_to_end(key)
+                out[i] = _pdf_cache[key]
+            else:
+                pending.append(i)
+
+    if pending:
+        rendered = _run_in_render_pool(_render_slip_pdf, [(layout.pdf_spec, jobs[i][1]) for i in pending])
+        for i, content in zip(pending, rendered):
+            out[i] = content
+        if PDF_CACHE_SIZE:
+            with _pdf_cache_lock:
+                for i in pending:
+                    _pdf_cache[keys[i]] = out[i]
+                while len(_pdf_cache) > PDF_CACHE_SIZE:
+                    _pdf_cache.popitem(last=False)
+    return out
+
+
+def export_sale_pdf(session: Session, *, sale_id: int, template_path: str | None = None) -> bytes:
+    """导出 PDF：按缓存的模板布局用 reportlab 直接绘制，不依赖 Excel，Linux 可用"""
+    exists = session.get(Sale, sale_id)
+    if not exists:
+        raise NotFoundError("单据不存在")
+    sale = sale_service.get_sale(session, sale_id)
 
     try:
-        pythoncom.CoInitialize()
-        # 必须使用 DispatchEx，它会强制启动一个全新的 Excel 进程，防止和您当前正在打开的 Excel 互相卡死干扰
-        excel = win32com.client.DispatchEx("Excel.Application")
-        excel.Visible = False
-        excel.DisplayAlerts = False
-
-        abs_xlsx = os.path.abspath(temp_xlsx)
-        abs_pdf = os.path.abspath(temp_pdf)
-
-        wb = excel.Workbooks.Open(abs_xlsx)
-        wb.ExportAsFixedFormat(0, abs_pdf)  # 0 代表输出为 PDF
-        wb.Close(False)
-        excel.Quit()
-    except Exception as e:
-        raise BadRequestError(f"PDF转换失败，请确认后台 Excel 进程未卡死: {str(e)}")
-    finally:
-        pythoncom.CoUninitialize()
-
-    # 读取转换好的 PDF 数据，并且立刻【清理销毁临时垃圾文件】，保护服务器硬盘
+        import openpyxl  # noqa: F401
+    except ImportError:
+        raise BadRequestError("请安装 openpyxl 库")
     try:
-        with open(temp_pdf, "rb") as f:
-            pdf_bytes = f.read()
-    except FileNotFoundError:
-        raise BadRequestError("未能成功生成 PDF 文件")
-    finally:
-        if os.path.exists(temp_xlsx):
-            try:
-                os.remove(temp_xlsx)
-            except:
-                pass
-        if os.path.exists(temp_pdf):
-            try:
-                os.remove(temp_pdf)
-            except:
-                pass
-
-    return pdf_bytes
\ No newline at end of file
+        import reportlab  # noqa: F401
+    except ImportError:
+        raise BadRequestError("请安装 reportlab 库以支持 PDF 导出")
+
+    layout = _get_template_layout(template_path)
+    pages = _slip_values(layout, sale, _customer_phone(session, sale))
+    return render_slips_pdf(layout, [(sale_id, pages)])[0]
+
+
+def render_slips_xlsx(layout: _TemplateLayout, jobs: list) -> list:
+    """批量填写模板 [(sale_id, pages)]，在渲染进程池中并行执行"""
+    return _run_in_render_pool(_fill_template, [(layout, pages) for _, pages in jobs])
+
+
+def export_sale_slips_zip(
+        session: Session,
+        *,
+        sale_ids: list[int],
+        fmt: str,
+        zip_path: Path,
+        template_path: str | None = None,
+        chunk_size: int = 100,
+        on_progress=None,
+) -> int:
+    """
+    批量导出销售单到 ZIP：每 chunk_size 单用两次查询取齐详情，并行填模板/绘制 PDF 后逐个写入压缩包。
+    on_progress(done) 在每批写完后回调。返回写入的单据数。
+    """
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        raise BadRequestError("请安装 openpyxl 库")
+    if fmt == "pdf":
+        try:
+            import reportlab  # noqa: F401
+        except ImportError:
+            raise BadRequestError("请安装 reportlab 库以支持 PDF 导出")
+
+    layout = _get_template_layout(template_path)
+    done = 0
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for start in range(0, len(sale_ids), chunk_size):
+            details = sale_service.get_sales_bulk(session, sale_ids[start : start + chunk_size])
+            jobs = [(sale.id, _slip_values(layout, sale, _customer_phone(session, sale, customer))) for sale, customer in details]
+            contents = render_slips_pdf(layout, jobs) if fmt == "pdf" else render_slips_xlsx(layout, jobs)
+            for (sale, _), content in zip(details, contents):
+                zf.writestr(f"销售清单_{sale.sale_no}.{fmt}", content)
+            done += len(details)
+            session.expunge_all()
+            if on_progress:
+                on_progress(done)
+    return done
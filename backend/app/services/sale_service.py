@@ -1,13 +1,17 @@
+import threading
 from datetime import datetime
 
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import func
+from sqlalchemy import insert, update
+from sqlalchemy import inspect as sa_inspect
 from sqlmodel import Session, select
 
+from app.core.config import PRICE_BAND_TOLERANCE, SALE_NO_BLOCK_SIZE
 from app.core.errors import BadRequestError, NotFoundError
 from app.core.time import utc_now
-from app.models import Customer, CustomerContact, InventoryTxn, Product, Sale, SaleItem, Payment, PaymentAllocation
-from app.schemas.sale import SaleItemRead, SaleRead, SaleSummary
+from app.models import Customer, CustomerContact, InventoryTxn, Product, Sale, SaleItem, SaleNoSequence
+from app.schemas.sale import SaleItemRead, SalePriceWarning, SaleRead, SaleSummary
+from app.services import customer_balance_service, last_price_service, product_service
 from app.services.pagination import paginate
 
 
@@ -27,37 +31,141 @@ def _to_settlement_status(payment_status: str) -> str:
     return {"unpaid": "UNPAID", "partial": "PARTIAL", "paid": "PAID"}.get(payment_status, "UNPAID")
 
 
-def _generate_sale_no(session: Session, sale_date: datetime) -> str:
-    day = sale_date.strftime("%Y%m%d")
-    prefix = f"SO{day}-"
-    last_no = session.exec(
-        select(Sale.sale_no).where(Sale.sale_no.like(f"{prefix}%")).order_by(Sale.sale_no.desc()).limit(1)
-    ).first()
-    seq = 1
-    if last_no and "-" in last_no:
+def _sale_no_prefix(sale_date: datetime) -> str:
+    return f"SO{sale_date.strftime('%Y%m%d')}-"
+
+
+def _bump_sequence(session: Session, prefix: str, n: int) -> int:
+    """原子地把计数器加 n，返回加完后的 last_seq；当天首单时插入计数行"""
+    for _ in range(2):
+        last = session.exec(
+            update(SaleNoSequence)
+            .where(SaleNoSequence.prefix == prefix)
+            .values(last_seq=SaleNoSequence.last_seq + n)
+            .returning(SaleNoSequence.last_seq)
+        ).scalar_one_or_none()
+        if last is not None:
+            return int(last)
         try:
-            seq = int(last_no.split("-")[-1]) + 1
-        except Exception:
-            seq = 1
-    return f"{prefix}{seq:04d}"
+            with session.begin_nested():
+                session.exec(insert(SaleNoSequence).values(prefix=prefix, last_seq=n))
+            return n
+        except IntegrityError:
+            # 并发首单：对方已插入计数行，回到 UPDATE 分支
+            continue
+    raise BadRequestError("生成单号失败，请重试")
 
 
-def next_sale_no(session: Session) -> str:
-    return _generate_sale_no(session, utc_now())
+def _observe_sale_no(session: Session, sale_no: str) -> None:
+    """手工/预览单号入库时把计数器推进到该号，避免之后自动生成撞号"""
+    prefix, _, seq_str = sale_no.rpartition("-")
+    if not (prefix.startswith("SO") and seq_str.isdigit()):
+        return
+    prefix, seq = f"{prefix}-", int(seq_str)
+    session.exec(
+        update(SaleNoSequence)
+        .where(SaleNoSequence.prefix == prefix, SaleNoSequence.last_seq < seq)
+        .values(last_seq=seq)
+    )
+    if session.get(SaleNoSequence, prefix) is None:
+        try:
+            with session.begin_nested():
+                session.exec(insert(SaleNoSequence).values(prefix=prefix, last_seq=seq))
+        except IntegrityError:
+            pass
+
+
+_seq_blocks: dict[str, tuple[int, int]] = {}
+_seq_blocks_lock = threading.Lock()
+
+
+def _reserve_seq_blocks(session: Session, orders: list) -> None:
+    """
+    号段模式：在调用方事务写入任何数据之前，为这些单据（未指定单号的）预占足够的流水号。
+    号段在独立事务里预占并立即提交，调用方回滚不会把号段还回去；
+    必须在调用方写入前执行，否则独立事务要等调用方自己持有的写锁（SQLite 报 database is locked，
+    PostgreSQL 自锁死）。
+    """
+    if SALE_NO_BLOCK_SIZE <= 1:
+        return
+    need: dict[str, int] = {}
+    now = utc_now()
+    for data in orders:
+        if not (data.sale_no or "").strip():
+            prefix = _sale_no_prefix(data.sale_date or now)
+            need[prefix] = need.get(prefix, 0) + 1
+    if not need:
+        return
+    with _seq_blocks_lock:
+        short = {prefix: n for prefix, n in need.items() if _block_remaining(prefix) < n}
+    if not short:
+        return
+
+    # 访问数据库时不持有进程锁：其它请求可能正持有计数行的锁并等着从号段取号
+    blocks = {}
+    with Session(session.get_bind()) as block_session:
+        for prefix, n in short.items():
+            size = max(SALE_NO_BLOCK_SIZE, n)
+            last = _bump_sequence(block_session, prefix, size)
+            blocks[prefix] = (last - size + 1, last)
+        block_session.commit()
+    with _seq_blocks_lock:
+        # 旧号段剩余的号作废（单号可能不连续）；其它日期前缀的号段一并释放，避免按天累积
+        for other in [p for p in _seq_blocks if p not in need]:
+            del _seq_blocks[other]
+        _seq_blocks.update(blocks)
+
+
+def _block_remaining(prefix: str) -> int:
+    nxt, last = _seq_blocks.get(prefix, (1, 0))
+    return last - nxt + 1
+
+
+def _next_seq(session: Session, prefix: str) -> int:
+    """号段模式先取已预占的号；号段不足（被其它请求取走等）时在调用方事务内逐个递增计数器"""
+    if SALE_NO_BLOCK_SIZE > 1:
+        with _seq_blocks_lock:
+            nxt, last = _seq_blocks.get(prefix, (1, 0))
+            if nxt <= last:
+                _seq_blocks[prefix] = (nxt + 1, last)
+                return nxt
+    return _bump_sequence(session, prefix, 1)
+
 
+def _generate_sale_no(session: Session, sale_date: datetime) -> str:
+    prefix = _sale_no_prefix(sale_date)
+    return f"{prefix}{_next_seq(session, prefix):04d}"
 
-def _resolve_buyer_for_customer(session: Session, customer: Customer, buyer_id: int | None):
+
+def next_sale_no(session: Session) -> str:
+    """预览下一个单号，只读计数器，不占号"""
+    prefix = _sale_no_prefix(utc_now())
+    with _seq_blocks_lock:
+        nxt, last = _seq_blocks.get(prefix, (1, 0))
+    if nxt <= last:
+        return f"{prefix}{nxt:04d}"
+    last_seq = session.exec(select(SaleNoSequence.last_seq).where(SaleNoSequence.prefix == prefix)).first()
+    return f"{prefix}{int(last_seq or 0) + 1:04d}"
+
+
+def _resolve_buyer_for_customer(session: Session, customer: Customer, buyer_id: int | None, contacts: list | None = None):
+    """contacts: 批量开单时预加载的该客户联系人（按 id 升序），传入时不再逐单查询"""
     if customer.type == "personal":
         if buyer_id:
             buyer = session.get(CustomerContact, buyer_id)
             if buyer and buyer.customer_id == customer.id:
                 return buyer
-        buyer = session.exec(select(CustomerContact).where(CustomerContact.customer_id == customer.id).order_by(CustomerContact.id.asc())).first()
+        if contacts is None:
+            buyer = session.exec(select(CustomerContact).where(CustomerContact.customer_id == customer.id).order_by(CustomerContact.id.asc())).first()
+        else:
+            buyer = contacts[0] if contacts else None
         if buyer:
             return buyer
         buyer = CustomerContact(customer_id=customer.id, name=customer.name, phone=customer.phone, role="本人", is_active=True)
         session.add(buyer)
         session.flush()
+        if contacts is not None:
+            contacts.append(buyer)
         return buyer
 
     if not buyer_id:
@@ -68,35 +176,79 @@ def _resolve_buyer_for_customer(session: Session, customer: Customer, buyer_id:
     return buyer
 
 
-def create_sale(session: Session, data) -> SaleRead:
-    customer = session.get(Customer, data.customer_id)
+def _check_customer(customer: Customer | None) -> Customer:
     if not customer:
         raise NotFoundError("客户不存在")
     if not customer.is_active:
         raise BadRequestError("客户已停用，不能开单")
+    return customer
 
-    buyer = _resolve_buyer_for_customer(session, customer, data.buyer_id)
 
+def _check_products(data, prod_map: dict) -> None:
     if not data.items:
         raise BadRequestError("至少需要 1 行商品明细")
-
-    product_ids = list({i.product_id for i in data.items})
-    products = session.exec(select(Product).where(Product.id.in_(product_ids))).all()
-    prod_map = {p.id: p for p in products}
-
+    product_ids = list(dict.fromkeys(i.product_id for i in data.items))
     missing = [pid for pid in product_ids if pid not in prod_map]
     if missing:
         raise BadRequestError(f"商品不存在：{missing}")
-
-    inactive = [p.name for p in products if not p.is_active]
+    inactive = [prod_map[pid].name for pid in product_ids if not prod_map[pid].is_active]
     if inactive:
         raise BadRequestError(f"以下商品已停用：{', '.join(inactive)}")
 
+
+def create_sale(session: Session, data) -> SaleRead:
+    _reserve_seq_blocks(session, [data])
+    customer = _check_customer(session.get(Customer, data.customer_id))
+    buyer = _resolve_buyer_for_customer(session, customer, data.buyer_id)
+
+    product_ids = list({i.product_id for i in data.items})
+    products = session.exec(select(Product).where(Product.id.in_(product_ids))).all() if product_ids else []
+    _check_products(data, {p.id: p for p in products})
+
+    sale, warnings = _insert_sale(session, data, buyer, {p.id: p for p in products})
+    session.commit()
+    out = get_sale(session, sale.id)
+    out.warnings = warnings
+    return out
+
+
+def _price_warnings(data, prod_map: dict, bands: dict) -> list[SalePriceWarning]:
+    """
+    按成本价与该客户开单前的历史价格区间（最近价表中预先累计，无需额外查询）校验每行成交价。
+    区间为历史最低/最高价再上下放宽 PRICE_BAND_TOLERANCE。
+    """
+    warnings = []
+    for idx, it in enumerate(data.items):
+        price = round(float(it.unit_price), 2)
+        product = prod_map[it.product_id]
+        cost = round(float(product.standard_cost or 0), 2)
+        band = bands.get(it.product_id)
+        if cost > 0 and price < cost:
+            kind, ref, message = "below_cost", cost, f"{product.name} 成交价 {price:.2f} 低于成本价 {cost:.2f}"
+        elif band and band[3] > 0 and price < round(band[0] * (1 - PRICE_BAND_TOLERANCE), 2):
+            kind, ref, message = "below_history", band[0], f"{product.name} 成交价 {price:.2f} 明显低于该客户历史最低价 {band[0]:.2f}（均价 {band[2] / band[3]:.2f}）"
+        elif band and band[3] > 0 and price > round(band[1] * (1 + PRICE_BAND_TOLERANCE), 2):
+            kind, ref, message = "above_history", band[1], f"{product.name} 成交价 {price:.2f} 明显高于该客户历史最高价 {band[1]:.2f}（均价 {band[2] / band[3]:.2f}）"
+        else:
+            continue
+        warnings.append(
+            SalePriceWarning(line_index=idx, product_id=it.product_id, unit_price=price, kind=kind, reference_price=ref, message=message)
+        )
+    return warnings
+
+
+def _insert_sale(session: Session, data, buyer: CustomerContact, prod_map: dict) -> tuple[Sale, list[SalePriceWarning]]:
+    """写入单头、明细、库存变动与流水（不提交），调用方负责校验与事务；返回单头与价格校验提示"""
     sale_date = data.sale_date or utc_now()
-    preferred_sale_no = (data.sale_no or "").strip()
+    sale_no = (data.sale_no or "").strip()
+    if sale_no and session.exec(select(Sale.id).where(Sale.sale_no == sale_no)).first():
+        sale_no = ""
+    if sale_no:
+        _observe_sale_no(session, sale_no)
+    else:
+        sale_no = _generate_sale_no(session, sale_date)
 
     for _ in range(3):
-        sale_no = preferred_sale_no or _generate_sale_no(session, sale_date)
         sale = Sale(
             sale_no=sale_no,
             customer_id=data.customer_id,
@@ -115,62 +267,135 @@ def create_sale(session: Session, data) -> SaleRead:
             payment_method=None,
             payment_note=None,
         )
-        session.add(sale)
         try:
-            session.flush()
+            with session.begin_nested():
+                session.add(sale)
+                session.flush()
+            break
         except IntegrityError:
-            session.rollback()
-            preferred_sale_no = ""
-            continue
+            # 仅在手工单号被并发占用时发生，换一个计数器生成的新号
+            sale_no = _generate_sale_no(session, sale_date)
+    else:
+        raise BadRequestError("生成单号失败，请重试")
+
+    now = utc_now()
+    total = 0.0
+    gross_profit = 0.0
+    item_rows = []
+    for it in data.items:
+        qty = float(it.qty)
+        price = float(it.unit_price)
+        if qty <= 0:
+            raise BadRequestError("数量必须大于 0")
+        if price < 0:
+            raise BadRequestError("成交价不能为负数")
+
+        line_total = round(qty * price, 2)
+        total += line_total
+
+        unit_cost = float(prod_map[it.product_id].standard_cost or 0)
+        line_gp = round((price - unit_cost) * qty, 2)
+        gross_profit += line_gp
+        item_rows.append(
+            {
+                "sale_id": sale.id,
+                "product_id": it.product_id,
+                "qty": qty,
+                "unit_price": price,
+                "sold_price": price,
+                "line_total": line_total,
+                "unit_cost": unit_cost,
+                "gross_profit": line_gp,
+                "remark": it.note,
+                "created_at": now,
+            }
+        )
 
-        total = 0.0
-        for it in data.items:
-            qty = float(it.qty)
-            price = float(it.unit_price)
-            if qty <= 0:
-                raise BadRequestError("数量必须大于 0")
-            if price < 0:
-                raise BadRequestError("成交价不能为负数")
-
-            line_total = round(qty * price, 2)
-            total += line_total
-
-            p = prod_map[it.product_id]
-            before_qty = float(p.stock_quantity or 0)
-            p.stock_quantity = round(before_qty - qty, 2)
-            session.add(
-                InventoryTxn(
-                    product_id=p.id,
-                    change_qty=round(-qty, 2),
-                    after_qty=float(p.stock_quantity),
-                    biz_type="sale",
-                    biz_id=sale.id,
-                    sale_id=sale.id,
-                    note=f"销售单{sale.sale_no}扣减",
-                )
-            )
-            session.add(p)
-
-            si = SaleItem(
-                sale_id=sale.id,
-                product_id=it.product_id,
-                qty=qty,
-                unit_price=price,
-                sold_price=price,
-                line_total=line_total,
-                remark=it.note,
-            )
-            session.add(si)
-
-        sale.total_amount = round(total, 2)
-        sale.ar_amount = round(total, 2)
-        sale.payment_status = _compute_payment_status(sale.total_amount, sale.paid_amount)
-        sale.settlement_status = _to_settlement_status(sale.payment_status)
-        session.add(sale)
-        session.commit()
-        return get_sale(session, sale.id)
+    after_qtys = product_service.apply_stock_deltas(session, [(r["product_id"], -r["qty"]) for r in item_rows])
+    session.exec(insert(SaleItem), params=item_rows)
+    session.exec(
+        insert(InventoryTxn),
+        params=[
+            {
+                "product_id": r["product_id"],
+                "change_qty": round(-r["qty"], 2),
+                "after_qty": after_qty,
+                "biz_type": "sale",
+                "biz_id": sale.id,
+                "sale_id": sale.id,
+                "note": f"销售单{sale.sale_no}扣减",
+                "created_at": now,
+            }
+            for r, after_qty in zip(item_rows, after_qtys)
+        ],
+    )
 
-    raise BadRequestError("生成单号失败，请重试")
+    sale.total_amount = round(total, 2)
+    sale.ar_amount = round(total, 2)
+    sale.gross_profit = round(gross_profit, 2)
+    sale.payment_status = _compute_payment_status(sale.total_amount, sale.paid_amount)
+    sale.settlement_status = _to_settlement_status(sale.payment_status)
+    session.add(sale)
+    session.flush()
+    customer_balance_service.apply_balance_delta(session, sale.customer_id, sales=sale.total_amount)
+    bands = last_price_service.record_sale(session, customer_id=sale.customer_id, sale_id=sale.id, sale_date=sale_date, item_rows=item_rows)
+    warnings = _price_warnings(data, prod_map, bands) if data.price_check else []
+    return sale, warnings
+
+
+def create_sales_batch(session: Session, orders: list, *, chunk_size: int = 100, progress=None) -> list[dict]:
+    """
+    批量开单（离线收银补传）：客户、联系人、商品各一次查询预加载；
+    每单在 savepoint 中写入，失败只回滚该单；每 chunk_size 单提交一次。
+    progress（idempotency_service.Progress）：每批提交前登记已完成结果，与该批同一事务提交；
+    带有此前已提交的结果时跳过这些单，从断点继续。
+    """
+    customer_ids = list({o.customer_id for o in orders})
+    customers = {c.id: c for c in session.exec(select(Customer).where(Customer.id.in_(customer_ids))).all()}
+    contacts_by_customer: dict[int, list] = {cid: [] for cid in customer_ids}
+    for ct in session.exec(
+        select(CustomerContact).where(CustomerContact.customer_id.in_(customer_ids)).order_by(CustomerContact.id.asc())
+    ).all():
+        contacts_by_customer[ct.customer_id].append(ct)
+    product_ids = list({it.product_id for o in orders for it in o.items})
+    prod_map = {p.id: p for p in session.exec(select(Product).where(Product.id.in_(product_ids))).all()} if product_ids else {}
+
+    results = list(progress.saved) if progress and progress.saved else []
+    expire_on_commit = session.expire_on_commit
+    # 预加载的对象跨 chunk 复用，提交后不过期，避免逐个重新加载
+    session.expire_on_commit = False
+    try:
+        for start in range(len(results), len(orders), chunk_size):
+            _reserve_seq_blocks(session, orders[start : start + chunk_size])
+            for idx, data in enumerate(orders[start : start + chunk_size], start=start):
+                contacts = contacts_by_customer[data.customer_id]
+                try:
+                    with session.begin_nested():
+                        customer = _check_customer(customers.get(data.customer_id))
+                        buyer = _resolve_buyer_for_customer(session, customer, data.buyer_id, contacts)
+                        _check_products(data, prod_map)
+                        sale, warnings = _insert_sale(session, data, buyer, prod_map)
+                    results.append(
+                        {
+                            "index": idx,
+                            "ok": True,
+                            "sale_id": sale.id,
+                            "sale_no": sale.sale_no,
+                            "total_amount": sale.total_amount,
+                            "error": None,
+                            "warnings": warnings,
+                        }
+                    )
+                except (NotFoundError, BadRequestError) as exc:
+                    # savepoint 回滚后，本单内新建的默认拿货人已失效
+                    contacts[:] = [ct for ct in contacts if sa_inspect(ct).persistent]
+                    results.append({"index": idx, "ok": False, "sale_id": None, "sale_no": None, "total_amount": None, "error": exc.message})
+            if progress:
+                progress.save(results)
+            session.commit()
+    finally:
+        session.expire_on_commit = expire_on_commit
+    return results
 
 
 def update_settlement(session: Session, *, sale_id: int, settlement_status: str, paid_amount: float, payment_method: str | None, payment_note: str | None):
@@ -187,16 +412,6 @@ def update_settlement(session: Session, *, sale_id: int, settlement_status: str,
     return get_sale(session, sale_id)
 
 
-def _sale_gross_profit(session: Session, sale_id: int) -> float:
-    rows = session.exec(
-        select(SaleItem, Product).join(Product, Product.id == SaleItem.product_id).where(SaleItem.sale_id == sale_id)
-    ).all()
-    gp = 0.0
-    for si, p in rows:
-        gp += (float(si.unit_price or si.sold_price) - float(p.standard_cost or 0)) * float(si.qty)
-    return round(gp, 2)
-
-
 def list_sales(session: Session, customer_id: int | None, page: int, page_size: int):
     stmt = select(Sale, Customer).join(Customer, Customer.id == Sale.customer_id)
     if customer_id:
@@ -218,7 +433,7 @@ def list_sales(session: Session, customer_id: int | None, page: int, page_size:
             paid_amount=s.paid_amount,
             ar_amount=s.ar_amount,
             payment_status=s.payment_status,
-            gross_profit=_sale_gross_profit(session, s.id),
+            gross_profit=s.gross_profit,
             biz_status=s.biz_status,
         )
         for (s, c) in rows
@@ -226,20 +441,7 @@ def list_sales(session: Session, customer_id: int | None, page: int, page_size:
     return items, total, page, page_size
 
 
-def get_sale(session: Session, sale_id: int) -> SaleRead:
-    row = session.exec(select(Sale, Customer).join(Customer, Customer.id == Sale.customer_id).where(Sale.id == sale_id)).first()
-    if not row:
-        raise NotFoundError("单据不存在")
-
-    sale, customer = row
-
-    item_rows = session.exec(
-        select(SaleItem, Product)
-        .join(Product, Product.id == SaleItem.product_id)
-        .where(SaleItem.sale_id == sale_id)
-        .order_by(SaleItem.id.asc())
-    ).all()
-
+def _sale_read(sale: Sale, customer: Customer, item_rows) -> SaleRead:
     items = [
         SaleItemRead(
             id=si.id,
@@ -250,7 +452,7 @@ def get_sale(session: Session, sale_id: int) -> SaleRead:
             qty=si.qty,
             unit_price=si.unit_price or si.sold_price,
             line_total=si.line_total,
-            gross_profit=round((float(si.unit_price or si.sold_price) - float(p.standard_cost or 0)) * float(si.qty), 2),
+            gross_profit=si.gross_profit,
             note=si.remark,
         )
         for (si, p) in item_rows
@@ -273,21 +475,42 @@ def get_sale(session: Session, sale_id: int) -> SaleRead:
         settlement_status=sale.settlement_status,
         payment_method=sale.payment_method,
         payment_note=sale.payment_note,
-        gross_profit=_sale_gross_profit(session, sale.id),
+        gross_profit=sale.gross_profit,
         biz_status=sale.biz_status,
         created_at=sale.created_at,
         items=items,
     )
 
 
-def recompute_sale_payment(session: Session, sale: Sale):
-    paid_direct = float(session.exec(select(func.coalesce(func.sum(Payment.amount), 0)).where(Payment.sale_id == sale.id)).one() or 0)
-    paid_alloc = float(session.exec(select(func.coalesce(func.sum(PaymentAllocation.amount), 0)).where(PaymentAllocation.sale_id == sale.id)).one() or 0)
-    paid = round(paid_direct + paid_alloc, 2)
-    sale.paid_amount = paid
-    sale.ar_amount = round(max(float(sale.total_amount) - sale.paid_amount, 0), 2)
-    sale.payment_status = _compute_payment_status(float(sale.total_amount), float(sale.paid_amount))
-    sale.settlement_status = _to_settlement_status(sale.payment_status)
-    if sale.settlement_status == "UNPAID":
-        sale.payment_method = None
-    session.add(sale)
+def get_sale(session: Session, sale_id: int) -> SaleRead:
+    row = session.exec(select(Sale, Customer).join(Customer, Customer.id == Sale.customer_id).where(Sale.id == sale_id)).first()
+    if not row:
+        raise NotFoundError("单据不存在")
+
+    sale, customer = row
+
+    item_rows = session.exec(
+        select(SaleItem, Product)
+        .join(Product, Product.id == SaleItem.product_id)
+        .where(SaleItem.sale_id == sale_id)
+        .order_by(SaleItem.id.asc())
+    ).all()
+    return _sale_read(sale, customer, item_rows)
+
+
+def get_sales_bulk(session: Session, sale_ids: list[int]) -> list[tuple[SaleRead, Customer]]:
+    """按 id 批量取单据详情：单据+客户一次查询、明细+商品一次查询，按传入顺序返回 (详情, 客户)"""
+    if not sale_ids:
+        return []
+    rows = session.exec(select(Sale, Customer).join(Customer, Customer.id == Sale.customer_id).where(Sale.id.in_(sale_ids))).all()
+    items_by_sale: dict[int, list] = {sid: [] for sid in sale_ids}
+    for si, p in session.exec(
+        select(SaleItem, Product)
+        .join(Product, Product.id == SaleItem.product_id)
+        .where(SaleItem.sale_id.in_(sale_ids))
+        .order_by(SaleItem.sale_id.asc(), SaleItem.id.asc())
+    ).all():
+        items_by_sale[si.sale_id].append((si, p))
+    by_id = {sale.id: (_sale_read(sale, customer, items_by_sale[sale.id]), customer) for sale, customer in rows}
+    return [by_id[sid] for sid in sale_ids if sid in by_id]
+
@@ -4,10 +4,11 @@ from sqlmodel import Session
 
 from app.core.errors import BadRequestError, NotFoundError
 from app.core.time import utc_now
+from sqlalchemy import insert
 from sqlmodel import select
 
-from app.models import InventoryTxn, Payment, Product, Sale, SaleItem, SaleOperation
-from app.services import payment_service
+from app.models import InventoryTxn, Payment, Sale, SaleItem, SaleOperation
+from app.services import customer_balance_service, last_price_service, payment_service, product_service
 
 _ALLOWED_SETTLEMENT = {"UNPAID", "PARTIAL", "PAID"}
 _ALLOWED_METHODS = {"cash", "wechat", "alipay", "bank_transfer", "bank", "transfer", "other", "现金", "微信", "支付宝", "银行卡", "转账", "其他"}
@@ -63,10 +64,11 @@ def apply_settlement_compat(
             note=payment_note,
         )
         session.add(pay)
-        # 修复：必须在此刻 Flush，否则接下来的 recompute_sale_payment 中的 SQL SUM 查不到这条新流水
         session.flush()
+        payment_service.refresh_payment_search_text(session, [pay.id])
+        customer_balance_service.apply_balance_delta(session, sale.customer_id, received=pay.amount)
 
-    payment_service.recompute_sale_payment(session, sale)
+    payment_service.apply_sale_paid_delta(session, sale, delta if abs(delta) > 1e-6 else 0)
     if settlement_status == "UNPAID":
         sale.payment_method = None
     else:
@@ -77,6 +79,37 @@ def apply_settlement_compat(
     return sale
 
 
+def _restore_stock(session: Session, sale: Sale, items, *, biz_type: str, note: str):
+    """整单回补库存：原子更新库存后批量写入库存流水"""
+    after_qtys = product_service.apply_stock_deltas(session, [(si.product_id, float(si.qty)) for si in items])
+    now = utc_now()
+    txns = [
+        {
+            "product_id": si.product_id,
+            "change_qty": float(si.qty),
+            "after_qty": after_qty,
+            "biz_type": biz_type,
+            "biz_id": sale.id,
+            "sale_id": sale.id,
+            "note": note,
+            "created_at": now,
+        }
+        for si, after_qty in zip(items, after_qtys)
+        if after_qty is not None
+    ]
+    if txns:
+        session.exec(insert(InventoryTxn), params=txns)
+
+
+def _clear_gross_profit(session: Session, sale: Sale, items):
+    """作废/整单退货后该单不再产生毛利"""
+    for si in items:
+        si.gross_profit = 0
+        session.add(si)
+    sale.gross_profit = 0
+    session.add(sale)
+
+
 def mark_sale_void(session: Session, *, sale_id: int, note: Optional[str]):
     sale = session.get(Sale, sale_id)
     if not sale:
@@ -86,17 +119,13 @@ def mark_sale_void(session: Session, *, sale_id: int, note: Optional[str]):
 
     # 库存回补（作废单按整单回补）
     rows = session.exec(select(SaleItem).where(SaleItem.sale_id == sale.id)).all()
-    for si in rows:
-        p = session.get(Product, si.product_id)
-        if not p:
-            continue
-        p.stock_quantity = round(float(p.stock_quantity or 0) + float(si.qty), 2)
-        session.add(InventoryTxn(product_id=p.id, change_qty=float(si.qty), after_qty=float(p.stock_quantity), biz_type="sale_void", biz_id=sale.id, sale_id=sale.id, note="销售作废回补库存"))
-        session.add(p)
+    _restore_stock(session, sale, rows, biz_type="sale_void", note="销售作废回补库存")
+    _clear_gross_profit(session, sale, rows)
 
     sale.biz_status = "VOIDED"
     session.add(SaleOperation(sale_id=sale.id, op_type="VOID", amount=float(sale.total_amount), note=note))
     session.add(sale)
+    last_price_service.refresh_last_prices(session, sale.customer_id, [si.product_id for si in rows])
     session.commit()
     return sale
 
@@ -113,22 +142,22 @@ def reverse_settlement(session: Session, *, sale_id: int, amount: Optional[float
     if reverse_amount > can_reverse + 1e-6:
         raise BadRequestError("反结算金额不能超过已收金额")
 
-    session.add(
-        Payment(
-            receipt_no=payment_service._gen_receipt_no(),
-            customer_id=sale.customer_id,
-            sale_id=sale.id,
-            pay_type="settlement_reverse",
-            amount=round(-reverse_amount, 2),
-            method="other",
-            paid_at=utc_now(),
-            note=note,
-        )
+    pay = Payment(
+        receipt_no=payment_service._gen_receipt_no(),
+        customer_id=sale.customer_id,
+        sale_id=sale.id,
+        pay_type="settlement_reverse",
+        amount=round(-reverse_amount, 2),
+        method="other",
+        paid_at=utc_now(),
+        note=note,
     )
+    session.add(pay)
     session.add(SaleOperation(sale_id=sale.id, op_type="REVERSE_SETTLEMENT", amount=reverse_amount, note=note))
-    # 修复：必须 Flush
     session.flush()
-    payment_service.recompute_sale_payment(session, sale)
+    payment_service.refresh_payment_search_text(session, [pay.id])
+    payment_service.apply_sale_paid_delta(session, sale, pay.amount)
+    customer_balance_service.apply_balance_delta(session, sale.customer_id, received=pay.amount)
     session.add(sale)
     session.commit()
     return sale
@@ -138,7 +167,9 @@ def sale_operations(session: Session, *, sale_id: int):
     sale = session.get(Sale, sale_id)
     if not sale:
         raise NotFoundError("单据不存在")
-    rows = sorted(sale.operations, key=lambda x: (x.created_at, x.id), reverse=True)
+    rows = session.exec(
+        select(SaleOperation).where(SaleOperation.sale_id == sale.id).order_by(SaleOperation.created_at.desc(), SaleOperation.id.desc())
+    ).all()
     return [
         {"id": row.id, "op_type": row.op_type, "amount": row.amount, "note": row.note, "created_at": row.created_at.isoformat().replace('+00:00', 'Z')}
         for row in rows
@@ -152,13 +183,9 @@ def return_sale_stock(session: Session, *, sale_id: int, note: Optional[str]):
     rows = session.exec(select(SaleItem).where(SaleItem.sale_id == sale.id)).all()
     if not rows:
         raise BadRequestError("单据无明细")
-    for si in rows:
-        p = session.get(Product, si.product_id)
-        if not p:
-            continue
-        p.stock_quantity = round(float(p.stock_quantity or 0) + float(si.qty), 2)
-        session.add(InventoryTxn(product_id=p.id, change_qty=float(si.qty), after_qty=float(p.stock_quantity), biz_type="sale_return", biz_id=sale.id, sale_id=sale.id, note=note or "销售退货回补库存"))
-        session.add(p)
+    _restore_stock(session, sale, rows, biz_type="sale_return", note=note or "销售退货回补库存")
+    _clear_gross_profit(session, sale, rows)
     session.add(SaleOperation(sale_id=sale.id, op_type="RETURN", amount=float(sale.total_amount), note=note))
+    last_price_service.refresh_last_prices(session, sale.customer_id, [si.product_id for si in rows])
     session.commit()
     return sale
\ No newline at end of file
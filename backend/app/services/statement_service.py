@@ -1,40 +1,50 @@
-from datetime import datetime
 from io import StringIO
-from typing import Optional, Tuple, List
+from typing import Iterator, List, Optional, Tuple
 import csv
+import tempfile
 
 from sqlalchemy import func, or_
 from sqlmodel import Session, select
 
-from app.models import CustomerContact, Payment, Sale
-
-
-def _parse_iso(dt_str: Optional[str]) -> Optional[datetime]:
-    if not dt_str:
-        return None
-    if len(dt_str) == 10:
-        dt_str = f"{dt_str}T00:00:00"
-    return datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
+from app.core.errors import BadRequestError
+from app.core.time import parse_iso_datetime
+from app.models import Customer, CustomerContact, Sale
+from app.services import customer_balance_service
 
 
 def _base_stmt(customer_id: int):
-    return select(Sale, CustomerContact).outerjoin(CustomerContact, CustomerContact.id == Sale.buyer_id).where(Sale.customer_id == customer_id)
+    return (
+        select(
+            Sale.id,
+            Sale.sale_no,
+            Sale.sale_date,
+            Sale.project,
+            Sale.contact_name_snapshot,
+            Sale.total_amount,
+            Sale.paid_amount,
+            Sale.ar_amount,
+            Sale.payment_status,
+            Sale.note,
+            CustomerContact.name.label("buyer_name"),
+        )
+        .outerjoin(CustomerContact, CustomerContact.id == Sale.buyer_id)
+        .where(Sale.customer_id == customer_id)
+    )
 
 
-def get_statement(
-    session: Session,
-    *,
+def _filtered_stmt(
     customer_id: int,
+    *,
     start_date: Optional[str],
     end_date: Optional[str],
-    page: int,
-    page_size: int,
-    q: Optional[str] = None,
-    payment_status: Optional[str] = None,
-    sort_by: str = "date_desc",
-) -> Tuple[dict, List[dict], int]:
-    start_dt = _parse_iso(start_date)
-    end_dt = _parse_iso(end_date)
+    q: Optional[str],
+    payment_status: Optional[str],
+):
+    try:
+        start_dt = parse_iso_datetime(start_date)
+        end_dt = parse_iso_datetime(end_date, end_of_day=True)
+    except ValueError:
+        raise BadRequestError("日期格式错误")
 
     stmt = _base_stmt(customer_id)
     if start_dt:
@@ -52,72 +62,201 @@ def get_statement(
                 Sale.contact_name_snapshot.ilike(like),
             )
         )
+    return stmt
 
-    total = int(session.exec(select(func.count()).select_from(stmt.subquery())).one() or 0)
 
+def _ordered(stmt, sort_by: str):
     if sort_by == "ar_desc":
-        stmt = stmt.order_by(Sale.ar_amount.desc(), Sale.sale_date.desc(), Sale.id.desc())
-    elif sort_by == "date_asc":
-        stmt = stmt.order_by(Sale.sale_date.asc(), Sale.id.asc())
-    else:
-        stmt = stmt.order_by(Sale.sale_date.desc(), Sale.id.desc())
-
-    rows = session.exec(stmt.offset((page - 1) * page_size).limit(page_size)).all()
-
-    items = []
-    for sale, buyer in rows:
-        buyer_name = buyer.name if buyer else sale.contact_name_snapshot
-        items.append(
-            {
-                "id": sale.id,
-                "sale_id": sale.id,
-                "sale_no": sale.sale_no,
-                "date": sale.sale_date.isoformat().replace("+00:00", "Z"),
-                "sale_date": sale.sale_date.isoformat().replace("+00:00", "Z"),
-                "project": sale.project,
-                "project_name": sale.project,
-                "buyer_name": buyer_name,
-                "contact_name_snapshot": buyer_name,
-                "total": round(float(sale.total_amount), 2),
-                "total_amount": round(float(sale.total_amount), 2),
-                "paid": round(float(sale.paid_amount), 2),
-                "paid_amount": round(float(sale.paid_amount), 2),
-                "unpaid": round(float(sale.ar_amount), 2),
-                "balance": round(float(sale.ar_amount), 2),
-                "ar": round(float(sale.ar_amount), 2),
-                "status": sale.payment_status,
-                "payment_status": sale.payment_status,
-                "note": sale.note,
-            }
-        )
+        return stmt.order_by(Sale.ar_amount.desc(), Sale.sale_date.desc(), Sale.id.desc())
+    if sort_by == "date_asc":
+        return stmt.order_by(Sale.sale_date.asc(), Sale.id.asc())
+    return stmt.order_by(Sale.sale_date.desc(), Sale.id.desc())
 
-    total_sales = float(session.exec(select(func.coalesce(func.sum(Sale.total_amount), 0)).where(Sale.customer_id == customer_id)).one() or 0)
-    total_paid = float(session.exec(select(func.coalesce(func.sum(Payment.amount), 0)).where(Payment.customer_id == customer_id)).one() or 0)
 
-    summary = {
-        "total_sales_amount": round(total_sales, 2),
-        "total_paid_amount": round(total_paid, 2),
-        "total_balance": round(total_sales - total_paid, 2),
+def _statement_item(row) -> dict:
+    buyer_name = row.buyer_name or row.contact_name_snapshot
+    sale_date = row.sale_date.isoformat().replace("+00:00", "Z")
+    return {
+        "id": row.id,
+        "sale_id": row.id,
+        "sale_no": row.sale_no,
+        "date": sale_date,
+        "sale_date": sale_date,
+        "project": row.project,
+        "project_name": row.project,
+        "buyer_name": buyer_name,
+        "contact_name_snapshot": buyer_name,
+        "total": round(float(row.total_amount), 2),
+        "total_amount": round(float(row.total_amount), 2),
+        "paid": round(float(row.paid_amount), 2),
+        "paid_amount": round(float(row.paid_amount), 2),
+        "unpaid": round(float(row.ar_amount), 2),
+        "balance": round(float(row.ar_amount), 2),
+        "ar": round(float(row.ar_amount), 2),
+        "status": row.payment_status,
+        "payment_status": row.payment_status,
+        "note": row.note,
     }
 
-    return summary, items, total
+
+def get_statement_summary(session: Session, customer_id: int) -> dict:
+    balance = customer_balance_service.get_balance(session, customer_id)
+    return {
+        "total_sales_amount": balance["total_sales"],
+        "total_paid_amount": balance["total_received"],
+        "total_balance": balance["total_ar"],
+    }
 
 
-def export_statement_csv(session: Session, *, customer_id: int, start_date: Optional[str], end_date: Optional[str], q: Optional[str], payment_status: Optional[str], sort_by: str):
-    _, items, _ = get_statement(
+def get_statement(
+    session: Session,
+    *,
+    customer_id: int,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    page: int,
+    page_size: int,
+    q: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    sort_by: str = "date_desc",
+) -> Tuple[dict, List[dict], int]:
+    stmt = _filtered_stmt(customer_id, start_date=start_date, end_date=end_date, q=q, payment_status=payment_status)
+
+    total = int(session.exec(select(func.count()).select_from(stmt.subquery())).one() or 0)
+
+    rows = session.exec(_ordered(stmt, sort_by).offset((page - 1) * page_size).limit(page_size)).all()
+    items = [_statement_item(row) for row in rows]
+
+    return get_statement_summary(session, customer_id), items, total
+
+
+def _stream_items(session: Session, stmt, chunk_size: int) -> Iterator[dict]:
+    result = session.exec(stmt.execution_options(stream_results=True, yield_per=chunk_size))
+    try:
+        for row in result:
+            yield _statement_item(row)
+    finally:
+        result.close()
+
+
+def iter_statement_items(
+    session: Session,
+    *,
+    customer_id: int,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    q: Optional[str],
+    payment_status: Optional[str],
+    sort_by: str,
+    chunk_size: int = 500,
+) -> Iterator[dict]:
+    """
+    按筛选条件逐行产出对账单明细：服务端游标分批读取，内存占用与总行数无关。
+    筛选条件在调用时即解析校验，出错不会等到开始输出之后。
+    """
+    stmt = _ordered(
+        _filtered_stmt(customer_id, start_date=start_date, end_date=end_date, q=q, payment_status=payment_status),
+        sort_by,
+    )
+    return _stream_items(session, stmt, chunk_size)
+
+
+def _csv_chunks(items: Iterator[dict], chunk_size: int) -> Iterator[str]:
+    sio = StringIO()
+    writer = csv.writer(sio)
+    writer.writerow(["单号", "日期", "项目", "拿货人", "总额", "已付", "未付", "状态", "备注"])
+    n = 0
+    for it in items:
+        writer.writerow([it["sale_no"], it["date"], it["project"], it["buyer_name"], it["total"], it["paid"], it["ar"], it["status"], it.get("note") or ""])
+        n += 1
+        if n % chunk_size == 0:
+            yield sio.getvalue()
+            sio.seek(0)
+            sio.truncate(0)
+    yield sio.getvalue()
+
+
+def export_statement_csv(session: Session, *, customer_id: int, start_date: Optional[str], end_date: Optional[str], q: Optional[str], payment_status: Optional[str], sort_by: str, chunk_size: int = 500) -> Iterator[str]:
+    """流式生成对账单 CSV：每 chunk_size 行输出一块文本，不设行数上限"""
+    items = iter_statement_items(
         session,
         customer_id=customer_id,
         start_date=start_date,
         end_date=end_date,
-        page=1,
-        page_size=5000,
         q=q,
         payment_status=payment_status,
         sort_by=sort_by,
+        chunk_size=chunk_size,
     )
-    sio = StringIO()
-    writer = csv.writer(sio)
-    writer.writerow(["单号", "日期", "项目", "拿货人", "总额", "已付", "未付", "状态", "备注"])
+    return _csv_chunks(items, chunk_size)
+
+
+_STATEMENT_STATUS_LABELS = {"paid": "已结清", "partial": "部分付款", "unpaid": "未付款"}
+
+
+def _xlsx_chunks(wb, ws, items: Iterator[dict], *, read_size: int = 64 * 1024) -> Iterator[bytes]:
+    from openpyxl.cell import WriteOnlyCell
+
+    def _date_cell(value):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.number_format = "yyyy-mm-dd hh:mm"
+        return cell
+
+    def _money_cell(value):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.number_format = "#,##0.00"
+        return cell
+
     for it in items:
-        writer.writerow([it["sale_no"], it["date"], it["project"], it["buyer_name"], it["total"], it["paid"], it["ar"], it["status"], it.get("note") or ""])
-    return sio.getvalue()
+        sale_date = datetime.fromisoformat(it["date"].replace("Z", "+00:00")).replace(tzinfo=None)
+        ws.append([
+            it["sale_no"],
+            _date_cell(sale_date),
+            it["project"],
+            it["buyer_name"],
+            _money_cell(it["total"]),
+            _money_cell(it["paid"]),
+            _money_cell(it["ar"]),
+            _STATEMENT_STATUS_LABELS.get(it["status"], it["status"]),
+            it.get("note") or "",
+        ])
+
+    # write-only 模式下行数据已边写边落盘，保存时只做 zip 打包；再按块读出，内存不随行数增长
+    with tempfile.TemporaryFile() as fp:
+        wb.save(fp)
+        fp.seek(0)
+        while True:
+            chunk = fp.read(read_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def export_statement_xlsx(session: Session, *, customer_id: int, start_date: Optional[str], end_date: Optional[str], q: Optional[str], payment_status: Optional[str], sort_by: str, chunk_size: int = 500) -> Iterator[bytes]:
+    """对账单 Excel：openpyxl write-only 模式，表头带汇总，数值/日期为带格式的真实类型单元格"""
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise BadRequestError("请安装 openpyxl 库")
+
+    items = iter_statement_items(
+        session,
+        customer_id=customer_id,
+        start_date=start_date,
+        end_date=end_date,
+        q=q,
+        payment_status=payment_status,
+        sort_by=sort_by,
+        chunk_size=chunk_size,
+    )
+    summary = get_statement_summary(session, customer_id)
+    customer = session.get(Customer, customer_id)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("对账单")
+    ws.append(["客户", customer.name if customer else ""])
+    ws.append(["期间", f"{start_date or ''} ~ {end_date or ''}"])
+    ws.append(["累计销售", summary["total_sales_amount"], "累计已付", summary["total_paid_amount"], "应收余额", summary["total_balance"]])
+    ws.append([])
+    ws.append(["单号", "日期", "项目", "拿货人", "总额", "已付", "未付", "状态", "备注"])
+    return _xlsx_chunks(wb, ws, items)
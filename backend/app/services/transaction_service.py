@@ -4,7 +4,9 @@ from typing import Optional
 from sqlalchemy import or_
 from sqlmodel import Session, select
 
-from app.models import Customer, Payment, PaymentAllocation, Product, Sale, SaleItem
+from app.models import Customer, Payment, Product, Sale, SaleItem
+from app.services import payment_service
+from app.services.pagination import keyset_paginate
 
 
 def _parse_iso(v: Optional[str], *, end_of_day: bool = False):
@@ -29,6 +31,8 @@ def list_sales_transactions(
         end_date: Optional[str],
         q: Optional[str],
         status: Optional[str],
+        cursor: Optional[str] = None,
+        with_total: bool = True,
 ):
     start_dt = _parse_iso(start_date)
     end_dt = _parse_iso(end_date, end_of_day=True)
@@ -44,18 +48,31 @@ def list_sales_transactions(
         stmt = stmt.where(Sale.payment_status == status)
     if q and q.strip():
         like = f"%{q.strip()}%"
-        stmt = stmt.outerjoin(SaleItem, SaleItem.sale_id == Sale.id).outerjoin(Product,
-                                                                               Product.id == SaleItem.product_id).where(
+        # 商品名用 EXISTS 匹配，避免 JOIN 明细导致一单多行、total 虚高
+        product_match = (
+            select(SaleItem.id)
+            .join(Product, Product.id == SaleItem.product_id)
+            .where(SaleItem.sale_id == Sale.id, Product.name.ilike(like))
+            .exists()
+        )
+        stmt = stmt.where(
             or_(
                 Sale.sale_no.ilike(like),
                 Customer.name.ilike(like),
-                Product.name.ilike(like),
+                product_match,
             )
         )
 
-    rows_all = session.exec(stmt.order_by(Sale.sale_date.desc(), Sale.id.desc())).all()
-    total = len(rows_all)
-    rows = rows_all[(page - 1) * page_size: page * page_size]
+    rows, total, next_cursor = keyset_paginate(
+        session,
+        stmt,
+        keys=(Sale.sale_date, Sale.id),
+        row_key=lambda row: (row[0].sale_date, row[0].id),
+        page=page,
+        page_size=page_size,
+        cursor=cursor,
+        with_total=with_total,
+    )
     items = [
         {
             "occurred_at": _to_iso_z(s.sale_date),
@@ -70,7 +87,7 @@ def list_sales_transactions(
         }
         for s, c in rows
     ]
-    return items, total
+    return items, total, next_cursor
 
 
 def list_payment_transactions(
@@ -82,53 +99,52 @@ def list_payment_transactions(
         end_date: Optional[str],
         q: Optional[str],
         method: Optional[str],
+        cursor: Optional[str] = None,
+        with_total: bool = True,
 ):
     start_dt = _parse_iso(start_date)
     end_dt = _parse_iso(end_date, end_of_day=True)
 
-    stmt = select(Payment, Customer).join(Customer, Customer.id == Payment.customer_id)
+    stmt = (
+        select(Payment, Customer, Sale.sale_no)
+        .join(Customer, Customer.id == Payment.customer_id)
+        .outerjoin(Sale, Sale.id == Payment.sale_id)
+    )
     if start_dt:
         stmt = stmt.where(Payment.paid_at >= start_dt)
     if end_dt:
         stmt = stmt.where(Payment.paid_at <= end_dt)
     if method:
         stmt = stmt.where(Payment.method == method)
-
-    rows_all = session.exec(stmt.order_by(Payment.paid_at.desc(), Payment.id.desc())).all()
-    raw = []
     qv = (q or "").strip().lower()
-    for p, c in rows_all:
-        sale_nos = []
-        if p.sale_id:
-            sale = session.get(Sale, p.sale_id)
-            if sale:
-                sale_nos.append(sale.sale_no)
-        alloc_sales = session.exec(
-            select(Sale)
-            .join(PaymentAllocation, PaymentAllocation.sale_id == Sale.id)
-            .where(PaymentAllocation.payment_id == p.id)
-            .order_by(Sale.sale_date.asc(), Sale.id.asc())
-        ).all()
-        for s in alloc_sales:
-            if s.sale_no not in sale_nos:
-                sale_nos.append(s.sale_no)
-
-        row = {
+    if qv:
+        # 转义通配符，让 % / _ 按字面匹配
+        escaped = qv.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        stmt = stmt.where(Payment.search_text.like(f"%{escaped}%", escape="\\"))
+
+    rows, total, next_cursor = keyset_paginate(
+        session,
+        stmt,
+        keys=(Payment.paid_at, Payment.id),
+        row_key=lambda row: (row[0].paid_at, row[0].id),
+        page=page,
+        page_size=page_size,
+        cursor=cursor,
+        with_total=with_total,
+    )
+
+    alloc_map = payment_service._allocated_sale_nos(session, [p.id for p, _, _ in rows])
+    items = [
+        {
             "occurred_at": _to_iso_z(p.paid_at),
             "payment_id": p.id,
             "customer_id": c.id,
             "customer_name": c.name,
             "method": p.method,
             "amount": p.amount,
-            "sale_nos": sale_nos,
+            "sale_nos": payment_service._merge_sale_nos(direct_sale_no, alloc_map.get(p.id, [])),
             "note": p.note,
         }
-        if qv:
-            hay = f"{row['customer_name']} {' '.join(row['sale_nos'])} {row.get('note') or ''}".lower()
-            if qv not in hay:
-                continue
-        raw.append(row)
-
-    total = len(raw)
-    items = raw[(page - 1) * page_size: page * page_size]
-    return items, total
\ No newline at end of file
+        for p, c, direct_sale_no in rows
+    ]
+    return items, total, next_cursor
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+_TMP_DIR = tempfile.mkdtemp(prefix="shop-tests-")
+
+# 必须在 import app.* 之前设置：配置在模块导入时读取
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP_DIR}/test.db"
+os.environ["EXPORT_DIR"] = os.path.join(_TMP_DIR, "exports")
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+@pytest.fixture(scope="session")
+def client():
+    """迁移到 head 的临时 SQLite 库 + TestClient"""
+    from alembic import command
+    from alembic.config import Config
+    from fastapi.testclient import TestClient
+
+    cfg = Config(str(BACKEND_DIR / "alembic.ini"))
+    cfg.set_main_option("script_location", str(BACKEND_DIR / "alembic"))
+    command.upgrade(cfg, "head")
+
+    from app.main import app
+
+    with TestClient(app) as c:
+        yield c
@@ -0,0 +1,54 @@
+"""批量销售单导出任务：按日期筛选（仅日期的 end_date 包含当天整天）"""
+
+import io
+import zipfile
+from datetime import timedelta
+
+from app.core.time import utc_now
+
+
+def _ok(resp):
+    assert resp.status_code < 300, (resp.status_code, resp.text)
+    return resp.json()
+
+
+def test_date_filtered_export_job(client):
+    customer = _ok(
+        client.post(
+            "/api/customers",
+            json={"type": "personal", "name": "导出客户", "contact_name": "赵六", "phone": "4", "address": "d"},
+        )
+    )
+    product = _ok(client.post("/api/products", json={"name": "导出商品", "standard_price": 10, "standard_cost": 5, "stock_quantity": 100}))
+    today = utc_now().replace(hour=12, minute=0, second=0, microsecond=0)
+    for sale_date in (today - timedelta(days=1), today, today.replace(hour=23, minute=30)):
+        _ok(
+            client.post(
+                "/api/sales",
+                json={
+                    "customer_id": customer["id"],
+                    "sale_date": sale_date.isoformat(),
+                    "items": [{"product_id": product["id"], "qty": 1, "unit_price": 10}],
+                },
+            )
+        )
+
+    day = today.date().isoformat()
+    job = _ok(
+        client.post(
+            "/api/sales/export_jobs",
+            json={"format": "xlsx", "customer_id": customer["id"], "start_date": day, "end_date": day},
+        )
+    )
+    job = _ok(client.get(f"/api/sales/export_jobs/{job['id']}"))
+    assert job["status"] == "done", job["error"]
+    assert job["total"] == 2
+
+    resp = client.get(f"/api/sales/export_jobs/{job['id']}/download")
+    assert resp.status_code == 200
+    assert len(zipfile.ZipFile(io.BytesIO(resp.content)).namelist()) == 2
+
+
+def test_export_job_rejects_bad_date(client):
+    resp = client.post("/api/sales/export_jobs", json={"format": "xlsx", "start_date": "2026-13-01"})
+    assert resp.status_code == 400
@@ -0,0 +1,80 @@
+"""Idempotency-Key：租约过期的占位只有在写操作确认未提交时才会被重试接管"""
+
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import update
+from sqlmodel import Session
+
+from app.core.time import utc_now
+from app.db.session import engine
+from app.models import IdempotencyKey
+from app.services import idempotency_service
+
+
+def _ok(resp):
+    assert resp.status_code < 300, (resp.status_code, resp.text)
+    return resp.json()
+
+
+@pytest.fixture(scope="module")
+def order(client):
+    customer = _ok(
+        client.post(
+            "/api/customers",
+            json={"type": "personal", "name": "幂等客户", "contact_name": "钱七", "phone": "5", "address": "e"},
+        )
+    )
+    product = _ok(client.post("/api/products", json={"name": "幂等商品", "standard_price": 10, "standard_cost": 5, "stock_quantity": 100}))
+    return {"customer_id": customer["id"], "items": [{"product_id": product["id"], "qty": 1, "unit_price": 10}]}
+
+
+def _expire_lease(key: str) -> str:
+    with Session(engine) as session:
+        session.exec(
+            update(IdempotencyKey).where(IdempotencyKey.key == key).values(locked_until=utc_now() - timedelta(seconds=1))
+        )
+        session.commit()
+        return session.exec(IdempotencyKey.__table__.select().where(IdempotencyKey.key == key)).one().status
+
+
+def _sale_count(client, customer_id: int) -> int:
+    return _ok(client.get("/api/sales", params={"customer_id": customer_id}))["total"]
+
+
+def test_crash_after_commit_is_not_rerun(client, order, monkeypatch):
+    def _crash(*args, **kwargs):
+        raise RuntimeError("进程在保存响应前退出")
+
+    headers = {"Idempotency-Key": "crash-after-commit"}
+    monkeypatch.setattr(idempotency_service, "_finish", _crash)
+    with pytest.raises(RuntimeError):
+        client.post("/api/sales", json=order, headers=headers)
+    monkeypatch.undo()
+
+    before = _sale_count(client, order["customer_id"])
+    assert _expire_lease("crash-after-commit") == "committed"
+    resp = client.post("/api/sales", json=order, headers=headers)
+    assert resp.status_code == 409
+    assert _sale_count(client, order["customer_id"]) == before
+
+
+def test_expired_uncommitted_key_is_taken_over(client, order, monkeypatch):
+    def _crash(*args, **kwargs):
+        raise RuntimeError("进程在写入前退出")
+
+    headers = {"Idempotency-Key": "crash-before-commit"}
+    # 模拟崩溃：占位已提交，写操作未提交，也没有机会释放 key
+    monkeypatch.setattr(idempotency_service, "_release", lambda *args: None)
+    monkeypatch.setattr("app.services.sale_service.create_sale", _crash)
+    with pytest.raises(RuntimeError):
+        client.post("/api/sales", json=order, headers=headers)
+    monkeypatch.undo()
+
+    assert client.post("/api/sales", json=order, headers=headers).status_code == 409
+    before = _sale_count(client, order["customer_id"])
+    assert _expire_lease("crash-before-commit") == "pending"
+    first = _ok(client.post("/api/sales", json=order, headers=headers))
+    again = _ok(client.post("/api/sales", json=order, headers=headers))
+    assert first["id"] == again["id"]
+    assert _sale_count(client, order["customer_id"]) == before + 1
@@ -0,0 +1,35 @@
+"""商品价格统计：按月分组在 Python 中按 UTC 日期计算，不依赖数据库日期函数"""
+
+import pytest
+
+pytest.importorskip("numpy")
+
+
+def _ok(resp):
+    assert resp.status_code < 300, (resp.status_code, resp.text)
+    return resp.json()
+
+
+def test_product_stats_by_month(client):
+    customer = _ok(
+        client.post(
+            "/api/customers",
+            json={"type": "personal", "name": "统计客户", "contact_name": "孙八", "phone": "6", "address": "f"},
+        )
+    )
+    product = _ok(client.post("/api/products", json={"name": "统计商品", "standard_price": 10, "standard_cost": 5, "stock_quantity": 100}))
+    for sale_date, price in (("2025-12-31T23:00:00Z", 10), ("2026-01-01T01:00:00+08:00", 12), ("2026-02-15T08:00:00Z", 14)):
+        _ok(
+            client.post(
+                "/api/sales",
+                json={
+                    "customer_id": customer["id"],
+                    "sale_date": sale_date,
+                    "items": [{"product_id": product["id"], "qty": 1, "unit_price": price}],
+                },
+            )
+        )
+
+    stats = _ok(client.get("/api/pricing/product_stats", params={"product_id": product["id"]}))
+    # +08:00 的 1 月 1 日 01:00 即 UTC 2025-12-31 17:00，归入 12 月
+    assert [(m["month"], m["count"], m["mean"]) for m in stats["by_month"]] == [("2025-12", 2, 11.0), ("2026-02", 1, 14.0)]
@@ -0,0 +1,108 @@
+"""热点接口的 SQL 条数：关系默认 lazy="raise"，各接口按需显式加载，条数不随明细/收款条数增长"""
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app.db.session import engine
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+
+
+def _ok(resp):
+    assert resp.status_code < 300, (resp.status_code, resp.text)
+    return resp.json()
+
+
+@pytest.fixture(scope="module")
+def data(client):
+    customer = _ok(
+        client.post(
+            "/api/customers",
+            json={"type": "personal", "name": "计数客户", "contact_name": "张三", "phone": "1", "address": "a"},
+        )
+    )
+    _ok(client.post(f"/api/customers/{customer['id']}/contacts", json={"name": "李四"}))
+    products = [
+        _ok(
+            client.post(
+                "/api/products",
+                json={"name": f"商品{i}", "standard_price": 10 + i, "standard_cost": 5, "stock_quantity": 100},
+            )
+        )
+        for i in range(5)
+    ]
+    sales = [
+        _ok(
+            client.post(
+                "/api/sales",
+                json={
+                    "customer_id": customer["id"],
+                    "items": [{"product_id": p["id"], "qty": 1, "unit_price": p["standard_price"]} for p in products],
+                },
+            )
+        )
+        for _ in range(3)
+    ]
+    for sale in sales:
+        _ok(client.post("/api/payments", json={"sale_id": sale["id"], "amount": 5, "method": "cash"}))
+        _ok(client.post("/api/payments", json={"sale_id": sale["id"], "amount": 5, "method": "cash"}))
+    _ok(
+        client.post(
+            f"/api/customers/{customer['id']}/payments/allocate",
+            json={"sale_ids": [s["id"] for s in sales], "amount": 30, "method": "cash"},
+        )
+    )
+    return {"customer": customer, "products": products, "sales": sales}
+
+
+def _assert_queries(client, expected, method, url, **kwargs):
+    with count_queries() as statements:
+        resp = client.request(method, url, **kwargs)
+    assert resp.status_code < 300, (resp.status_code, resp.text)
+    assert len(statements) == expected, "\n".join(statements)
+
+
+def test_get_sale(client, data):
+    _assert_queries(client, 2, "GET", f"/api/sales/{data['sales'][0]['id']}")
+
+
+def test_list_sales(client, data):
+    _assert_queries(client, 2, "GET", "/api/sales", params={"page": 1, "page_size": 20})
+
+
+def test_list_products(client, data):
+    _assert_queries(client, 2, "GET", "/api/products", params={"page": 1, "page_size": 20})
+
+
+def test_list_customers(client, data):
+    _assert_queries(client, 2, "GET", "/api/customers", params={"page": 1, "page_size": 20})
+
+
+def test_get_customer(client, data):
+    _assert_queries(client, 1, "GET", f"/api/customers/{data['customer']['id']}")
+
+
+def test_customer_statement(client, data):
+    _assert_queries(client, 4, "GET", f"/api/customers/{data['customer']['id']}/statement")
+
+
+def test_create_payment(client, data):
+    _assert_queries(client, 8, "POST", "/api/payments", json={"sale_id": data["sales"][2]["id"], "amount": 1, "method": "cash"})
+
+
+def test_export_sale_excel(client, data):
+    _assert_queries(client, 6, "GET", f"/api/sales/{data['sales'][0]['id']}/export_excel")
@@ -0,0 +1,44 @@
+"""号段模式（SALE_NO_BLOCK_SIZE > 1）下的开单：号段在调用方写入前预占，批量开单不会锁等自身事务"""
+
+import pytest
+
+from app.services import sale_service
+
+
+def _ok(resp):
+    assert resp.status_code < 300, (resp.status_code, resp.text)
+    return resp.json()
+
+
+@pytest.fixture
+def block_mode(monkeypatch):
+    monkeypatch.setattr(sale_service, "SALE_NO_BLOCK_SIZE", 3)
+    monkeypatch.setattr(sale_service, "_seq_blocks", {})
+
+
+@pytest.fixture(scope="module")
+def order(client):
+    customer = _ok(
+        client.post(
+            "/api/customers",
+            json={"type": "personal", "name": "号段客户", "contact_name": "王五", "phone": "3", "address": "c"},
+        )
+    )
+    product = _ok(client.post("/api/products", json={"name": "号段商品", "standard_price": 10, "standard_cost": 5, "stock_quantity": 1000}))
+    return {"customer_id": customer["id"], "items": [{"product_id": product["id"], "qty": 1, "unit_price": 10}]}
+
+
+def test_batch_with_block_size(client, order, block_mode):
+    manual = dict(order, sale_no="SO20991231-0001")
+    resp = client.post("/api/sales/batch", json={"orders": [order] * 4 + [manual] + [order] * 4})
+    body = _ok(resp)
+    assert body["created"] == 9 and body["failed"] == 0
+    sale_nos = [r["sale_no"] for r in body["results"]]
+    assert len(set(sale_nos)) == len(sale_nos)
+    assert sale_nos[4] == "SO20991231-0001"
+
+
+def test_single_sales_with_block_size(client, order, block_mode):
+    sale_nos = [_ok(client.post("/api/sales", json=order))["sale_no"] for _ in range(7)]
+    assert len(set(sale_nos)) == len(sale_nos)
+    assert sale_nos == sorted(sale_nos)
@@ -0,0 +1,51 @@
+"""对账单导出：客户与日期在流式输出前校验，仅日期的 end_date 包含当天整天"""
+
+import pytest
+
+
+def _ok(resp):
+    assert resp.status_code < 300, (resp.status_code, resp.text)
+    return resp
+
+
+@pytest.fixture(scope="module")
+def customer(client):
+    customer = _ok(
+        client.post(
+            "/api/customers",
+            json={"type": "personal", "name": "对账客户", "contact_name": "周九", "phone": "7", "address": "g"},
+        )
+    ).json()
+    product = _ok(client.post("/api/products", json={"name": "对账商品", "standard_price": 10, "standard_cost": 5, "stock_quantity": 100})).json()
+    _ok(
+        client.post(
+            "/api/sales",
+            json={
+                "customer_id": customer["id"],
+                "sale_date": "2026-03-31T18:00:00Z",
+                "items": [{"product_id": product["id"], "qty": 1, "unit_price": 10}],
+            },
+        )
+    )
+    return customer
+
+
+@pytest.mark.parametrize("fmt", ["csv", "xlsx"])
+def test_export_rejects_bad_date(client, customer, fmt):
+    resp = client.get(f"/api/customers/{customer['id']}/statement/export", params={"format": fmt, "start_date": "2026-02-30"})
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("fmt", ["csv", "xlsx"])
+def test_export_unknown_customer(client, fmt):
+    assert client.get("/api/customers/999999/statement/export", params={"format": fmt}).status_code == 404
+
+
+def test_export_end_date_includes_whole_day(client, customer):
+    resp = _ok(
+        client.get(
+            f"/api/customers/{customer['id']}/statement/export",
+            params={"start_date": "2026-03-01", "end_date": "2026-03-31"},
+        )
+    )
+    assert len(resp.text.strip().splitlines()) == 2